@@ -1,15 +1,54 @@
-import logging
+"""
+Auditoría asíncrona y por lotes.
+
+`log_audit` solo arma un dict y lo encola: no serializa ni escribe en el camino
+de la solicitud.
+
+    log_audit -> logger "audit" -> AuditQueueHandler (cola acotada en memoria)
+              -> QueueListener (hilo) -> lote en memoria
+              -> AuditPipeline.run (tarea de fondo) -> insert_many en `audit_events` (capped)
+
+Si la cola se llena, AUDIT_BACKPRESSURE decide: "drop_newest" descarta el evento
+nuevo, "drop_oldest" el más viejo de la cola y "block" espera hasta
+AUDIT_BLOCK_TIMEOUT_MS (frena el event loop mientras tanto) y después lo descarta.
+Los descartes se cuentan en `audit_events_total{result="dropped"}`.
+"""
+
+from collections import deque
+from datetime import datetime
+from enum import Enum
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import asyncio
 import json
+import logging
+import queue
+
 from fastapi import Request
-from enum import Enum
-from datetime import datetime
+from prometheus_client import Counter
+
+from config import settings
+from database import get_collection
+
+logger = logging.getLogger(__name__)
 
-# Configura un logger específico para auditoría
+# Logger específico para auditoría (no se propaga al logging general)
 audit_log = logging.getLogger("audit")
+audit_log.setLevel(logging.INFO)
+audit_log.propagate = False
+
+AUDIT_COLLECTION = "audit_events"
+
+AUDIT_EVENTS = Counter(
+    "audit_events_total",
+    "Eventos de auditoría por resultado",
+    ["result"],
+)
+EVENTS_ENQUEUED = AUDIT_EVENTS.labels("enqueued")
+EVENTS_DROPPED = AUDIT_EVENTS.labels("dropped")
+EVENTS_INSERTED = AUDIT_EVENTS.labels("inserted")
+EVENTS_FAILED = AUDIT_EVENTS.labels("failed")
 
-if not audit_log.handlers:
-    audit_log.addHandler(logging.StreamHandler())
-    audit_log.setLevel(logging.INFO)
 
 class AuditEvent(str, Enum):
     USER_LOGIN_SUCCESS = "USER_LOGIN_SUCCESS"
@@ -18,11 +57,125 @@ class AuditEvent(str, Enum):
     ORDER_CREATED = "ORDER_CREATED"
     ORDER_STATUS_CHANGED = "ORDER_STATUS_CHANGED"
     PAYMENT_WEBHOOK_RECEIVED = "PAYMENT_WEBHOOK_RECEIVED"
+    PAYMENT_CONFLICT = "PAYMENT_CONFLICT"
+
+
+class AuditQueueHandler(QueueHandler):
+    """Encola el registro tal cual (sin formatearlo) aplicando la política de contrapresión."""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        policy = settings.AUDIT_BACKPRESSURE
+        try:
+            if policy == "block":
+                self.queue.put(record, timeout=settings.AUDIT_BLOCK_TIMEOUT_MS / 1000)
+            else:
+                self.queue.put_nowait(record)
+            EVENTS_ENQUEUED.inc()
+            return
+        except queue.Full:
+            pass
 
-def log_audit(event: AuditEvent, request: Request, details: dict):
+        if policy == "drop_oldest":
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+                EVENTS_ENQUEUED.inc()
+            except (queue.Empty, queue.Full):
+                pass
+        EVENTS_DROPPED.inc()
+
+
+class AuditJSONFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.audit, ensure_ascii=False, default=str)
+
+
+class AuditBatchHandler(logging.Handler):
+    """Corre en el hilo del QueueListener: pasa cada evento al lote del pipeline."""
+
+    def __init__(self, pipeline: "AuditPipeline"):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def emit(self, record):
+        self.pipeline.add_to_batch(record.audit)
+
+
+class AuditPipeline:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+        self.handler = AuditQueueHandler(self.queue)
+        # Eventos ya drenados de la cola y pendientes de insertar
+        self._batch = deque()
+        self._listener: Optional[QueueListener] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._flush_requested = asyncio.Event()
+        handlers = [AuditBatchHandler(self)]
+        if settings.AUDIT_STDOUT_ENABLED:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(AuditJSONFormatter())
+            handlers.append(stream_handler)
+        self._listener = QueueListener(self.queue, *handlers)
+        self._listener.start()
+        logger.info(f"📝 Auditoría asíncrona activa (cola de {settings.AUDIT_QUEUE_SIZE}, política: {settings.AUDIT_BACKPRESSURE}).")
+
+    def add_to_batch(self, event: dict) -> None:
+        if len(self._batch) >= settings.AUDIT_QUEUE_SIZE:
+            # MongoDB no da abasto: se descarta el evento más viejo del lote
+            self._batch.popleft()
+            EVENTS_DROPPED.inc()
+        self._batch.append(event)
+        if len(self._batch) >= settings.AUDIT_BATCH_SIZE and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._flush_requested.set)
+
+    async def run(self) -> None:
+        """Tarea de fondo: inserta un lote al juntar AUDIT_BATCH_SIZE eventos o cada AUDIT_FLUSH_INTERVAL_SECONDS."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=settings.AUDIT_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._batch:
+            batch = [self._batch.popleft() for _ in range(min(len(self._batch), settings.AUDIT_BATCH_SIZE))]
+            try:
+                await get_collection(AUDIT_COLLECTION).insert_many(batch, ordered=False)
+                EVENTS_INSERTED.inc(len(batch))
+            except Exception as e:
+                EVENTS_FAILED.inc(len(batch))
+                logger.error(f"❌ No se pudieron guardar {len(batch)} eventos de auditoría: {e}")
+
+    async def stop(self) -> None:
+        """Drena la cola y guarda lo pendiente."""
+        if self._listener:
+            try:
+                self._listener.stop()
+            except queue.Full:
+                logger.warning("⚠️ Cola de auditoría llena al cerrar; los eventos sin drenar se pierden.")
+            self._listener = None
+        await self.flush()
+
+
+audit_pipeline = AuditPipeline()
+audit_log.addHandler(audit_pipeline.handler)
+
+
+def log_audit(event: AuditEvent, request: Optional[Request], details: dict):
     """
-    Registra un evento de auditoría en formato JSON.
+    Registra un evento de auditoría. Solo lo encola; se guarda en `audit_events` en segundo plano.
     """
+    if not settings.AUDIT_ENABLED:
+        return
     client_ip = "N/A"
     method = "N/A"
     path = "N/A"
@@ -33,13 +186,11 @@ def log_audit(event: AuditEvent, request: Request, details: dict):
         method = request.method
         path = request.url.path
 
-    log_data = {
+    audit_log.info(event.value, extra={"audit": {
         "event": event.value,
         "client_ip": client_ip,
         "method": method,
         "path": path,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": datetime.utcnow(),
         "details": details
-    }
-
-    audit_log.info(json.dumps(log_data, ensure_ascii=False))
+    }})
@@ -0,0 +1,75 @@
+"""
+Caché en memoria (por proceso) para lecturas del catálogo.
+Pensada para datos que toleran algunos segundos de desactualización
+(listados, rankings, recomendaciones) y que se leen mucho más de lo que cambian.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import time
+
+from config import settings
+
+
+class TTLCache:
+    """
+    Caché clave/valor con expiración por tiempo y tamaño máximo.
+    `get_or_load` evita que varias peticiones concurrentes recalculen la misma
+    clave a la vez (solo una ejecuta el loader, el resto espera su resultado).
+    """
+
+    def __init__(self, ttl_seconds: float, maxsize: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Devuelve el valor si existe y no expiró; si no, None."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """Guarda un valor. Si se supera el tamaño máximo, descarta la entrada más antigua."""
+        if len(self._data) >= self.maxsize and key not in self._data:
+            oldest_key = min(self._data, key=lambda k: self._data[k][0])
+            self._data.pop(oldest_key, None)
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], ttl_seconds: Optional[float] = None) -> Any:
+        """Devuelve el valor cacheado o lo calcula con `loader` (una sola vez por clave)."""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            value = self.get(key)
+            if value is None:
+                value = await loader()
+                self.set(key, value, ttl_seconds)
+        self._locks.pop(key, None)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Invalida una clave, o toda la caché si no se indica ninguna."""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def invalidate_prefix(self, prefix: Tuple) -> None:
+        """Invalida todas las claves (tuplas) que empiezan con `prefix`."""
+        for key in [k for k in self._data if isinstance(k, tuple) and k[:len(prefix)] == prefix]:
+            self._data.pop(key, None)
+
+
+# Instancia compartida del catálogo
+catalog_cache = TTLCache(ttl_seconds=settings.CATALOG_CACHE_TTL_SECONDS, maxsize=settings.CATALOG_CACHE_MAXSIZE)
@@ -12,6 +12,29 @@ class Settings(BaseSettings):
     # MongoDB
     DATABASE_URL: str
     DATABASE_NAME: str
+    # Pool de conexiones (por proceso)
+    MONGO_MIN_POOL_SIZE: int = 10
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = 300000
+    # Cuánto espera una operación por una conexión libre del pool (None = sin límite)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = 5000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 10000
+    MONGO_CONNECT_TIMEOUT_MS: int = 10000
+    MONGO_SOCKET_TIMEOUT_MS: Optional[int] = 30000
+    # Compresión de red, en orden de preferencia; vacío = sin compresión.
+    # zlib no necesita paquetes extra. zstd y snappy son opcionales: instalar `zstandard`
+    # o `python-snappy` y agregarlos adelante (ej. "zstd,zlib"); sin el paquete, el driver los descarta
+    MONGO_COMPRESSORS: str = "zlib"
+    MONGO_ZLIB_COMPRESSION_LEVEL: int = 6
+    MONGO_READ_PREFERENCE: str = "primary"
+    MONGO_APP_NAME: str = "EscabiAPI"
+    # Abrir las MONGO_MIN_POOL_SIZE conexiones al arrancar, antes de recibir tráfico
+    MONGO_WARM_UP_POOL: bool = True
+    # Lecturas del catálogo y de los reportes del admin (pueden ir a secundarios)
+    CATALOG_READ_PREFERENCE: str = "secondaryPreferred"
+    REPORTING_READ_PREFERENCE: str = "secondaryPreferred"
+    # Desfase máximo tolerado de un secundario (mínimo 90 s según el driver; -1 = sin límite)
+    MONGO_MAX_STALENESS_SECONDS: int = 90
 
     # --- NUEVA VARIABLE PARA REDIS ---
     REDIS_URL: str = "redis://localhost:6379"
@@ -22,6 +45,12 @@ class Settings(BaseSettings):
     MERCADOPAGO_PUBLIC_KEY: Optional[str] = None
     MERCADOPAGO_WEBHOOK_SECRET: Optional[str] = None  # Para validar firma de webhooks
     
+    # API de Mercado Pago (se puede apuntar a scripts/fake_mercadopago.py en desarrollo)
+    MERCADOPAGO_API_BASE_URL: str = "https://api.mercadopago.com"
+    MERCADOPAGO_TIMEOUT_SECONDS: float = 10.0
+    # Máximo de llamadas simultáneas a la API de MP por proceso
+    MERCADOPAGO_MAX_CONCURRENCY: int = 5
+    
     # URL base para tus webhooks (importante para desarrollo y producción)
     # En desarrollo usaremos ngrok, en producción será tu dominio
     WEBHOOK_BASE_URL: str = "http://localhost:8000"
@@ -29,6 +58,130 @@ class Settings(BaseSettings):
     # URL del frontend para redirecciones después del pago
     FRONTEND_URL: str = "http://localhost:3000"
 
+    # Preferencias de pago: vigencia en Mercado Pago y margen mínimo para reutilizar una guardada
+    PAYMENT_PREFERENCE_TTL_MINUTES: int = 60
+    PAYMENT_PREFERENCE_MIN_REMAINING_MINUTES: int = 5
+
+    # Exportaciones (tamaño de lote de los cursores en streaming)
+    EXPORT_BATCH_SIZE: int = 1000
+
+    # Caché del catálogo (en memoria, por proceso)
+    CATALOG_CACHE_TTL_SECONDS: int = 60
+    CATALOG_CACHE_MAXSIZE: int = 1024
+
+    # Estadísticas precalculadas de productos (más vendidos / comprados juntos)
+    # Solo se procesan pedidos creados hace más de estas horas (ya pagados o cancelados)
+    PRODUCT_STATS_SETTLE_HOURS: int = 24
+    # Intervalo del job dentro de la app; 0 lo deshabilita (usar scripts/compute_product_stats.py)
+    PRODUCT_STATS_INTERVAL_MINUTES: int = 0
+    # Lease del job (se renueva en cada volcado): con varias réplicas o workers, solo uno procesa
+    PRODUCT_STATS_LEASE_SECONDS: int = 600
+
+    # Detector de bajo stock: "auto" (change stream si hay replica set, si no hook en la app),
+    # "change_stream", "events" u "off"
+    INVENTORY_ALERTS_MODE: str = "auto"
+    # Días que se conservan las alertas resueltas antes de que el índice TTL las borre
+    INVENTORY_ALERTS_RETENTION_DAYS: int = 30
+
+    # Guardia de consultas de los listados de administración
+    # "reject": rechaza ordenamientos sin índice (400); "rewrite": usa el orden por defecto
+    QUERY_GUARD_MODE: str = "reject"
+    # Ejecuta explain() y falla ante COLLSCAN o SORT en memoria (solo para desarrollo)
+    QUERY_GUARD_EXPLAIN: bool = False
+
+    # Sweeper de pedidos pendientes sin pagar (libera el stock retenido)
+    SWEEPER_ENABLED: bool = True
+    PENDING_ORDER_EXPIRY_MINUTES: int = 60
+    SWEEPER_INTERVAL_SECONDS: int = 300
+    SWEEPER_BATCH_SIZE: int = 200
+    # Vencimiento del lease: si el worker muere, otro puede tomar el sweeper pasado este tiempo
+    SWEEPER_LEASE_SECONDS: int = 120
+
+    # Stock repartido en shards (opcional por producto, para ventas flash)
+    # Cada cuánto se actualiza el total cacheado en products.stock; 0 deshabilita el refresco en la app
+    STOCK_SHARDS_REFRESH_SECONDS: int = 5
+    STOCK_SHARDS_MAX: int = 64
+
+    # Reservas de stock al agregar al carrito (opcional)
+    CART_RESERVATIONS_ENABLED: bool = False
+    # Duración de la reserva; cada acción sobre el carrito la renueva
+    CART_HOLD_MINUTES: int = 15
+    # Caché de los totales reservados por producto para los listados
+    CART_HOLDS_CACHE_SECONDS: int = 5
+
+    # Idempotency-Key (POST /orders/ y creación de preferencias de pago)
+    IDEMPOTENCY_TTL_HOURS: int = 24
+    # Cuánto espera un reintento a que termine la solicitud original
+    IDEMPOTENCY_WAIT_SECONDS: int = 10
+    # Si la solicitud original no terminó en este tiempo (proceso caído), otra puede retomarla
+    IDEMPOTENCY_LOCK_SECONDS: int = 30
+
+    # Conciliación de pagos (pedidos pendientes cuyo webhook no llegó)
+    PAYMENT_RECONCILE_ENABLED: bool = True
+    PAYMENT_RECONCILE_INTERVAL_SECONDS: int = 60
+    PAYMENT_RECONCILE_BATCH_SIZE: int = 100
+    PAYMENT_RECONCILE_LEASE_SECONDS: int = 120
+    # Pedidos más viejos que esto ya no se consultan
+    PAYMENT_RECONCILE_MAX_AGE_HOURS: int = 72
+
+    # Índices declarados en index_registry.py: crear los faltantes al arrancar.
+    # En segundo plano no demora el arranque (las consultas pueden ir sin índice hasta que terminen)
+    ENSURE_INDEXES_ON_STARTUP: bool = True
+    ENSURE_INDEXES_IN_BACKGROUND: bool = True
+
+    # Instrumentación de MongoDB (métricas por colección/comando/ruta, log de lentos, explain muestreado)
+    DB_MONITORING_ENABLED: bool = True
+    DB_SLOW_COMMAND_MS: int = 100
+    DB_SLOW_LOG_SIZE: int = 200
+    # Fracción de lecturas (find/aggregate/count/distinct) a las que se les hace explain; 0 = desactivado.
+    # Cada muestra vuelve a ejecutar la consulta con executionStats: activarlo solo para diagnosticar
+    DB_EXPLAIN_SAMPLE_RATE: float = 0.0
+    # Endpoint /metrics para Prometheus
+    METRICS_ENABLED: bool = True
+    # Métricas HTTP por ruta (latencia, en curso, códigos de estado, tamaño de respuesta)
+    HTTP_METRICS_ENABLED: bool = True
+
+    # Monitor del event loop: lag, bloqueos con stack capturado (opt-in)
+    LOOP_MONITOR_ENABLED: bool = False
+    LOOP_MONITOR_INTERVAL_MS: int = 50
+    LOOP_BLOCK_THRESHOLD_MS: int = 100
+    LOOP_BLOCK_LOG_SIZE: int = 100
+    # Modo para pruebas: la solicitud que bloquea el loop más que LOOP_BLOCK_THRESHOLD_MS falla
+    LOOP_MONITOR_STRICT: bool = False
+
+    # Perfilado a pedido (header X-Profile con token de admin), guardado en una colección capped
+    PROFILING_ENABLED: bool = True
+    PROFILING_INTERVAL_MS: float = 1.0
+    PROFILE_STORE_MAX_BYTES: int = 50 * 1024 * 1024
+    PROFILE_STORE_MAX_DOCUMENTS: int = 500
+
+    # Trazas distribuidas (W3C traceparent) de solicitudes, MongoDB, Redis y Mercado Pago
+    TRACING_ENABLED: bool = False
+    TRACING_SERVICE_NAME: str = "escabiapi"
+    TRACING_SAMPLE_RATE: float = 0.01
+    # Tasas por prefijo de ruta, ej. "/payments=1.0,/orders=0.2"
+    TRACING_ROUTE_SAMPLE_RATES: str = ""
+    # Respetar la decisión de muestreo del traceparent entrante
+    TRACING_RESPECT_PARENT_SAMPLED: bool = True
+    TRACING_EXPORTER: str = "file"  # "file" (JSON lines) u "otlp" (OTLP/HTTP JSON)
+    TRACING_FILE_PATH: str = "traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_EXPORT_INTERVAL_SECONDS: float = 2.0
+    TRACING_EXPORT_BATCH_SIZE: int = 512
+    TRACING_MAX_QUEUE_SIZE: int = 10000
+
+    # Auditoría: cola acotada en memoria -> QueueListener -> inserts por lotes en audit_events (capped)
+    AUDIT_ENABLED: bool = True
+    AUDIT_QUEUE_SIZE: int = 10000
+    # Con la cola llena: "drop_newest", "drop_oldest" o "block" (espera AUDIT_BLOCK_TIMEOUT_MS, frena el event loop)
+    AUDIT_BACKPRESSURE: str = "drop_newest"
+    AUDIT_BLOCK_TIMEOUT_MS: int = 50
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 1.0
+    AUDIT_STORE_MAX_BYTES: int = 256 * 1024 * 1024
+    # Además escribir cada evento como JSON en stdout (desde el hilo del listener)
+    AUDIT_STDOUT_ENABLED: bool = False
+
     # Entorno
     ENV: str = "development"
 
@@ -39,6 +192,47 @@ class Settings(BaseSettings):
             raise ValueError(f"ENV debe ser uno de: {allowed}")
         return v
 
+    @field_validator("MONGO_READ_PREFERENCE", "CATALOG_READ_PREFERENCE", "REPORTING_READ_PREFERENCE")
+    def validate_mongo_read_preference(cls, v, info):
+        allowed = {"primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"}
+        if v not in allowed:
+            raise ValueError(f"{info.field_name} debe ser uno de: {allowed}")
+        return v
+
+    @field_validator("MONGO_MAX_STALENESS_SECONDS")
+    def validate_mongo_max_staleness(cls, v):
+        if v != -1 and v < 90:
+            raise ValueError("MONGO_MAX_STALENESS_SECONDS debe ser -1 o al menos 90")
+        return v
+
+    @field_validator("TRACING_EXPORTER")
+    def validate_tracing_exporter(cls, v):
+        allowed = {"file", "otlp"}
+        if v not in allowed:
+            raise ValueError(f"TRACING_EXPORTER debe ser uno de: {allowed}")
+        return v
+
+    @field_validator("AUDIT_BACKPRESSURE")
+    def validate_audit_backpressure(cls, v):
+        allowed = {"drop_newest", "drop_oldest", "block"}
+        if v not in allowed:
+            raise ValueError(f"AUDIT_BACKPRESSURE debe ser uno de: {allowed}")
+        return v
+
+    @field_validator("QUERY_GUARD_MODE")
+    def validate_query_guard_mode(cls, v):
+        allowed = {"reject", "rewrite"}
+        if v not in allowed:
+            raise ValueError(f"QUERY_GUARD_MODE debe ser uno de: {allowed}")
+        return v
+
+    @field_validator("INVENTORY_ALERTS_MODE")
+    def validate_inventory_alerts_mode(cls, v):
+        allowed = {"auto", "change_stream", "events", "off"}
+        if v not in allowed:
+            raise ValueError(f"INVENTORY_ALERTS_MODE debe ser uno de: {allowed}")
+        return v
+
     model_config = SettingsConfigDict(
         env_file=".env",
         extra="allow"
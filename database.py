@@ -1,6 +1,14 @@
+import asyncio
 import logging
+import time
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.errors import CollectionInvalid
+from pymongo.write_concern import WriteConcern
 from config import settings
+from db_monitoring import db_command_monitor
+from tracing import tracing_command_listener
 
 logger = logging.getLogger(__name__)
 
@@ -10,19 +18,68 @@ class Database:
 
 db = Database()
 
+def client_options() -> dict:
+    """
+    Opciones del cliente de MongoDB (pool, timeouts, compresión, read preference)
+    a partir de la configuración. Tienen prioridad sobre las de DATABASE_URL.
+    """
+    options = {
+        "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+        "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+        "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "readPreference": settings.MONGO_READ_PREFERENCE,
+        "appname": settings.MONGO_APP_NAME,
+    }
+    listeners = []
+    if settings.DB_MONITORING_ENABLED:
+        listeners.append(db_command_monitor)
+    if settings.TRACING_ENABLED:
+        listeners.append(tracing_command_listener)
+    if listeners:
+        options["event_listeners"] = listeners
+    # El driver descarta (con un warning) los compresores cuyo paquete no está instalado
+    compressors = [name.strip() for name in settings.MONGO_COMPRESSORS.split(",") if name.strip()]
+    if compressors:
+        options["compressors"] = compressors
+        if "zlib" in compressors:
+            options["zlibCompressionLevel"] = settings.MONGO_ZLIB_COMPRESSION_LEVEL
+    return options
+
 async def connect_db():
     """
     Establece la conexión a MongoDB y valida con un ping.
     """
     try:
-        db.client = AsyncIOMotorClient(settings.DATABASE_URL)
+        db.client = AsyncIOMotorClient(settings.DATABASE_URL, **client_options())
         db.db = db.client[settings.DATABASE_NAME]
+        db_command_monitor.attach(asyncio.get_running_loop(), db.db)
         await db.client.admin.command("ping")
         logger.info(f"✅ Conectado a MongoDB: {settings.DATABASE_URL}/{settings.DATABASE_NAME}")
     except Exception as e:
         logger.error(f"❌ Error al conectar con MongoDB: {e}")
         raise RuntimeError("No se pudo establecer conexión con MongoDB.") from e
 
+async def warm_up_pool(connections: int | None = None) -> float:
+    """
+    Abre conexiones del pool antes de recibir tráfico lanzando pings concurrentes
+    (cada uno necesita su propia conexión), para que las primeras solicitudes no
+    paguen el handshake TCP/TLS y la autenticación. Devuelve la duración en ms.
+    """
+    if db.client is None:
+        raise RuntimeError("La base de datos no está conectada. Asegúrate de llamar a connect_db() en el startup.")
+    connections = settings.MONGO_MIN_POOL_SIZE if connections is None else connections
+    if connections <= 0:
+        return 0.0
+    started = time.perf_counter()
+    await asyncio.gather(*(db.client.admin.command("ping") for _ in range(connections)))
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"🔥 Pool de MongoDB precalentado ({connections} conexiones) en {elapsed_ms:.0f} ms.")
+    return elapsed_ms
+
 async def close_db():
     """
     Cierra la conexión a MongoDB.
@@ -44,3 +101,73 @@ async def get_database() -> AsyncIOMotorDatabase:
         raise RuntimeError("La base de datos no está conectada. Asegúrate de llamar a connect_db() en el startup.")
     return db.db
 
+async def ensure_capped_collection(collection_name: str, size_bytes: int, max_documents: int | None = None):
+    """
+    Crea la colección como capped (tamaño fijo, descarta lo más viejo) si todavía
+    no existe. Una colección existente no se convierte.
+    """
+    database = await get_database()
+    if await database.list_collection_names(filter={"name": collection_name}):
+        return
+    options = {"capped": True, "size": size_bytes}
+    if max_documents:
+        options["max"] = max_documents
+    try:
+        await database.create_collection(collection_name, **options)
+        logger.info(f"🗃️ Colección capped '{collection_name}' creada ({size_bytes} bytes).")
+    except CollectionInvalid:
+        pass  # Otro worker la creó entre medio
+
+
+# --- Enrutamiento de lecturas ---
+# Perfiles de lectura que toleran datos algo desactualizados y pueden ir a los
+# secundarios del replica set (con un límite de desfase, maxStalenessSeconds).
+READ_PROFILES = {
+    "catalog": lambda: settings.CATALOG_READ_PREFERENCE,      # navegación anónima del catálogo
+    "reporting": lambda: settings.REPORTING_READ_PREFERENCE,  # estadísticas y exportaciones del admin
+}
+
+_READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def read_preference_for(profile: str):
+    """Read preference configurada para un perfil de lectura."""
+    mode_name = READ_PROFILES[profile]()
+    if mode_name == "primary":
+        return Primary()  # maxStalenessSeconds no se admite con "primary"
+    return _READ_PREFERENCES[mode_name](max_staleness=settings.MONGO_MAX_STALENESS_SECONDS)
+
+def get_read_collection(collection_name: str, profile: str):
+    """
+    Obtiene una colección para lecturas del perfil indicado ("catalog" o "reporting").
+    Solo para lecturas: las escrituras siempre van al primario.
+    """
+    return get_collection(collection_name).with_options(read_preference=read_preference_for(profile))
+
+# --- Lecturas de las propias escrituras (carrito -> pedido -> pago) ---
+
+def get_consistent_collection(collection_name: str):
+    """
+    Colección con read/write concern "majority" y lecturas en el primario: junto con
+    una sesión causal garantiza que el usuario lea sus propias escrituras incluso si
+    hay un cambio de primario entre medio.
+    """
+    return get_collection(collection_name).with_options(
+        read_concern=ReadConcern("majority"),
+        write_concern=WriteConcern("majority")
+    )
+
+async def get_causal_session():
+    """
+    Dependencia de FastAPI: sesión de MongoDB con consistencia causal para la
+    solicitud. Las operaciones que reciben `session=` ven las escrituras previas
+    de la misma sesión aunque se lean de otro miembro del replica set.
+    """
+    if db.client is None:
+        raise RuntimeError("La base de datos no está conectada. Asegúrate de llamar a connect_db() en el startup.")
+    async with await db.client.start_session(causal_consistency=True) as session:
+        yield session
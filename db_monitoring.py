@@ -0,0 +1,335 @@
+"""
+Instrumentación de los comandos de MongoDB.
+
+Un `CommandListener` de PyMongo (registrado por database.connect_db) mide cada
+comando y lo etiqueta con la colección, el nombre del comando y la ruta de la
+API que lo originó (`current_route`, la fija el middleware de main.py). Con eso:
+
+- Histogramas de latencia en Prometheus (`mongodb_command_duration_seconds`) y
+  agregados en memoria para el diagnóstico del admin.
+- Log de comandos lentos (más de DB_SLOW_COMMAND_MS) con el filtro redactado:
+  se conservan los campos y operadores pero no los valores.
+- `explain` muestreado (DB_EXPLAIN_SAMPLE_RATE, desactivado por defecto) de las
+  lecturas, que informa documentos examinados vs. devueltos y si el plan usó COLLSCAN.
+
+Los agregados, el log de lentos y los explain viven en la memoria de cada proceso:
+con varios workers de gunicorn, el diagnóstico del admin muestra solo el worker
+que atendió la solicitud (indicado en `process`). Los histogramas de /metrics sí
+se agregan entre workers.
+
+El listener corre en los hilos del executor de Motor (que propaga los
+contextvars), así que no hace I/O: los explain se programan en el event loop.
+"""
+
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+import asyncio
+import logging
+import os
+import random
+import socket
+import threading
+
+from pymongo import monitoring
+from prometheus_client import Counter, Histogram
+from starlette.routing import Match
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ruta (plantilla, ej. "/products/{product_id}") de la solicitud en curso
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+
+# Comandos sin colección o internos del driver que no se miden
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildInfo", "saslStart", "saslContinue",
+    "endSessions", "killCursors", "explain", "listIndexes", "collStats", "serverStatus",
+}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# Campos que agrega el driver y que no se pueden reenviar dentro de un explain
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction", "readConcern", "apiVersion"}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds",
+    "Duración de los comandos de MongoDB",
+    ["collection", "command", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+COMMAND_FAILURES = Counter(
+    "mongodb_command_failures_total",
+    "Comandos de MongoDB que fallaron",
+    ["collection", "command", "route"],
+)
+EXPLAIN_DOCS_EXAMINED = Counter(
+    "mongodb_explain_docs_examined_total",
+    "Documentos examinados en los explain muestreados",
+    ["collection", "command", "route"],
+)
+EXPLAIN_DOCS_RETURNED = Counter(
+    "mongodb_explain_docs_returned_total",
+    "Documentos devueltos en los explain muestreados",
+    ["collection", "command", "route"],
+)
+EXPLAIN_COLLSCANS = Counter(
+    "mongodb_explain_collscan_total",
+    "Explain muestreados cuyo plan usó COLLSCAN",
+    ["collection", "command", "route"],
+)
+
+
+def command_collection(command_name: str, command: dict) -> Optional[str]:
+    """Colección sobre la que opera un comando (None si no aplica)."""
+    if command_name == "getMore":
+        return command.get("collection")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else None
+
+
+def command_filter(command_name: str, command: dict):
+    """Filtro (o pipeline) del comando, para el log de lentos."""
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "aggregate":
+        return command.get("pipeline", [])
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or []
+        return statements[0].get("q", {}) if statements else {}
+    return None
+
+
+def redact(value):
+    """Reemplaza los valores por '?' conservando campos y operadores."""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value[:3]] + (["..."] if len(value) > 3 else [])
+    return "?"
+
+
+def _find_execution_stats(explain: dict) -> Optional[dict]:
+    """executionStats de un explain de find/count o de la etapa $cursor de un aggregate."""
+    if "executionStats" in explain:
+        return explain["executionStats"]
+    for stage in explain.get("stages", []):
+        cursor_stage = stage.get("$cursor")
+        if cursor_stage and "executionStats" in cursor_stage:
+            return cursor_stage["executionStats"]
+    return None
+
+
+class _CommandStats:
+    __slots__ = ("count", "failures", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, duration_ms: float) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if duration_ms <= bound * 1000:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Cota superior (en ms) del bucket que contiene el percentil."""
+        target = fraction * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                return LATENCY_BUCKETS[i] * 1000 if i < len(LATENCY_BUCKETS) else None
+        return None
+
+
+class DBCommandMonitor(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stats = defaultdict(_CommandStats)
+        self._explains = defaultdict(lambda: {"samples": 0, "docs_examined": 0, "keys_examined": 0, "returned": 0, "collscans": 0, "last_plan": None})
+        self.slow_commands = deque(maxlen=settings.DB_SLOW_LOG_SIZE)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._database = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop, database) -> None:
+        """Event loop y base de datos donde se ejecutan los explain muestreados."""
+        self._loop = loop
+        self._database = database
+
+    # --- Eventos del driver (en hilos del executor) ---
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = command_collection(event.command_name, event.command)
+        if collection is None:
+            return
+        route = current_route.get()
+        explain_command = None
+        if (event.command_name in EXPLAINABLE_COMMANDS and settings.DB_EXPLAIN_SAMPLE_RATE > 0
+                and random.random() < settings.DB_EXPLAIN_SAMPLE_RATE and not self._writes_output(event.command)):
+            explain_command = {k: v for k, v in event.command.items() if k not in DRIVER_FIELDS}
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection, route, command_filter(event.command_name, event.command), explain_command
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool) -> None:
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        collection, route, query_filter, explain_command = pending
+        command = event.command_name
+        duration_ms = event.duration_micros / 1000
+
+        COMMAND_DURATION.labels(collection, command, route).observe(duration_ms / 1000)
+        with self._lock:
+            stats = self._stats[(collection, command, route)]
+            stats.observe(duration_ms)
+            if failed:
+                stats.failures += 1
+        if failed:
+            COMMAND_FAILURES.labels(collection, command, route).inc()
+
+        if duration_ms >= settings.DB_SLOW_COMMAND_MS:
+            entry = {
+                "at": datetime.utcnow(),
+                "collection": collection,
+                "command": command,
+                "route": route,
+                "duration_ms": round(duration_ms, 2),
+                "filter": redact(query_filter) if query_filter is not None else None,
+                "failed": failed,
+            }
+            self.slow_commands.append(entry)
+            logger.warning(f"🐢 Comando lento de MongoDB ({duration_ms:.0f} ms) {command} {collection} en {route}: {entry['filter']}")
+
+        if explain_command and not failed and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._schedule_explain, collection, command, route, explain_command)
+
+    @staticmethod
+    def _writes_output(command: dict) -> bool:
+        pipeline = command.get("pipeline") or []
+        return any("$out" in stage or "$merge" in stage for stage in pipeline)
+
+    # --- Explain muestreado (en el event loop) ---
+
+    def _schedule_explain(self, collection: str, command: str, route: str, explain_command: dict) -> None:
+        asyncio.ensure_future(self._run_explain(collection, command, route, explain_command))
+
+    async def _run_explain(self, collection: str, command: str, route: str, explain_command: dict) -> None:
+        try:
+            explain = await self._database.command({"explain": explain_command, "verbosity": "executionStats"})
+        except Exception as e:
+            logger.debug(f"No se pudo obtener el explain de {command} {collection}: {e}")
+            return
+        execution_stats = _find_execution_stats(explain) or {}
+        docs_examined = execution_stats.get("totalDocsExamined", 0)
+        keys_examined = execution_stats.get("totalKeysExamined", 0)
+        returned = execution_stats.get("nReturned", 0)
+        collscan = "COLLSCAN" in str(explain.get("queryPlanner", explain.get("stages", "")))
+
+        EXPLAIN_DOCS_EXAMINED.labels(collection, command, route).inc(docs_examined)
+        EXPLAIN_DOCS_RETURNED.labels(collection, command, route).inc(returned)
+        if collscan:
+            EXPLAIN_COLLSCANS.labels(collection, command, route).inc()
+        with self._lock:
+            sample = self._explains[(collection, command, route)]
+            sample["samples"] += 1
+            sample["docs_examined"] += docs_examined
+            sample["keys_examined"] += keys_examined
+            sample["returned"] += returned
+            sample["collscans"] += int(collscan)
+            sample["last_plan"] = {
+                "filter": redact(command_filter(command, explain_command)),
+                "docs_examined": docs_examined,
+                "keys_examined": keys_examined,
+                "returned": returned,
+                "collscan": collscan,
+            }
+
+    # --- Diagnóstico ---
+
+    def snapshot(self, limit: int = 20) -> dict:
+        """Resumen para el endpoint de diagnóstico del admin."""
+        with self._lock:
+            commands = [
+                {
+                    "collection": collection,
+                    "command": command,
+                    "route": route,
+                    "count": stats.count,
+                    "failures": stats.failures,
+                    "total_ms": round(stats.total_ms, 2),
+                    "avg_ms": round(stats.total_ms / stats.count, 2) if stats.count else 0.0,
+                    "p95_ms_upper_bound": stats.percentile(0.95),
+                    "max_ms": round(stats.max_ms, 2),
+                }
+                for (collection, command, route), stats in self._stats.items()
+            ]
+            explains = [
+                {
+                    "collection": collection,
+                    "command": command,
+                    "route": route,
+                    **{k: v for k, v in sample.items() if k != "last_plan"},
+                    "docs_examined_per_returned": round(sample["docs_examined"] / sample["returned"], 2) if sample["returned"] else None,
+                    "last_plan": sample["last_plan"],
+                }
+                for (collection, command, route), sample in self._explains.items()
+            ]
+            slow_commands = list(self.slow_commands)[-limit:]
+        commands.sort(key=lambda c: c["total_ms"], reverse=True)
+        explains.sort(key=lambda e: (e["collscans"], e["docs_examined_per_returned"] or 0), reverse=True)
+        return {
+            # Solo este worker: cada proceso tiene sus propios agregados
+            "process": process_id(),
+            "slow_command_threshold_ms": settings.DB_SLOW_COMMAND_MS,
+            "explain_sample_rate": settings.DB_EXPLAIN_SAMPLE_RATE,
+            "top_commands": commands[:limit],
+            "explain_samples": explains[:limit],
+            "slow_commands": list(reversed(slow_commands)),
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._explains.clear()
+            self.slow_commands.clear()
+
+
+# Instancia compartida
+db_command_monitor = DBCommandMonitor()
+
+
+def process_id() -> str:
+    """Identificador del worker (host:pid) para los diagnósticos en memoria."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def route_template(request) -> str:
+    """Plantilla de la ruta que atenderá la solicitud (evita etiquetas con IDs)."""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
@@ -0,0 +1,126 @@
+"""
+Helpers para exportar colecciones grandes en streaming (CSV / NDJSON).
+Iteran cursores de Motor por lotes para que la memoria se mantenga constante
+sin importar cuántos documentos se exporten.
+"""
+
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List
+from datetime import datetime
+from bson import ObjectId
+import csv
+import io
+import json
+import zlib
+
+# Tamaño de lote por defecto para los cursores de exportación
+DEFAULT_EXPORT_BATCH_SIZE = 1000
+
+
+def _json_default(value):
+    """Serializa tipos de MongoDB que json no conoce."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def iter_cursor_batches(cursor, batch_size: int = DEFAULT_EXPORT_BATCH_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Agrupa los documentos de un cursor de Motor en listas de `batch_size`.
+    El cursor también se configura con ese batch_size para que cada round trip
+    al servidor traiga exactamente un lote.
+    """
+    cursor = cursor.batch_size(batch_size)
+    batch: List[dict] = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def stream_ndjson(rows: AsyncIterator[Iterable[Dict]]) -> AsyncIterator[bytes]:
+    """Convierte lotes de filas en líneas NDJSON (un chunk por lote)."""
+    async for batch in rows:
+        chunk = "".join(
+            json.dumps(row, ensure_ascii=False, default=_json_default) + "\n"
+            for row in batch
+        )
+        if chunk:
+            yield chunk.encode("utf-8")
+
+
+async def stream_csv(rows: AsyncIterator[Iterable[Dict]], fieldnames: List[str]) -> AsyncIterator[bytes]:
+    """
+    Convierte lotes de filas en CSV. La cabecera se emite una sola vez;
+    las columnas que falten en una fila quedan vacías.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue().encode("utf-8")
+
+    async for batch in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        for row in batch:
+            writer.writerow({
+                key: _json_default(value) if isinstance(value, (ObjectId, datetime)) else value
+                for key, value in row.items()
+            })
+        chunk = buffer.getvalue()
+        if chunk:
+            yield chunk.encode("utf-8")
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Comprime al vuelo un stream de bytes en formato gzip."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> cabecera gzip
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def build_export_stream(
+    rows: AsyncIterator[Iterable[Dict]],
+    export_format: str,
+    fieldnames: List[str],
+    use_gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """Arma el pipeline de serialización (y compresión opcional) para una exportación."""
+    if export_format == "csv":
+        stream = stream_csv(rows, fieldnames)
+    else:
+        stream = stream_ndjson(rows)
+    if use_gzip:
+        stream = gzip_stream(stream)
+    return stream
+
+
+def export_headers(filename: str, export_format: str, use_gzip: bool) -> Dict[str, str]:
+    """Cabeceras de descarga para una exportación."""
+    extension = "csv" if export_format == "csv" else "ndjson"
+    if use_gzip:
+        extension += ".gz"
+    return {"Content-Disposition": f'attachment; filename="{filename}.{extension}"'}
+
+
+def export_media_type(export_format: str, use_gzip: bool) -> str:
+    """Content-Type de una exportación."""
+    if use_gzip:
+        return "application/gzip"
+    return "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+
+
+async def map_batches(
+    batches: AsyncIterator[List[dict]],
+    transform: Callable[[List[dict]], Awaitable[List[dict]]],
+) -> AsyncIterator[List[dict]]:
+    """Aplica una transformación asíncrona lote a lote (ej. enriquecer con usuarios)."""
+    async for batch in batches:
+        yield await transform(batch)
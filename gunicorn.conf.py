@@ -0,0 +1,32 @@
+"""
+Configuración de gunicorn para correr la API con varios workers de uvicorn
+(es el comando de Procfile, railway.toml y el Dockerfile):
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Si no está definido, PROMETHEUS_MULTIPROC_DIR toma /tmp/prometheus: cada worker
+escribe sus métricas en ese directorio y `/metrics` (http_metrics.metrics_payload)
+las agrega, sin importar qué worker atienda el scrape. El directorio se vacía al arrancar y se descartan las
+métricas en curso de los workers que terminan.
+"""
+
+import os
+import shutil
+
+# Se define acá, antes de crear los workers, para que lo hereden al importar la app
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+
+def on_starting(server):
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
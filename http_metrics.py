@@ -0,0 +1,113 @@
+"""
+Métricas HTTP por ruta para Prometheus.
+
+`RequestMetricsMiddleware` es un middleware ASGI puro (sin BaseHTTPMiddleware,
+que agrega una tarea y un stream por solicitud). Por cada solicitud:
+
+- Resuelve una sola vez la plantilla de la ruta (ej. "/products/{product_id}")
+  y la deja en `current_route` para las métricas de MongoDB (db_monitoring.py).
+- Si HTTP_METRICS_ENABLED, registra latencia, solicitudes en curso, cantidad
+  por código de estado y tamaño de la respuesta, etiquetados por método y
+  plantilla de ruta (nunca por la URL, para no multiplicar las series).
+
+Con varios workers (gunicorn, ver gunicorn.conf.py) cada proceso escribe sus
+métricas en PROMETHEUS_MULTIPROC_DIR y `/metrics` las agrega al exponerlas.
+"""
+
+import os
+import time
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess,
+)
+from starlette.requests import Request
+
+from db_monitoring import current_route, route_template
+
+# Rutas que no se miden (el scrape de Prometheus no debe medirse a sí mismo)
+EXCLUDED_PATHS = {"/metrics"}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total",
+    "Solicitudes HTTP atendidas",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duración de las solicitudes HTTP",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Solicitudes HTTP en curso",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes",
+    "Tamaño del cuerpo de las respuestas HTTP",
+    ["method", "route"],
+    buckets=SIZE_BUCKETS,
+)
+
+
+def multiprocess_enabled() -> bool:
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def metrics_payload() -> bytes:
+    """Métricas en formato de exposición de texto; con varios workers, agregadas entre procesos."""
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app, record_metrics: bool = True):
+        self.app = app
+        self.record_metrics = record_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_template(Request(scope))
+        token = current_route.set(route)
+        try:
+            if not self.record_metrics or scope["path"] in EXCLUDED_PATHS:
+                await self.app(scope, receive, send)
+                return
+            await self._call_measured(scope, receive, send, scope["method"], route)
+        finally:
+            current_route.reset(token)
+
+    async def _call_measured(self, scope, receive, send, method: str, route: str):
+        status_code = 500
+        response_size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            HTTP_RESPONSE_SIZE.labels(method, route).observe(response_size)
+            in_progress.dec()
+
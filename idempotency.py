@@ -0,0 +1,171 @@
+"""
+Soporte para el header `Idempotency-Key` en endpoints que no deben ejecutarse
+dos veces (crear pedidos, crear preferencias de pago).
+
+La primera solicitud con una clave registra un documento "in_progress" en
+`idempotency_keys` (el _id único garantiza que solo una la ejecute). Al terminar
+se guarda la respuesta y los reintentos con la misma clave la reciben sin volver
+a ejecutar nada (header `Idempotent-Replayed: true`). Los duplicados que llegan
+mientras la original sigue en curso esperan su resultado.
+
+- Las claves son por usuario y por endpoint (scope) y vencen con un índice TTL.
+- Reusar una clave con otra solicitud (otro cuerpo / otro recurso) responde 422.
+- Si la ejecución falla, la clave se libera y el cliente puede reintentar.
+- Si el proceso que la ejecutaba muere, otra solicitud la retoma cuando vence
+  el lock (IDEMPOTENCY_LOCK_SECONDS).
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from datetime import datetime, timedelta
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import hashlib
+import json
+import logging
+
+from config import settings
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+# Intervalo de consulta mientras se espera una ejecución de otro proceso
+POLL_INTERVAL_SECONDS = 0.2
+
+# Ejecuciones en curso en este proceso: los duplicados esperan el evento sin consultar la base
+_inflight: Dict[str, asyncio.Event] = {}
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """Hash estable de los datos de la solicitud (para detectar claves reusadas)."""
+    raw = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _replay(record: dict) -> JSONResponse:
+    return JSONResponse(
+        content=record["body"],
+        status_code=record["status_code"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+
+async def _claim(collection, record_id: str, fingerprint: str) -> Optional[dict]:
+    """
+    Intenta quedarse con la ejecución de la clave.
+    Devuelve None si la tomamos, o el registro existente si ya la tiene otra solicitud.
+    """
+    now = datetime.utcnow()
+    lock_until = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        await collection.insert_one({
+            "_id": record_id,
+            "status": IN_PROGRESS,
+            "request_hash": fingerprint,
+            "locked_until": lock_until,
+            "created_at": now,
+            "expires_at": now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS),
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # Retomar una ejecución abandonada (el proceso que la tenía murió)
+    taken = await collection.find_one_and_update(
+        {"_id": record_id, "status": IN_PROGRESS, "request_hash": fingerprint, "locked_until": {"$lte": now}},
+        {"$set": {"locked_until": lock_until}},
+        return_document=ReturnDocument.AFTER
+    )
+    if taken:
+        logger.warning(f"Idempotency-Key {record_id}: se retoma una ejecución abandonada.")
+        return None
+    return await collection.find_one({"_id": record_id}) or {}
+
+
+async def _wait_for_result(collection, record_id: str) -> Optional[dict]:
+    """Espera a que la ejecución original termine. None si se liberó la clave (falló)."""
+    event = _inflight.get(record_id)
+    if event is not None:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=settings.IDEMPOTENCY_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        return await collection.find_one({"_id": record_id})
+
+    deadline = asyncio.get_running_loop().time() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while asyncio.get_running_loop().time() < deadline:
+        record = await collection.find_one({"_id": record_id})
+        if record is None or record["status"] == DONE:
+            return record
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    return await collection.find_one({"_id": record_id})
+
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    scope: str,
+    user_id: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable[Any]],
+    status_code: int = status.HTTP_200_OK,
+) -> Any:
+    """
+    Ejecuta `handler` una sola vez por (scope, usuario, clave) y devuelve su
+    resultado; los reintentos reciben la respuesta guardada.
+    Sin clave, simplemente ejecuta `handler`.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    collection = get_collection("idempotency_keys")
+    record_id = f"{scope}:{user_id}:{idempotency_key}"
+
+    # Dos vueltas: si la ejecución original falla mientras esperamos, la tomamos nosotros
+    for _ in range(2):
+        existing = await _claim(collection, record_id, fingerprint)
+        if existing is None:
+            break
+        if existing and existing.get("request_hash") != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="La Idempotency-Key ya se usó con una solicitud diferente."
+            )
+        if existing.get("status") == DONE:
+            return _replay(existing)
+
+        record = await _wait_for_result(collection, record_id)
+        if record and record["status"] == DONE:
+            return _replay(record)
+        if record:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Una solicitud con la misma Idempotency-Key todavía está en proceso. Intenta nuevamente."
+            )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Una solicitud con la misma Idempotency-Key todavía está en proceso. Intenta nuevamente."
+        )
+
+    event = _inflight.setdefault(record_id, asyncio.Event())
+    try:
+        result = await handler()
+    except BaseException:
+        # Sin respuesta que guardar: liberar la clave para que el cliente pueda reintentar
+        await collection.delete_one({"_id": record_id, "status": IN_PROGRESS})
+        raise
+    else:
+        await collection.update_one(
+            {"_id": record_id},
+            {"$set": {"status": DONE, "status_code": status_code, "body": jsonable_encoder(result), "completed_at": datetime.utcnow()}}
+        )
+        return result
+    finally:
+        event.set()
+        _inflight.pop(record_id, None)
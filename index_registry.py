@@ -0,0 +1,295 @@
+"""
+Registro declarativo de los índices de MongoDB.
+
+Todos los índices que necesita el código se declaran acá (INDEXES). Al arrancar
+la app (ENSURE_INDEXES_ON_STARTUP) se crean los que falten, de forma idempotente,
+y se informa la deriva respecto de lo que hay en la base:
+
+- missing:    declarados que no existen (se crean).
+- mismatched: existen con el mismo nombre (o las mismas claves) pero distintas
+              claves u opciones; no se tocan salvo `rebuild_mismatched=True`.
+- extra:      existen en la base pero no están declarados; no se borran salvo
+              `drop_extra=True`.
+
+scripts/create_indexes.py es un CLI sobre este módulo (incluye `--check`).
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import logging
+
+from pymongo import IndexModel
+from pymongo.errors import PyMongoError
+
+from config import settings
+from models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+# Opciones que se comparan entre lo declarado y lo existente
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+@dataclass
+class IndexSpec:
+    """Un índice declarado: colección, claves [(campo, dirección)], nombre y opciones de create_index."""
+    collection: str
+    keys: List[tuple]
+    name: str
+    options: dict = field(default_factory=dict)
+
+    def model(self, background: bool = True) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, background=background, **self.options)
+
+    @property
+    def is_text(self) -> bool:
+        return any(direction == "text" for _, direction in self.keys)
+
+
+def _index(collection: str, keys, name: str, **options) -> IndexSpec:
+    if isinstance(keys, str):
+        keys = [(keys, 1)]
+    return IndexSpec(collection=collection, keys=list(keys), name=name, options=options)
+
+
+def declared_indexes() -> List[IndexSpec]:
+    """Todos los índices de la aplicación (algunas opciones dependen de la configuración)."""
+    pending = OrderStatus.PENDING.value
+    return [
+        # ==================== USERS ====================
+        _index("users", "email", "idx_users_email", unique=True),
+        _index("users", "username", "idx_users_username", unique=True),
+        _index("users", "role", "idx_users_role"),
+        _index("users", "age_verified", "idx_users_age_verified"),
+        # Filtros del listado de admin ordenados por _id (ver ADMIN_USERS_GUARD en query_guard.py)
+        _index("users", [("role", 1), ("_id", 1)], "idx_users_role_id"),
+        _index("users", [("age_verified", 1), ("_id", 1)], "idx_users_age_verified_id"),
+        _index("users", [("role", 1), ("age_verified", 1), ("_id", 1)], "idx_users_role_age_verified_id"),
+
+        # ==================== PRODUCTS ====================
+        # Nombre único: create_product rechaza duplicados por nombre
+        _index("products", "name", "idx_products_name", unique=True),
+        _index("products", "category", "idx_products_category"),
+        _index("products", "stock", "idx_products_stock"),
+        _index("products", [("name", "text"), ("description", "text")], "idx_products_text_search"),
+        _index("products", [("category", 1), ("price", 1)], "idx_products_category_price"),
+        # Productos con stock en shards (refresco periódico del total cacheado)
+        _index("products", "stock_shards", "idx_products_stock_shards", sparse=True),
+
+        # ==================== CARTS ====================
+        # Un carrito por usuario
+        _index("carts", "user_id", "idx_carts_user_id", unique=True),
+
+        # ==================== ORDERS ====================
+        _index("orders", "user_id", "idx_orders_user_id"),
+        _index("orders", "status", "idx_orders_status"),
+        _index("orders", [("user_id", 1), ("status", 1)], "idx_orders_user_status"),
+        _index("orders", "created_at", "idx_orders_created_at"),
+        _index("orders", [("created_at", -1), ("_id", -1)], "idx_orders_pagination"),
+        # Filtros del listado de admin ordenados por fecha (ver ADMIN_ORDERS_GUARD en query_guard.py)
+        _index("orders", [("status", 1), ("created_at", -1)], "idx_orders_status_created_at"),
+        # También sirve a GET /orders/me (pedidos del usuario, más recientes primero)
+        _index("orders", [("user_id", 1), ("created_at", -1)], "idx_orders_user_created_at"),
+        _index("orders", [("user_id", 1), ("status", 1), ("created_at", -1)], "idx_orders_user_status_created_at"),
+        # Marca de las transiciones masivas de estado (order_transitions.bulk_transition_orders)
+        _index("orders", "transition_id", "idx_orders_transition_id", sparse=True),
+        # Sweeper de pedidos pendientes vencidos (solo indexa los pendientes)
+        _index("orders", "created_at", "idx_orders_pending_created_at",
+               partialFilterExpression={"status": pending}),
+        # Conciliación de pagos (pendientes con preferencia de pago)
+        _index("orders", "next_payment_check_at", "idx_orders_payment_check",
+               partialFilterExpression={"status": pending, "payment_preference_id": {"$exists": True}}),
+
+        # ==================== PAYMENTS ====================
+        _index("payments", "status", "idx_payments_status"),
+        # ID de pago de Mercado Pago: un documento por pago (upsert del webhook y de la conciliación)
+        _index("payments", "id", "idx_payments_mp_id", unique=True),
+        # Pagos de un pedido (external_reference = ID del pedido)
+        _index("payments", "external_reference", "idx_payments_external_reference"),
+        _index("payments", [("status", 1), ("date_created", -1)], "idx_payments_status_date"),
+
+        # ==================== INVENTORY_ALERTS ====================
+        # Una sola alerta abierta por producto (el detector hace upsert sobre este índice)
+        _index("inventory_alerts", "product_id", "idx_inventory_alerts_open_product",
+               unique=True, partialFilterExpression={"status": "open"}),
+        # Feed de alertas por cursor (timestamp + _id); también cubre los rangos y orden por timestamp
+        _index("inventory_alerts", [("timestamp", -1), ("_id", -1)], "idx_inventory_alerts_feed"),
+        _index("inventory_alerts", [("status", 1), ("timestamp", -1), ("_id", -1)], "idx_inventory_alerts_status_feed"),
+        # Retención: las alertas resueltas se eliminan automáticamente
+        _index("inventory_alerts", "resolved_at", "idx_inventory_alerts_resolved_ttl",
+               expireAfterSeconds=settings.INVENTORY_ALERTS_RETENTION_DAYS * 24 * 3600,
+               partialFilterExpression={"status": "resolved"}),
+
+        # ==================== LEDGER DE INVENTARIO ====================
+        _index("stock_movements", [("p", 1), ("_id", 1)], "idx_stock_movements_product"),
+        _index("stock_snapshots", [("p", 1), ("last_entry", -1)], "idx_stock_snapshots_product"),
+
+        # ==================== STOCK EN SHARDS ====================
+        _index("stock_counters", [("p", 1), ("n", 1)], "idx_stock_counters_product_shard", unique=True),
+
+        # ==================== RESERVAS DE CARRITO ====================
+        _index("stock_holds", [("product_id", 1), ("user_id", 1)], "idx_stock_holds_product_user", unique=True),
+        _index("stock_holds", "user_id", "idx_stock_holds_user"),
+        _index("stock_holds", "expires_at", "idx_stock_holds_ttl", expireAfterSeconds=0),
+
+        # ==================== IDEMPOTENCY-KEY ====================
+        _index("idempotency_keys", "expires_at", "idx_idempotency_keys_ttl", expireAfterSeconds=0),
+
+        # ==================== ESTADÍSTICAS DE PRODUCTOS ====================
+        _index("product_sales", [("units_sold", -1)], "idx_product_sales_units"),
+        _index("product_pairs", [("product_id", 1), ("other_id", 1)], "idx_product_pairs_pair", unique=True),
+        _index("product_pairs", [("product_id", 1), ("count", -1)], "idx_product_pairs_product_count"),
+
+        # ==================== REFRESH_TOKENS ====================
+        _index("refresh_tokens", "token", "idx_refresh_tokens_token", unique=True),
+        _index("refresh_tokens", "user_id", "idx_refresh_tokens_user_id"),
+        _index("refresh_tokens", "expires_at", "idx_refresh_tokens_ttl", expireAfterSeconds=0),
+    ]
+
+
+# Colecciones sin índices propios (solo _id) que igual se revisan en busca de extras
+COLLECTIONS_WITHOUT_INDEXES = ["job_leases", "request_profiles", "audit_events"]
+
+
+def registered_collections(specs: Optional[List[IndexSpec]] = None) -> List[str]:
+    specs = specs if specs is not None else declared_indexes()
+    names = []
+    for spec in specs:
+        if spec.collection not in names:
+            names.append(spec.collection)
+    return names + COLLECTIONS_WITHOUT_INDEXES
+
+
+def _normalize(value):
+    """Documentos de la base (SON) -> dict/list comparables con lo declarado."""
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _existing_keys(info: dict) -> list:
+    """Claves de un índice existente; los de texto se describen por sus campos con peso."""
+    if "weights" in info:
+        return [(field_name, "text") for field_name in sorted(info["weights"])]
+    return [(field_name, _normalize(direction)) for field_name, direction in info["key"]]
+
+
+def _declared_keys(spec: IndexSpec) -> list:
+    if spec.is_text:
+        return [(field_name, "text") for field_name, _ in sorted(spec.keys)]
+    return [(field_name, direction) for field_name, direction in spec.keys]
+
+
+def _differences(spec: IndexSpec, info: dict) -> Dict[str, dict]:
+    differences = {}
+    existing_keys = _existing_keys(info)
+    if existing_keys != _declared_keys(spec):
+        differences["key"] = {"declared": spec.keys, "existing": existing_keys}
+    for option in COMPARED_OPTIONS:
+        declared = _normalize(spec.options.get(option))
+        existing = _normalize(info.get(option))
+        if option in ("unique", "sparse"):
+            declared, existing = bool(declared), bool(existing)
+        if declared != existing:
+            differences[option] = {"declared": declared, "existing": existing}
+    return differences
+
+
+async def index_drift(database, specs: Optional[List[IndexSpec]] = None) -> dict:
+    """Compara los índices declarados con los de la base (sin modificar nada)."""
+    specs = specs if specs is not None else declared_indexes()
+    report = {"missing": [], "mismatched": [], "extra": []}
+    for collection_name in registered_collections(specs):
+        existing = await database[collection_name].index_information()
+        existing.pop("_id_", None)
+        declared = [spec for spec in specs if spec.collection == collection_name]
+        matched_names = set()
+        for spec in declared:
+            info = existing.get(spec.name)
+            if info is None:
+                # ¿Existe con otro nombre y las mismas claves? (create_index fallaría)
+                same_keys = next((name for name, other in existing.items()
+                                  if name not in matched_names and _existing_keys(other) == _declared_keys(spec)), None)
+                if same_keys:
+                    matched_names.add(same_keys)
+                    report["mismatched"].append({
+                        "collection": collection_name, "name": spec.name,
+                        "differences": {"name": {"declared": spec.name, "existing": same_keys}},
+                        "spec": spec, "existing_name": same_keys,
+                    })
+                else:
+                    report["missing"].append({"collection": collection_name, "name": spec.name, "spec": spec})
+                continue
+            matched_names.add(spec.name)
+            differences = _differences(spec, info)
+            if differences:
+                report["mismatched"].append({
+                    "collection": collection_name, "name": spec.name,
+                    "differences": differences, "spec": spec, "existing_name": spec.name,
+                })
+        for name, info in existing.items():
+            if name not in matched_names:
+                report["extra"].append({"collection": collection_name, "name": name, "key": _existing_keys(info)})
+    return report
+
+
+def has_drift(report: dict) -> bool:
+    return any(report[kind] for kind in ("missing", "mismatched", "extra"))
+
+
+async def ensure_indexes(database, drop_extra: bool = False, rebuild_mismatched: bool = False, background: bool = True) -> dict:
+    """
+    Crea los índices faltantes y devuelve el informe de deriva con lo que se hizo
+    ("created", "rebuilt", "dropped", "failed"). Idempotente: si no hay deriva no
+    modifica nada. Un índice que no se puede crear (ej. único con duplicados) se
+    informa en "failed" sin frenar al resto.
+    """
+    report = await index_drift(database)
+    report.update(created=[], rebuilt=[], dropped=[], failed=[])
+
+    async def create(spec: IndexSpec) -> bool:
+        try:
+            await database[spec.collection].create_indexes([spec.model(background)])
+            return True
+        except PyMongoError as e:
+            report["failed"].append({"collection": spec.collection, "name": spec.name, "error": str(e)})
+            logger.error(f"❌ No se pudo crear el índice {spec.collection}.{spec.name}: {e}")
+            return False
+
+    for entry in report["missing"]:
+        if await create(entry["spec"]):
+            report["created"].append(f"{entry['collection']}.{entry['name']}")
+
+    for entry in report["mismatched"]:
+        label = f"{entry['collection']}.{entry['name']}"
+        if not rebuild_mismatched:
+            logger.warning(f"⚠️ Índice {label} distinto de lo declarado: {entry['differences']}")
+            continue
+        await database[entry["collection"]].drop_index(entry["existing_name"])
+        if await create(entry["spec"]):
+            report["rebuilt"].append(label)
+
+    for entry in report["extra"]:
+        label = f"{entry['collection']}.{entry['name']}"
+        if not drop_extra:
+            logger.info(f"ℹ️ Índice no declarado en el registro: {label} {entry['key']}")
+            continue
+        await database[entry["collection"]].drop_index(entry["name"])
+        report["dropped"].append(label)
+
+    if report["created"] or report["rebuilt"] or report["dropped"]:
+        logger.info(f"🗂️ Índices: {len(report['created'])} creados, {len(report['rebuilt'])} reconstruidos, {len(report['dropped'])} eliminados.")
+    return report
+
+
+def printable_report(report: dict) -> dict:
+    """Informe sin los IndexSpec internos (para logs, JSON o el CLI)."""
+    return {
+        kind: [{k: v for k, v in entry.items() if k not in ("spec", "existing_name")} if isinstance(entry, dict) else entry
+               for entry in entries]
+        for kind, entries in report.items()
+    }
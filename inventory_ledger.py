@@ -0,0 +1,322 @@
+"""
+Libro mayor (ledger) de movimientos de stock.
+
+Cada cambio de stock se registra como un documento compacto y de solo inserción
+en `stock_movements`:
+
+    {
+        "_id": ObjectId,   # orden aproximado de los movimientos
+        "p": ObjectId,     # producto
+        "d": int,          # delta aplicado (+ reposición / - venta)
+        "s": int,          # (opcional) stock absoluto para ajustes manuales "set"
+        "r": str,          # motivo (ver StockMovementReason)
+        "o": ObjectId,     # (opcional) pedido relacionado
+        "t": datetime      # momento del movimiento
+    }
+
+Periódicamente los movimientos se compactan en `stock_snapshots` (un documento
+por producto y compactación), de modo que el stock actual o histórico se calcula
+como "último snapshot + movimientos posteriores".
+"""
+
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+import logging
+
+from database import db, get_collection
+from models import StockMovementReason
+from stock_alerts import notify_stock_change
+from stock_shards import is_sharded, sharded_totals
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_JOB_NAME = "ledger_compaction"
+
+# Margen para no compactar movimientos que otros procesos aún pueden estar insertando
+COMPACTION_LAG = timedelta(minutes=1)
+
+
+@dataclass
+class StockMovement:
+    """Un cambio de stock de un producto. `set_to` indica un ajuste absoluto."""
+    product_id: Union[str, ObjectId]
+    reason: StockMovementReason
+    delta: int = 0
+    set_to: Optional[int] = None
+    order_id: Optional[Union[str, ObjectId]] = None
+
+    def to_update(self) -> UpdateOne:
+        product_oid = ObjectId(self.product_id)
+        if self.set_to is not None:
+            return UpdateOne({"_id": product_oid}, {"$set": {"stock": self.set_to}})
+        return UpdateOne({"_id": product_oid}, {"$inc": {"stock": self.delta}})
+
+    def to_document(self, now: datetime) -> dict:
+        doc = {"p": ObjectId(self.product_id), "d": self.delta, "r": self.reason.value, "t": now}
+        if self.set_to is not None:
+            doc["s"] = self.set_to
+        if self.order_id is not None:
+            doc["o"] = ObjectId(self.order_id)
+        return doc
+
+
+async def record_movements(movements: Iterable[StockMovement], session=None) -> None:
+    """Agrega movimientos al ledger con un solo insert_many."""
+    now = datetime.utcnow()
+    docs = [m.to_document(now) for m in movements]
+    if docs:
+        await get_collection("stock_movements").insert_many(docs, ordered=False, session=session)
+
+
+def transactions_supported() -> bool:
+    """True si el despliegue admite transacciones (replica set o clúster, ej. Atlas M10+)."""
+    return db.client.topology_description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced")
+
+
+# Escritura sobre `products` que recibe la sesión y devuelve (resultado, movimientos a registrar)
+StockWrite = Callable[[Any], Awaitable[Tuple[Any, List[StockMovement]]]]
+
+
+async def run_stock_write(write: StockWrite, session=None) -> Any:
+    """
+    Ejecuta `write` (el cambio de stock en `products`) y registra en el ledger los
+    movimientos que devuelve, en el mismo lote de escrituras. Devuelve el resultado de `write`.
+
+    - Con una sesión del llamador, ambas escrituras usan esa sesión (atómicas si tiene
+      una transacción abierta).
+    - Sin sesión, si el despliegue admite transacciones, ambas van en una transacción
+      propia (`with_transaction` reintenta `write` ante errores transitorios).
+    - En un MongoDB standalone son dos escrituras separadas: si falla la del ledger,
+      el stock queda cambiado sin su movimiento (se registra el error y `reconcile`
+      lo informa como diferencia).
+    """
+    async def write_and_record(session):
+        result, movements = await write(session)
+        try:
+            await record_movements(movements, session=session)
+        except PyMongoError:
+            if session is None or not session.in_transaction:
+                logger.error(
+                    f"❌ Stock actualizado sin registrar en el ledger para los productos "
+                    f"{sorted({str(m.product_id) for m in movements})}; ver scripts/reconcile_inventory.py --reconcile."
+                )
+            raise
+        return result, movements
+
+    if session is None and transactions_supported():
+        async with await db.client.start_session() as own_session:
+            result, movements = await own_session.with_transaction(write_and_record)
+    else:
+        result, movements = await write_and_record(session)
+    if movements:
+        notify_stock_change([m.product_id for m in movements])
+    return result
+
+
+async def apply_stock_movements(
+    movements: List[StockMovement],
+    session=None,
+    applied_elsewhere: Iterable[StockMovement] = (),
+):
+    """
+    Aplica los movimientos sobre `products.stock` con un único bulk_write no ordenado
+    y los registra en el ledger (ver `run_stock_write`).
+    `applied_elsewhere` son movimientos ya descontados fuera de `products` (ej. en los
+    shards de stock) que solo se registran, en el mismo lote.
+    """
+    applied_elsewhere = list(applied_elsewhere)
+    if not movements and not applied_elsewhere:
+        return None
+
+    async def write(session):
+        result = None
+        if movements:
+            result = await get_collection("products").bulk_write(
+                [m.to_update() for m in movements], ordered=False, session=session
+            )
+        return result, movements + applied_elsewhere
+
+    return await run_stock_write(write, session=session)
+
+
+# --- Snapshots ---
+
+def _replay(entries: Iterable[dict], base: int) -> int:
+    """Aplica una secuencia ordenada de movimientos sobre un stock base."""
+    stock = base
+    for entry in entries:
+        if "s" in entry:
+            stock = entry["s"]
+        else:
+            stock += entry.get("d", 0)
+    return stock
+
+
+async def _latest_snapshots(product_ids: List[ObjectId], before: Optional[datetime] = None) -> Dict[ObjectId, dict]:
+    """Último snapshot de cada producto (opcionalmente anterior a una fecha)."""
+    match: dict = {"p": {"$in": product_ids}}
+    if before:
+        match["t"] = {"$lte": before}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"p": 1, "last_entry": -1}},
+        {"$group": {"_id": "$p", "stock": {"$first": "$stock"}, "last_entry": {"$first": "$last_entry"}}},
+    ]
+    cursor = get_collection("stock_snapshots").aggregate(pipeline)
+    return {doc["_id"]: doc async for doc in cursor}
+
+
+async def create_baseline_snapshots(batch_size: int = 1000) -> int:
+    """
+    Toma el stock actual de todos los productos como punto de partida del ledger.
+    Ejecutar una vez al habilitar el ledger (o después de corregir una deriva).
+    """
+    now = datetime.utcnow()
+    # Marca de agua = último movimiento ya registrado (incluido en el stock actual).
+    # ObjectId.from_datetime redondea al segundo y volvería a contar los movimientos de ese segundo
+    latest = await get_collection("stock_movements").find_one({}, projection={"_id": 1}, sort=[("_id", -1)])
+    last_entry = latest["_id"] if latest else ObjectId()
+    snapshots_collection = get_collection("stock_snapshots")
+    cursor = get_collection("products").find({}, projection={"stock": 1}).batch_size(batch_size)
+    batch: List[dict] = []
+    total = 0
+    async for product in cursor:
+        batch.append({"p": product["_id"], "stock": product.get("stock", 0), "last_entry": last_entry, "t": now, "baseline": True})
+        if len(batch) >= batch_size:
+            await snapshots_collection.insert_many(batch, ordered=False)
+            total += len(batch)
+            batch = []
+    if batch:
+        await snapshots_collection.insert_many(batch, ordered=False)
+        total += len(batch)
+    await get_collection("job_state").update_one(
+        {"_id": COMPACTION_JOB_NAME}, {"$set": {"watermark": last_entry, "updated_at": now}}, upsert=True
+    )
+    logger.info(f"📸 Snapshots base creados para {total} productos.")
+    return total
+
+
+async def compact_snapshots(batch_size: int = 1000) -> dict:
+    """
+    Compacta los movimientos nuevos (desde la marca de agua) en un snapshot por producto.
+    Recorre el ledger en orden con un cursor por lotes; la memoria es O(productos con movimientos).
+    """
+    state = await get_collection("job_state").find_one({"_id": COMPACTION_JOB_NAME}) or {}
+    watermark: ObjectId = state.get("watermark", ObjectId.from_datetime(datetime(1970, 1, 1)))
+    now = datetime.utcnow()
+    upper = ObjectId.from_datetime(now - COMPACTION_LAG)
+    if upper <= watermark:
+        return {"products": 0, "movements": 0}
+
+    # Por producto: ("abs", valor) si hubo un ajuste absoluto, o ("delta", suma) si no
+    pending: Dict[ObjectId, list] = {}
+    movements = 0
+    cursor = get_collection("stock_movements").find(
+        {"_id": {"$gt": watermark, "$lte": upper}},
+        projection={"p": 1, "d": 1, "s": 1},
+    ).sort("_id", 1).batch_size(batch_size)
+    async for entry in cursor:
+        movements += 1
+        state_for_product = pending.setdefault(entry["p"], ["delta", 0])
+        if "s" in entry:
+            state_for_product[0], state_for_product[1] = "abs", entry["s"]
+        else:
+            state_for_product[1] += entry.get("d", 0)
+
+    product_ids = list(pending)
+    snapshots_collection = get_collection("stock_snapshots")
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        previous = await _latest_snapshots(chunk)
+        docs = []
+        for product_id in chunk:
+            kind, value = pending[product_id]
+            base = previous.get(product_id, {}).get("stock", 0)
+            stock = value if kind == "abs" else base + value
+            docs.append({"p": product_id, "stock": stock, "last_entry": upper, "t": now})
+        await snapshots_collection.insert_many(docs, ordered=False)
+
+    await get_collection("job_state").update_one(
+        {"_id": COMPACTION_JOB_NAME}, {"$set": {"watermark": upper, "updated_at": now}}, upsert=True
+    )
+    summary = {"products": len(product_ids), "movements": movements}
+    logger.info(f"📚 Ledger compactado: {movements} movimientos en {len(product_ids)} snapshots.")
+    return summary
+
+
+async def stock_at(product_id: Union[str, ObjectId], at: Optional[datetime] = None) -> int:
+    """
+    Calcula el stock de un producto según el ledger (actual, o en la fecha `at`)
+    como último snapshot + movimientos posteriores.
+    """
+    product_oid = ObjectId(product_id)
+    snapshot = (await _latest_snapshots([product_oid], before=at)).get(product_oid)
+    query: dict = {"p": product_oid}
+    if snapshot:
+        query["_id"] = {"$gt": snapshot["last_entry"]}
+    if at:
+        query["t"] = {"$lte": at}
+    entries = get_collection("stock_movements").find(query, projection={"d": 1, "s": 1}).sort("_id", 1)
+    return _replay([entry async for entry in entries], snapshot["stock"] if snapshot else 0)
+
+
+async def reconcile(batch_size: int = 500) -> List[dict]:
+    """
+    Compara el stock según el ledger con `products.stock`, recorriendo los productos
+    por lotes. Devuelve la lista de diferencias encontradas.
+    """
+    mismatches: List[dict] = []
+    movements_collection = get_collection("stock_movements")
+    cursor = get_collection("products").find(
+        {}, projection={"name": 1, "stock": 1, "stock_shards": 1, "stock_cached": 1}
+    ).sort("_id", 1).batch_size(batch_size)
+
+    batch: List[dict] = []
+
+    async def check(products: List[dict]):
+        product_ids = [p["_id"] for p in products]
+        snapshots = await _latest_snapshots(product_ids)
+        # Una consulta por lote: movimientos posteriores al snapshot más antiguo del lote
+        since = min((s["last_entry"] for s in snapshots.values()), default=None)
+        query: dict = {"p": {"$in": product_ids}}
+        if since is not None and len(snapshots) == len(product_ids):
+            query["_id"] = {"$gt": since}
+        entries: Dict[ObjectId, List[dict]] = {}
+        async for entry in movements_collection.find(query, projection={"p": 1, "d": 1, "s": 1}).sort("_id", 1):
+            snapshot = snapshots.get(entry["p"])
+            if snapshot and entry["_id"] <= snapshot["last_entry"]:
+                continue
+            entries.setdefault(entry["p"], []).append(entry)
+
+        # Productos con stock en shards: el stock real es la suma de los shards más las escrituras directas
+        shard_totals = await sharded_totals([p["_id"] for p in products if is_sharded(p)])
+
+        for product in products:
+            snapshot = snapshots.get(product["_id"])
+            expected = _replay(entries.get(product["_id"], []), snapshot["stock"] if snapshot else 0)
+            actual = product.get("stock", 0)
+            if is_sharded(product):
+                actual += shard_totals.get(product["_id"], 0) - product.get("stock_cached", 0)
+            if expected != actual:
+                mismatches.append({
+                    "product_id": str(product["_id"]),
+                    "name": product.get("name"),
+                    "ledger_stock": expected,
+                    "products_stock": actual,
+                    "difference": actual - expected,
+                })
+
+    async for product in cursor:
+        batch.append(product)
+        if len(batch) >= batch_size:
+            await check(batch)
+            batch = []
+    if batch:
+        await check(batch)
+
+    logger.info(f"🔍 Conciliación de inventario terminada: {len(mismatches)} diferencias.")
+    return mismatches
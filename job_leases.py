@@ -0,0 +1,51 @@
+"""
+Leases (locks con vencimiento) en MongoDB para trabajos en segundo plano.
+
+Cada trabajo tiene un documento en `job_leases` con `_id` = nombre del trabajo.
+Un worker toma el lease si está libre o vencido; si el worker muere, el lease
+vence solo y otro proceso puede tomarlo. Así, con varias réplicas de la API,
+solo una ejecuta el trabajo a la vez.
+"""
+
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import os
+import socket
+import logging
+
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+
+def default_owner() -> str:
+    """Identificador del proceso actual (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(name: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Toma (o renueva) el lease `name` por `ttl_seconds` segundos.
+    Devuelve False si otro owner lo tiene vigente.
+    """
+    now = datetime.utcnow()
+    try:
+        lease = await get_collection("job_leases").find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl_seconds), "renewed_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # El documento existe y lo tiene otro owner: el upsert intentó insertar el mismo _id
+        return False
+    return lease is not None
+
+
+async def release_lease(name: str, owner: str) -> None:
+    """Libera el lease si todavía es nuestro (otro worker puede tomarlo de inmediato)."""
+    await get_collection("job_leases").update_one(
+        {"_id": name, "owner": owner},
+        {"$set": {"expires_at": datetime.utcnow()}}
+    )
@@ -0,0 +1,207 @@
+"""
+Monitor del event loop (opt-in con LOOP_MONITOR_ENABLED).
+
+Cualquier llamada síncrona lenta (SDK de Mercado Pago, bcrypt, logging pesado)
+frena todas las solicitudes en curso del worker. Este monitor lo hace visible:
+
+- Latido: una tarea duerme LOOP_MONITOR_INTERVAL_MS y mide cuánto tarda de más
+  en despertar (lag del loop). Se exporta como histograma y como percentiles
+  p50/p95/p99 de la última ventana.
+- Watchdog: un hilo aparte revisa el último latido; si el loop lleva más de
+  LOOP_BLOCK_THRESHOLD_MS sin atenderlo, captura el stack del hilo del loop y
+  la ruta de la solicitud que lo está bloqueando (`current_route` de la tarea
+  en curso). Al volver el latido se registra el bloqueo con su duración.
+- Modo estricto (LOOP_MONITOR_STRICT, para pruebas): `LoopBlockBudgetMiddleware`
+  hace fallar con LoopBlockedError la solicitud que bloqueó el loop más que el
+  umbral, así un cliente de prueba ASGI lo ve como error.
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Optional
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from config import settings
+from db_monitoring import current_route, process_id
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LAG_QUANTILES = (0.5, 0.95, 0.99)
+# Muestras de la ventana para los percentiles y cada cuántos latidos se recalculan
+LAG_WINDOW_SIZE = 1200
+QUANTILES_EVERY = 20
+# Últimos frames del stack que se muestran en el log
+STACK_DEPTH = 15
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Retraso del event loop en atender el latido del monitor",
+    buckets=LAG_BUCKETS,
+)
+LOOP_LAG_QUANTILE = Gauge(
+    "event_loop_lag_quantile_seconds",
+    "Percentiles del retraso del event loop en la última ventana",
+    ["quantile"],
+    multiprocess_mode="max",
+)
+LOOP_BLOCKS = Counter(
+    "event_loop_blocks_total",
+    "Veces que el event loop estuvo bloqueado más que el umbral",
+    ["route"],
+)
+
+
+class LoopBlockedError(RuntimeError):
+    """Una solicitud bloqueó el event loop más que el presupuesto (solo en modo estricto)."""
+
+
+class LoopMonitor:
+    def __init__(self):
+        self.interval = settings.LOOP_MONITOR_INTERVAL_MS / 1000
+        self.threshold = settings.LOOP_BLOCK_THRESHOLD_MS / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._last_beat = time.monotonic()
+        self._pending_block: Optional[dict] = None
+        self._lags = deque(maxlen=LAG_WINDOW_SIZE)
+        self._blocks = deque(maxlen=settings.LOOP_BLOCK_LOG_SIZE)
+        # Bloqueo máximo (ms) por tarea, para el modo estricto
+        self._blocked_tasks = weakref.WeakKeyDictionary()
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(
+            f"🩺 Monitor del event loop activo (latido {settings.LOOP_MONITOR_INTERVAL_MS}ms, "
+            f"umbral {settings.LOOP_BLOCK_THRESHOLD_MS}ms{', estricto' if settings.LOOP_MONITOR_STRICT else ''})."
+        )
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        beats = 0
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(0.0, now - started - self.interval)
+            LOOP_LAG.observe(lag)
+            self._lags.append(lag)
+
+            block = self._pending_block
+            if block is not None:
+                self._pending_block = None
+                self._record_block(block, lag)
+
+            beats += 1
+            if beats % QUANTILES_EVERY == 0:
+                for quantile, value in self.lag_quantiles().items():
+                    LOOP_LAG_QUANTILE.labels(str(quantile)).set(value)
+
+    def _watch(self) -> None:
+        """Hilo watchdog: captura el stack del loop mientras está bloqueado."""
+        while not self._stopped.wait(self.interval):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.threshold or self._pending_block is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = None
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                pass
+            route = "background"
+            if task is not None and hasattr(task, "get_context"):
+                route = task.get_context().get(current_route, "background")
+            self._pending_block = {
+                "detected_at": datetime.utcnow(),
+                "route": route,
+                "task": task,
+                "stack": traceback.format_stack(frame) if frame else [],
+            }
+
+    def _record_block(self, block: dict, lag: float) -> None:
+        task = block.pop("task")
+        block["blocked_ms"] = round(lag * 1000, 1)
+        self._blocks.append(block)
+        LOOP_BLOCKS.labels(block["route"]).inc()
+        if task is not None and settings.LOOP_MONITOR_STRICT:
+            self._blocked_tasks[task] = max(self._blocked_tasks.get(task, 0.0), block["blocked_ms"])
+        logger.warning(
+            f"🐢 Event loop bloqueado {block['blocked_ms']}ms (ruta: {block['route']}):\n"
+            + "".join(block["stack"][-STACK_DEPTH:])
+        )
+
+    def pop_blocked_ms(self, task: asyncio.Task) -> float:
+        """Bloqueo máximo registrado para la tarea (0 si no bloqueó)."""
+        return self._blocked_tasks.pop(task, 0.0)
+
+    def lag_quantiles(self) -> dict:
+        if not self._lags:
+            return {}
+        ordered = sorted(self._lags)
+        return {q: ordered[min(int(len(ordered) * q), len(ordered) - 1)] for q in LAG_QUANTILES}
+
+    def snapshot(self, limit: int = 20) -> dict:
+        return {
+            # Solo este worker: cada proceso tiene su propio event loop y registro de bloqueos
+            "process": process_id(),
+            "enabled": self._task is not None,
+            "interval_ms": settings.LOOP_MONITOR_INTERVAL_MS,
+            "threshold_ms": settings.LOOP_BLOCK_THRESHOLD_MS,
+            "lag_ms": {f"p{round(q * 100)}": round(value * 1000, 2) for q, value in self.lag_quantiles().items()},
+            "recent_blocks": list(self._blocks)[-limit:][::-1],
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+class LoopBlockBudgetMiddleware:
+    """Modo estricto: falla la solicitud cuya tarea bloqueó el loop más que el umbral."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+        try:
+            await self.app(scope, receive, send)
+            # El latido registra el bloqueo al volver a correr: se le da una vuelta
+            await asyncio.sleep(loop_monitor.interval)
+        finally:
+            blocked_ms = loop_monitor.pop_blocked_ms(task)
+        if blocked_ms:
+            raise LoopBlockedError(
+                f"{scope['method']} {current_route.get()} bloqueó el event loop {blocked_ms}ms "
+                f"(presupuesto {settings.LOOP_BLOCK_THRESHOLD_MS}ms)"
+            )
@@ -1,7 +1,7 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
-from database import connect_db, close_db, get_database
+from database import connect_db, close_db, get_database, warm_up_pool, ensure_capped_collection
 from routers import auth, products, age_verification, cart, orders, payments, inventory, admin
 from contextlib import asynccontextmanager
 from datetime import datetime
@@ -11,6 +11,18 @@ import os
 import redis.asyncio as redis
 from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
+from product_stats import product_stats_loop
+from stock_alerts import low_stock_detector
+from order_sweeper import order_sweeper_loop
+from stock_shards import stock_shards_refresh_loop
+from payment_reconciler import payment_reconcile_loop
+from http_metrics import RequestMetricsMiddleware, metrics_payload, CONTENT_TYPE_LATEST
+from index_registry import ensure_indexes
+from loop_monitor import loop_monitor, LoopBlockBudgetMiddleware
+from request_profiling import RequestProfilingMiddleware, PROFILES_COLLECTION
+from tracing import tracer, TracingMiddleware, instrument_redis
+from audit_logger import audit_pipeline, AUDIT_COLLECTION
+import asyncio
 
 # Configuración de logging
 logging.basicConfig(
@@ -19,21 +31,97 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_startup_indexes():
+    """Crea los índices faltantes sin impedir el arranque si algo falla."""
+    try:
+        await ensure_indexes(await get_database())
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error al asegurar los índices de MongoDB: {e}", exc_info=True)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("🚀 Iniciando aplicación. Conectando a MongoDB...")
     await connect_db()
+    if settings.MONGO_WARM_UP_POOL:
+        try:
+            await warm_up_pool()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo precalentar el pool de MongoDB: {e}")
+
+    # Índices declarados (index_registry.py)
+    ensure_indexes_task = None
+    if settings.ENSURE_INDEXES_ON_STARTUP:
+        if settings.ENSURE_INDEXES_IN_BACKGROUND:
+            ensure_indexes_task = asyncio.create_task(ensure_startup_indexes())
+        else:
+            await ensure_startup_indexes()
+
+    # Perfiles de solicitudes a pedido de un admin (request_profiling.py)
+    if settings.PROFILING_ENABLED:
+        try:
+            await ensure_capped_collection(PROFILES_COLLECTION, settings.PROFILE_STORE_MAX_BYTES, settings.PROFILE_STORE_MAX_DOCUMENTS)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo preparar la colección de perfiles: {e}")
+
+    # Auditoría asíncrona por lotes (audit_logger.py)
+    if settings.AUDIT_ENABLED:
+        try:
+            await ensure_capped_collection(AUDIT_COLLECTION, settings.AUDIT_STORE_MAX_BYTES)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo preparar la colección de auditoría: {e}")
+        await audit_pipeline.start()
+
+    # Exportador de trazas (tracing.py)
+    tracer.start()
+
+    # Lag del event loop y bloqueos (loop_monitor.py)
+    if settings.LOOP_MONITOR_ENABLED:
+        await loop_monitor.start()
+
+    # Detector de bajo stock (change stream o hook de la aplicación)
+    await low_stock_detector.start()
 
     # Conexión a Redis para el Rate Limiter
     try:
         redis_connection = redis.from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
+        if settings.TRACING_ENABLED:
+            instrument_redis(redis_connection)
         await FastAPILimiter.init(redis_connection)
         logger.info("✅ Conectado a Redis y FastAPILimiter inicializado.")
     except Exception as e:
         logger.error(f"❌ No se pudo conectar a Redis o inicializar FastAPILimiter: {e}")
 
+    # Tareas periódicas en segundo plano
+    background_tasks = []
+    if settings.PRODUCT_STATS_INTERVAL_MINUTES > 0:
+        background_tasks.append(asyncio.create_task(product_stats_loop(settings.PRODUCT_STATS_INTERVAL_MINUTES)))
+        logger.info(f"📈 Job de estadísticas de productos cada {settings.PRODUCT_STATS_INTERVAL_MINUTES} minutos.")
+    if settings.SWEEPER_ENABLED:
+        background_tasks.append(asyncio.create_task(order_sweeper_loop(settings.SWEEPER_INTERVAL_SECONDS)))
+        logger.info(f"🧹 Sweeper de pedidos pendientes activo (vencen a los {settings.PENDING_ORDER_EXPIRY_MINUTES} minutos).")
+    if settings.STOCK_SHARDS_REFRESH_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(stock_shards_refresh_loop(settings.STOCK_SHARDS_REFRESH_SECONDS)))
+    if settings.PAYMENT_RECONCILE_ENABLED and settings.MERCADOPAGO_ACCESS_TOKEN:
+        background_tasks.append(asyncio.create_task(payment_reconcile_loop(settings.PAYMENT_RECONCILE_INTERVAL_SECONDS)))
+        logger.info(f"💳 Conciliación de pagos cada {settings.PAYMENT_RECONCILE_INTERVAL_SECONDS} segundos.")
+    if settings.AUDIT_ENABLED:
+        background_tasks.append(asyncio.create_task(audit_pipeline.run()))
+
     yield  # ⏳ Aquí corre la app
 
+    if ensure_indexes_task:
+        background_tasks.append(ensure_indexes_task)
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await low_stock_detector.stop()
+    await loop_monitor.stop()
+    tracer.stop()
+    if settings.AUDIT_ENABLED:
+        await audit_pipeline.stop()
+
     logger.info("🔴 Cerrando aplicación. Desconectando de MongoDB...")
     await close_db()
 
@@ -77,8 +165,32 @@ app.add_middleware(
     allow_headers=["*"],    # Permite todos los encabezados
 )
 
+# Modo estricto del monitor del event loop: falla la solicitud que lo bloquea (pruebas)
+if settings.LOOP_MONITOR_ENABLED and settings.LOOP_MONITOR_STRICT:
+    app.add_middleware(LoopBlockBudgetMiddleware)
+
+# Trazas: span por solicitud con traceparent W3C (ver tracing.py)
+if settings.TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
+# Perfilado a pedido: header X-Profile con token de admin (ver request_profiling.py)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(RequestProfilingMiddleware)
+
+# Métricas HTTP por ruta y ruta de la solicitud para las métricas de MongoDB (ver http_metrics.py)
+app.add_middleware(
+    RequestMetricsMiddleware,
+    record_metrics=settings.METRICS_ENABLED and settings.HTTP_METRICS_ENABLED,
+)
+
 # Rutas principales
 
+# Métricas para Prometheus
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(metrics_payload(), media_type=CONTENT_TYPE_LATEST)
+
 # Health Check Endpoint
 @app.get("/health", tags=["Health"])
 async def health_check():
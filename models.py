@@ -1,5 +1,5 @@
 from bson import ObjectId
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, model_validator
 from pydantic_core import core_schema
 from typing import List, Optional, Any
 from datetime import datetime
@@ -87,6 +87,8 @@ class Product(BaseModel):
     abv: Optional[float] = Field(None, ge=0, le=100, description="Grado alcohólico por volumen (Alcohol by Volume), 0-100%")
     volume_ml: Optional[int] = Field(None, gt=0, description="Volumen del envase en mililitros")
     origin: Optional[str] = Field(None, max_length=50, description="País o región de origen")
+    # Solo lectura: stock menos las reservas activas de carritos (con CART_RESERVATIONS_ENABLED)
+    available_stock: Optional[int] = Field(None, ge=0, description="Stock disponible descontando reservas de carritos")
     
     class Config:
         populate_by_name = True # Permite usar alias en el ID al crear o actualizar
@@ -223,12 +225,26 @@ class Order(BaseModel):
     shipping_address: Address
     payment_id: Optional[str] = None # ID de la transacción de pago
     payment_preference_id: Optional[str] = None # ID de la preferencia de Mercado Pago
+    payment_conflict: Optional[dict] = None # Pago aprobado que llegó con el pedido ya cerrado (devolver a mano)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     class Config:
         populate_by_name = True
 
+# Modelos para cambios de estado masivos de pedidos
+class BulkOrderStatusUpdate(BaseModel):
+    order_ids: List[str] = Field(..., min_length=1, max_length=1000, description="IDs de los pedidos a actualizar")
+    new_status: OrderStatus = Field(..., description="Estado destino")
+
+class BulkOrderStatusResult(BaseModel):
+    order_id: str
+    result: str = Field(..., description="'updated', 'not_found', 'invalid_id', 'invalid_transition' o 'conflict'")
+
+class BulkOrderStatusResponse(BaseModel):
+    updated: int
+    results: List[BulkOrderStatusResult] = Field(..., description="Un resultado por ID, en el mismo orden que `order_ids`")
+
 # Modelos para Pagos (Simplificado para la intención de la API)
 class PaymentRequest(BaseModel):
     order_id: str = Field(..., description="ID del pedido a pagar")
@@ -252,6 +268,10 @@ class PaymentResponseModel(BaseModel): # Renombrado para evitar conflicto con Pa
         populate_by_name = True
 
 # Modelos para Gestión de Inventario / Alertas
+class InventoryAlertStatus(str, enum.Enum):
+    OPEN = "open"
+    RESOLVED = "resolved"
+
 class InventoryAlert(BaseModel):
     id: Optional[PyObjectId] = Field(None, alias="_id")
     product_id: str
@@ -259,7 +279,59 @@ class InventoryAlert(BaseModel):
     current_stock: int
     threshold: int
     message: str
+    status: InventoryAlertStatus = InventoryAlertStatus.OPEN
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = None
+    resolved_at: Optional[datetime] = None
     
     class Config:
-        populate_by_name = True
\ No newline at end of file
+        populate_by_name = True
+
+class InventoryAlertPage(BaseModel):
+    """Página del feed de alertas (paginación por cursor)"""
+    items: List[InventoryAlert]
+    next_cursor: Optional[str] = Field(None, description="Cursor para pedir la página siguiente; null si no hay más")
+
+class InventoryAlertSummary(BaseModel):
+    open: int
+    resolved: int
+
+# Motivos de los movimientos de stock (ledger de inventario)
+class StockMovementReason(str, enum.Enum):
+    ORDER = "order"            # Venta: decremento al crear un pedido
+    RESTOCK = "restock"        # Reposición por cancelación/reembolso de un pedido
+    MANUAL_SET = "manual_set"  # Ajuste absoluto de un administrador
+    MANUAL_ADD = "manual_add"  # Reposición manual de un administrador
+    PRODUCT = "product"        # Alta o edición del producto con stock
+
+# Modelos para actualización masiva de stock
+class StockUpdateMode(str, enum.Enum):
+    SET = "set"  # Establece el stock al valor indicado
+    ADD = "add"  # Suma la cantidad indicada al stock actual
+
+class BulkStockItem(BaseModel):
+    product_id: str = Field(..., description="ID del producto")
+    mode: StockUpdateMode = Field(StockUpdateMode.SET, description="'set' para establecer el stock, 'add' para sumarlo")
+    quantity: int = Field(..., ge=0, description="Nuevo stock (set) o cantidad a sumar (add)")
+
+    @model_validator(mode="after")
+    def validate_quantity(self):
+        if self.mode == StockUpdateMode.ADD and self.quantity == 0:
+            raise ValueError("La cantidad a sumar debe ser mayor que cero.")
+        return self
+
+class BulkStockUpdate(BaseModel):
+    items: List[BulkStockItem] = Field(..., min_length=1, max_length=10000, description="Cambios de stock a aplicar")
+
+class BulkStockItemResult(BaseModel):
+    product_id: str
+    status: str = Field(..., description="'updated', 'not_found' o 'invalid'")
+    stock: Optional[int] = Field(None, description="Stock resultante")
+    low_stock: bool = False
+    detail: Optional[str] = None
+
+class BulkStockUpdateResponse(BaseModel):
+    matched: int
+    modified: int
+    low_stock_count: int = Field(..., description="Productos del lote que quedaron con bajo stock")
+    results: List[BulkStockItemResult] = Field(..., description="Un resultado por ítem, en el mismo orden que `items`")
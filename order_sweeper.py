@@ -0,0 +1,111 @@
+"""
+Liberación automática del stock retenido por pedidos pendientes sin pagar.
+
+`create_order` descuenta el stock al crear el pedido; si el checkout de Mercado
+Pago se abandona, el pedido queda en "Pendiente" y ese stock queda bloqueado.
+Este job busca por lotes los pedidos pendientes más antiguos que
+PENDING_ORDER_EXPIRY_MINUTES (índice parcial {created_at} con status Pendiente),
+los cancela con una transición condicionada (solo si siguen pendientes) y
+devuelve su stock con escrituras en lote. Los pedidos cuya preferencia de pago
+todavía no venció se dejan para la próxima pasada.
+
+Solo un worker barre a la vez gracias al lease `order_sweeper` en `job_leases`.
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
+
+from config import settings
+from database import get_collection
+from job_leases import acquire_lease, release_lease, default_owner
+from models import OrderStatus
+from order_transitions import bulk_transition_orders
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "order_sweeper"
+
+# Motivo guardado en los pedidos cancelados por el sweeper
+EXPIRED_CANCEL_REASON = "payment_expired"
+
+# Pagos que Mercado Pago todavía está procesando (ej. transferencia): no se cancelan
+PAYMENT_IN_PROGRESS_STATUSES = ["in_process", "pending", "authorized"]
+
+
+async def sweep_expired_orders(
+    expiry_minutes: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    owner: Optional[str] = None,
+) -> int:
+    """
+    Cancela los pedidos pendientes vencidos y repone su stock.
+    Devuelve la cantidad de pedidos cancelados (0 si otro worker tiene el lease).
+    """
+    expiry_minutes = expiry_minutes or settings.PENDING_ORDER_EXPIRY_MINUTES
+    batch_size = batch_size or settings.SWEEPER_BATCH_SIZE
+    owner = owner or default_owner()
+    lease_ttl = settings.SWEEPER_LEASE_SECONDS
+
+    if not await acquire_lease(LEASE_NAME, owner, lease_ttl):
+        logger.debug("Otro worker tiene el lease del sweeper de pedidos; se omite esta pasada.")
+        return 0
+
+    orders_collection = get_collection("orders")
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=expiry_minutes)
+    query = {
+        "status": OrderStatus.PENDING.value,
+        "created_at": {"$lt": cutoff},
+        "payment_status": {"$nin": PAYMENT_IN_PROGRESS_STATUSES},
+        # Sin preferencia, o con la preferencia de MP ya vencida (todavía se puede pagar)
+        "payment_preference.expires_at": {"$not": {"$gt": now}},
+    }
+    cancelled = 0
+    try:
+        while True:
+            batch = await orders_collection.find(
+                query, projection={"_id": 1}
+            ).sort("created_at", 1).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+
+            results = await bulk_transition_orders(
+                [order["_id"] for order in batch],
+                OrderStatus.CANCELLED,
+                only_from=[OrderStatus.PENDING],
+                extra_filter=query,
+                extra_fields={"cancel_reason": EXPIRED_CANCEL_REASON},
+                orders_collection=orders_collection
+            )
+            updated = sum(1 for result in results.values() if result == "updated")
+            cancelled += updated
+
+            # Los pedidos no actualizados cambiaron de estado en paralelo y ya no coinciden con la consulta
+            if len(batch) < batch_size or updated == 0:
+                break
+
+            # Renovar el lease entre lotes; si se perdió, otro worker continúa
+            if not await acquire_lease(LEASE_NAME, owner, lease_ttl):
+                logger.warning("⚠️ Se perdió el lease del sweeper de pedidos; se detiene esta pasada.")
+                break
+    finally:
+        await release_lease(LEASE_NAME, owner)
+
+    if cancelled:
+        logger.info(f"🧹 {cancelled} pedidos pendientes vencidos cancelados y su stock repuesto.")
+    return cancelled
+
+
+async def order_sweeper_loop(interval_seconds: int) -> None:
+    """Ejecuta el sweeper periódicamente (se lanza desde el lifespan de la app)."""
+    owner = default_owner()
+    while True:
+        try:
+            await sweep_expired_orders(owner=owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error en el sweeper de pedidos pendientes: {e}", exc_info=True)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,182 @@
+"""
+Máquina de estados de los pedidos.
+
+Las transiciones permitidas se declaran en ORDER_TRANSITIONS. Cada cambio de
+estado se aplica con una escritura condicionada al estado actual esperado
+(find_one_and_update / update_many con `status` en el filtro), de modo que dos
+cambios concurrentes no puedan pisarse. Si la transición devuelve el pedido a
+un estado que libera stock (cancelado / reembolsado), la reposición se hace con
+un único bulk_write a través del ledger de inventario.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+import logging
+
+from database import get_collection
+from inventory_ledger import StockMovement, apply_stock_movements
+from models import OrderStatus, StockMovementReason
+
+logger = logging.getLogger(__name__)
+
+# Estado actual -> estados a los que puede pasar
+ORDER_TRANSITIONS: Dict[OrderStatus, Set[OrderStatus]] = {
+    OrderStatus.PENDING: {OrderStatus.PROCESSING, OrderStatus.CANCELLED},
+    OrderStatus.PROCESSING: {OrderStatus.SHIPPED, OrderStatus.CANCELLED, OrderStatus.REFUNDED},
+    OrderStatus.SHIPPED: {OrderStatus.DELIVERED, OrderStatus.REFUNDED},
+    OrderStatus.DELIVERED: {OrderStatus.REFUNDED},
+    OrderStatus.CANCELLED: set(),
+    OrderStatus.REFUNDED: set(),
+}
+
+# Estados que devuelven al inventario el stock del pedido
+RESTOCK_STATUSES = {OrderStatus.CANCELLED, OrderStatus.REFUNDED}
+
+
+def can_transition(current_status: OrderStatus, new_status: OrderStatus) -> bool:
+    return new_status in ORDER_TRANSITIONS.get(current_status, set())
+
+
+def allowed_sources(new_status: OrderStatus) -> List[OrderStatus]:
+    """Estados desde los que se puede llegar a `new_status`."""
+    return [source for source, targets in ORDER_TRANSITIONS.items() if new_status in targets]
+
+
+def restock_movements(order: dict) -> List[StockMovement]:
+    """Movimientos de reposición para todos los ítems de un pedido."""
+    movements = []
+    for item in order.get("items", []):
+        if not ObjectId.is_valid(str(item.get("product_id"))):
+            logger.error(f"El product_id {item.get('product_id')} no es válido, no se repone stock.")
+            continue
+        movements.append(StockMovement(
+            product_id=item["product_id"],
+            delta=item["quantity"],
+            reason=StockMovementReason.RESTOCK,
+            order_id=order["_id"]
+        ))
+    return movements
+
+
+async def transition_order(
+    order_id: str,
+    new_status: OrderStatus,
+    expected_status: Optional[OrderStatus] = None,
+    extra_fields: Optional[dict] = None,
+    orders_collection=None,
+) -> dict:
+    """
+    Cambia el estado de un pedido de forma atómica y devuelve el documento actualizado.
+
+    Args:
+        order_id: ID del pedido.
+        new_status: Estado destino.
+        expected_status: Estado actual esperado. Si no se indica, se lee el actual.
+        extra_fields: Campos adicionales a guardar junto con el cambio de estado.
+
+    Raises:
+        HTTPException 404 si el pedido no existe, 409 si la transición no está permitida
+        o si otro proceso cambió el estado del pedido en el medio.
+    """
+    orders_collection = orders_collection if orders_collection is not None else get_collection("orders")
+    order_oid = ObjectId(order_id)
+
+    if expected_status is None:
+        current = await orders_collection.find_one({"_id": order_oid}, projection={"status": 1})
+        if not current:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado.")
+        expected_status = OrderStatus(current["status"])
+
+    if not can_transition(expected_status, new_status):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"No se puede pasar un pedido de '{expected_status.value}' a '{new_status.value}'."
+        )
+
+    update_fields = {"status": new_status.value, "updated_at": datetime.utcnow()}
+    if extra_fields:
+        update_fields.update(extra_fields)
+
+    updated_order = await orders_collection.find_one_and_update(
+        {"_id": order_oid, "status": expected_status.value},
+        {"$set": update_fields},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_order:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El estado del pedido cambió mientras se procesaba la solicitud. Intenta nuevamente."
+        )
+
+    if new_status in RESTOCK_STATUSES:
+        logger.info(f"El pedido {order_id} se está cancelando/reembolsando. Reponiendo stock...")
+        await apply_stock_movements(restock_movements(updated_order))
+
+    return updated_order
+
+
+async def bulk_transition_orders(
+    order_ids: Iterable[ObjectId],
+    new_status: OrderStatus,
+    only_from: Optional[Iterable[OrderStatus]] = None,
+    extra_filter: Optional[dict] = None,
+    extra_fields: Optional[dict] = None,
+    orders_collection=None,
+) -> Dict[ObjectId, str]:
+    """
+    Cambia el estado de muchos pedidos con pocas escrituras:
+    una lectura de estados, un update_many por estado de origen, una lectura de los
+    pedidos efectivamente modificados y un único bulk_write de reposición de stock.
+
+    Cada update_many marca los pedidos con un `transition_id` propio, lo que permite
+    saber exactamente cuáles cambió esta llamada aunque haya cambios concurrentes.
+
+    Returns:
+        {order_id: resultado} con "updated", "not_found", "invalid_transition" o "conflict".
+    """
+    orders_collection = orders_collection if orders_collection is not None else get_collection("orders")
+    order_ids = list(dict.fromkeys(order_ids))
+    sources = set(allowed_sources(new_status))
+    if only_from is not None:
+        sources &= set(only_from)
+
+    results: Dict[ObjectId, str] = {oid: "not_found" for oid in order_ids}
+    by_source: Dict[OrderStatus, List[ObjectId]] = {}
+    query = {"_id": {"$in": order_ids}}
+    if extra_filter:
+        query.update(extra_filter)
+    async for order in orders_collection.find(query, projection={"status": 1}):
+        current = OrderStatus(order["status"])
+        if current in sources:
+            by_source.setdefault(current, []).append(order["_id"])
+            results[order["_id"]] = "conflict"  # Se corrige a "updated" si la escritura lo toma
+        else:
+            results[order["_id"]] = "invalid_transition"
+
+    if not by_source:
+        return results
+
+    transition_id = ObjectId()
+    update_fields = {"status": new_status.value, "updated_at": datetime.utcnow(), "transition_id": transition_id}
+    if extra_fields:
+        update_fields.update(extra_fields)
+    for source, ids in by_source.items():
+        await orders_collection.update_many(
+            {"_id": {"$in": ids}, "status": source.value, **(extra_filter or {})},
+            {"$set": update_fields}
+        )
+
+    projection = {"items": 1} if new_status in RESTOCK_STATUSES else {"_id": 1}
+    transitioned = await orders_collection.find({"transition_id": transition_id}, projection=projection).to_list(length=None)
+    for order in transitioned:
+        results[order["_id"]] = "updated"
+
+    if new_status in RESTOCK_STATUSES and transitioned:
+        movements = [m for order in transitioned for m in restock_movements(order)]
+        await apply_stock_movements(movements)
+        logger.info(f"Stock repuesto para {len(transitioned)} pedidos pasados a '{new_status.value}'.")
+
+    return results
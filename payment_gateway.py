@@ -0,0 +1,85 @@
+"""
+Cliente asíncrono de la API de Mercado Pago.
+
+Las llamadas HTTP (bloqueantes, con `requests`) se ejecutan en un hilo con
+`asyncio.to_thread` para no frenar el event loop, y un semáforo limita cuántas
+hay en vuelo a la vez (MERCADOPAGO_MAX_CONCURRENCY), tanto para no saturar el
+pool de hilos como para respetar el rate limit de MP.
+
+Cada llamada abre un span de cliente (tracing.py) y propaga el `traceparent`.
+
+La URL base se puede cambiar con MERCADOPAGO_API_BASE_URL, por ejemplo para
+apuntar al servidor falso de scripts/fake_mercadopago.py en desarrollo.
+
+Las respuestas mantienen la forma del SDK oficial: {"status": int, "response": dict}.
+"""
+
+from typing import List, Optional
+import asyncio
+import logging
+import requests
+
+from config import settings
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class MercadoPagoGateway:
+    def __init__(self, access_token: Optional[str], base_url: str, timeout: float, max_concurrency: int):
+        self.access_token = access_token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = requests.Session()
+
+    def _request(self, method: str, path: str, headers: Optional[dict] = None, **kwargs) -> dict:
+        response = self._session.request(
+            method,
+            f"{self.base_url}{path}",
+            headers={"Authorization": f"Bearer {self.access_token}", **(headers or {})},
+            timeout=self.timeout,
+            **kwargs
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"message": response.text}
+        return {"status": response.status_code, "response": body}
+
+    async def request(self, method: str, path: str, **kwargs) -> dict:
+        async with self._semaphore:
+            with tracer.span(f"mercadopago {method}", "client", {"http.method": method, "http.target": path}) as span:
+                result = await asyncio.to_thread(self._request, method, path, headers=tracer.outgoing_headers(), **kwargs)
+                if span is not None:
+                    span.set_attribute("http.status_code", result["status"])
+                return result
+
+    # --- Preferencias ---
+
+    async def create_preference(self, preference_data: dict) -> dict:
+        return await self.request("POST", "/checkout/preferences", json=preference_data)
+
+    # --- Pagos ---
+
+    async def get_payment(self, payment_id: str) -> dict:
+        return await self.request("GET", f"/v1/payments/{payment_id}")
+
+    async def search_payments(self, external_reference: str, limit: int = 10) -> List[dict]:
+        """Pagos asociados a un pedido (external_reference), del más reciente al más antiguo."""
+        result = await self.request(
+            "GET", "/v1/payments/search",
+            params={"external_reference": external_reference, "sort": "date_created", "criteria": "desc", "limit": limit}
+        )
+        if result["status"] != 200:
+            raise RuntimeError(f"Mercado Pago respondió {result['status']} al buscar pagos: {result['response']}")
+        return result["response"].get("results", [])
+
+
+# Instancia compartida
+mercadopago_gateway = MercadoPagoGateway(
+    access_token=settings.MERCADOPAGO_ACCESS_TOKEN,
+    base_url=settings.MERCADOPAGO_API_BASE_URL,
+    timeout=settings.MERCADOPAGO_TIMEOUT_SECONDS,
+    max_concurrency=settings.MERCADOPAGO_MAX_CONCURRENCY,
+)
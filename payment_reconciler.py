@@ -0,0 +1,213 @@
+"""
+Conciliación de pagos con Mercado Pago.
+
+Si un webhook se pierde, el pedido queda "Pendiente" aunque MP haya aprobado el
+pago. Este worker recorre por lotes los pedidos pendientes que ya tienen
+preferencia de pago (índice parcial sobre `next_payment_check_at`), consulta sus
+pagos a MP con concurrencia acotada y aplica el resultado con las mismas
+transiciones condicionadas que usa el webhook (`apply_payment_status`).
+
+La frecuencia es adaptativa: cada pedido guarda en `next_payment_check_at`
+cuándo volver a consultarlo, seguido al principio y cada vez menos a medida que
+envejece (ver RECHECK_SCHEDULE). Pasado PAYMENT_RECONCILE_MAX_AGE_HOURS deja de
+consultarse.
+
+Solo un worker concilia a la vez gracias al lease `payment_reconciler`.
+"""
+
+from typing import List, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi import HTTPException, status
+import asyncio
+import logging
+
+from audit_logger import log_audit, AuditEvent
+from config import settings
+from database import get_collection
+from job_leases import acquire_lease, release_lease, default_owner
+from models import OrderStatus
+from order_transitions import transition_order
+from payment_gateway import mercadopago_gateway
+from payment_store import save_payment_event
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "payment_reconciler"
+
+# (edad máxima del pedido, intervalo hasta la próxima consulta)
+RECHECK_SCHEDULE = [
+    (timedelta(minutes=10), timedelta(minutes=1)),
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(hours=24), timedelta(minutes=30)),
+]
+RECHECK_SLOWEST = timedelta(hours=6)
+
+# Estados de MP que cancelan el pedido / que indican un pago todavía en curso
+REJECTED_PAYMENT_STATUSES = {"rejected", "cancelled"}
+IN_PROGRESS_PAYMENT_STATUSES = {"in_process", "pending", "authorized"}
+
+
+def next_check_at(created_at: datetime, now: datetime) -> Optional[datetime]:
+    """Próxima consulta según la edad del pedido; None si ya no se consulta más."""
+    age = now - created_at
+    if age >= timedelta(hours=settings.PAYMENT_RECONCILE_MAX_AGE_HOURS):
+        return None
+    for max_age, interval in RECHECK_SCHEDULE:
+        if age < max_age:
+            return now + interval
+    return now + RECHECK_SLOWEST
+
+
+async def apply_payment_status(order_id: str, payment_info: dict, source: str) -> Optional[str]:
+    """
+    Aplica el estado de un pago de MP a su pedido con transiciones condicionadas
+    (solo desde "Pendiente"). Devuelve el estado nuevo del pedido, o None si no cambió.
+    """
+    payment_status = payment_info.get("status")
+    payment_fields = {
+        "payment_id": str(payment_info.get("id")),
+        "payment_status": payment_status,
+        "payment_status_detail": payment_info.get("status_detail", "N/A"),
+    }
+
+    if payment_status == "approved":
+        new_status = OrderStatus.PROCESSING
+    elif payment_status in REJECTED_PAYMENT_STATUSES:
+        new_status = OrderStatus.CANCELLED
+    else:
+        if payment_status in IN_PROGRESS_PAYMENT_STATUSES:
+            # Algunos pagos quedan pendientes (ej: transferencia bancaria)
+            await get_collection("orders").update_one(
+                {"_id": ObjectId(order_id), "status": OrderStatus.PENDING.value},
+                {"$set": payment_fields}
+            )
+            logger.info(f"⏳ Pedido {order_id} marcado como pendiente - pago en proceso ({source}).")
+        return None
+
+    try:
+        await transition_order(order_id, new_status, expected_status=OrderStatus.PENDING, extra_fields=payment_fields)
+    except HTTPException as e:
+        if payment_status == "approved" and e.status_code == status.HTTP_409_CONFLICT:
+            await flag_payment_conflict(order_id, payment_fields, source)
+            return None
+        # 404: el pedido no existe. 409: ya no está pendiente (otro webhook, el sweeper o el admin lo cambió)
+        logger.info(f"ℹ️ Pedido {order_id}: no se aplica el pago '{payment_status}' ({source}): {e.detail}")
+        return None
+
+    logger.info(f"✅ Pedido {order_id} actualizado a '{new_status.value}' por pago '{payment_status}' ({source}).")
+    return new_status.value
+
+
+async def flag_payment_conflict(order_id: str, payment_fields: dict, source: str) -> None:
+    """
+    Un pago aprobado llegó para un pedido que ya no está pendiente (cancelado por el
+    sweeper o el admin, o pagado con otro pago): el cliente fue cobrado sin pedido.
+    Se marca `payment_conflict` en el pedido y se audita para devolverlo a mano.
+    Si el pedido ya figura pagado con este mismo pago (webhook duplicado), no es conflicto.
+    """
+    payment_id = payment_fields["payment_id"]
+    result = await get_collection("orders").update_one(
+        {
+            "_id": ObjectId(order_id),
+            "status": {"$ne": OrderStatus.PENDING.value},
+            "payment_id": {"$ne": payment_id},
+            "payment_conflict.payment_id": {"$ne": payment_id},
+        },
+        {"$set": {"payment_conflict": {**payment_fields, "source": source, "detected_at": datetime.utcnow()}}}
+    )
+    if not result.modified_count:
+        logger.info(f"ℹ️ Pedido {order_id}: pago aprobado {payment_id} ya aplicado o ya marcado ({source}).")
+        return
+    logger.error(f"🚨 Pago aprobado {payment_id} para el pedido {order_id}, que ya no está pendiente ({source}). Requiere devolución manual.")
+    log_audit(AuditEvent.PAYMENT_CONFLICT, None, {"order_id": order_id, "payment_id": payment_id, "source": source})
+
+
+def pick_relevant_payment(payments: List[dict]) -> Optional[dict]:
+    """Un pago aprobado si existe; si no, uno en curso; si no, el más reciente."""
+    for wanted in ({"approved"}, IN_PROGRESS_PAYMENT_STATUSES):
+        for payment in payments:
+            if payment.get("status") in wanted:
+                return payment
+    return payments[0] if payments else None
+
+
+async def reconcile_order(order: dict, now: datetime) -> Optional[str]:
+    """Consulta los pagos de un pedido, aplica el relevante y reprograma la próxima consulta."""
+    order_id = str(order["_id"])
+    result = None
+    try:
+        payments = await mercadopago_gateway.search_payments(order_id)
+        payment = pick_relevant_payment(payments)
+        if payment:
+            # Guardar el estado consultado (pisa el de un webhook anterior, ej. in_process -> approved);
+            # el webhook de ese mismo estado se reconoce como ya procesado
+            await save_payment_event(payment)
+            result = await apply_payment_status(order_id, payment, source="conciliación")
+    except Exception as e:
+        logger.error(f"❌ Error al conciliar el pago del pedido {order_id}: {e}")
+
+    if result is None:
+        next_check = next_check_at(order["created_at"], now)
+        update = {"$set": {"next_payment_check_at": next_check}} if next_check else {"$unset": {"next_payment_check_at": ""}}
+        await get_collection("orders").update_one({"_id": order["_id"], "status": OrderStatus.PENDING.value}, update)
+    return result
+
+
+async def reconcile_payments(batch_size: Optional[int] = None, owner: Optional[str] = None) -> dict:
+    """
+    Concilia los pedidos pendientes cuya próxima consulta ya venció.
+    Devuelve un resumen {"checked": n, "updated": n}.
+    """
+    batch_size = batch_size or settings.PAYMENT_RECONCILE_BATCH_SIZE
+    owner = owner or default_owner()
+    lease_ttl = settings.PAYMENT_RECONCILE_LEASE_SECONDS
+    summary = {"checked": 0, "updated": 0}
+
+    if not await acquire_lease(LEASE_NAME, owner, lease_ttl):
+        return summary
+
+    orders_collection = get_collection("orders")
+    now = datetime.utcnow()
+    try:
+        while True:
+            batch = await orders_collection.find(
+                {
+                    "status": OrderStatus.PENDING.value,
+                    "payment_preference_id": {"$exists": True},
+                    "next_payment_check_at": {"$lte": now},
+                },
+                projection={"created_at": 1}
+            ).sort("next_payment_check_at", 1).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                break
+
+            # La concurrencia real la limita el semáforo del gateway
+            results = await asyncio.gather(*(reconcile_order(order, now) for order in batch))
+            summary["checked"] += len(batch)
+            summary["updated"] += sum(1 for result in results if result)
+
+            if len(batch) < batch_size:
+                break
+            if not await acquire_lease(LEASE_NAME, owner, lease_ttl):
+                logger.warning("⚠️ Se perdió el lease del conciliador de pagos; se detiene esta pasada.")
+                break
+    finally:
+        await release_lease(LEASE_NAME, owner)
+
+    if summary["checked"]:
+        logger.info(f"💳 Conciliación de pagos: {summary['checked']} pedidos consultados, {summary['updated']} actualizados.")
+    return summary
+
+
+async def payment_reconcile_loop(interval_seconds: int) -> None:
+    """Ejecuta la conciliación periódicamente (se lanza desde el lifespan de la app)."""
+    owner = default_owner()
+    while True:
+        try:
+            await reconcile_payments(owner=owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error en la conciliación de pagos: {e}", exc_info=True)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,109 @@
+"""
+Almacenamiento compacto de los eventos de pago de Mercado Pago.
+
+En lugar de guardar el objeto de pago completo de MP (grande y muy anidado),
+cada documento de `payments` tiene solo los campos que consultamos y el
+payload original comprimido para auditoría:
+
+    {
+        "id": int,                     # ID del pago en MP
+        "status": str,
+        "status_detail": str,
+        "external_reference": str,     # ID del pedido
+        "amount": float,
+        "currency": str,
+        "payment_method": str,
+        "date_created": datetime,
+        "date_approved": datetime | None,
+        "date_last_updated": datetime | None,
+        "raw": Binary,                 # JSON original comprimido
+        "raw_encoding": "zstd" | "gzip",
+        "schema": 2,
+    }
+
+Se usa zstd si el paquete `zstandard` está instalado; si no, gzip.
+"""
+
+from typing import Optional
+from datetime import datetime, timezone
+from bson import Binary
+from dateutil import parser as date_parser
+import gzip
+import json
+import logging
+
+from database import get_collection
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+
+def _parse_date(value) -> Optional[datetime]:
+    """Fechas ISO de MP (con zona horaria) -> datetime UTC naive, como el resto de la base."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        parsed = date_parser.isoparse(value)
+    except (ValueError, TypeError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def compress_payload(payload: dict) -> tuple:
+    """Devuelve (bytes comprimidos, codificación)."""
+    raw = json.dumps(payload, default=str, separators=(",", ":")).encode()
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(raw), "zstd"
+    return gzip.compress(raw, compresslevel=9), "gzip"
+
+
+def load_raw_payment(document: dict) -> Optional[dict]:
+    """Reconstruye el payload original de MP de un documento compacto (o viejo)."""
+    if document.get("schema") != SCHEMA_VERSION:
+        return document  # Documento anterior a la migración: es el payload completo
+    raw = bytes(document["raw"])
+    if document.get("raw_encoding") == "zstd":
+        if zstandard is None:
+            raise RuntimeError("El payload está comprimido con zstd pero el paquete 'zstandard' no está instalado.")
+        raw = zstandard.ZstdDecompressor().decompress(raw)
+    else:
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def to_payment_document(payment_info: dict) -> dict:
+    """Convierte el objeto de pago de MP en el documento compacto."""
+    if payment_info.get("schema") == SCHEMA_VERSION:
+        return payment_info
+    raw, encoding = compress_payload({k: v for k, v in payment_info.items() if k != "_id"})
+    return {
+        "id": payment_info.get("id"),
+        "status": payment_info.get("status"),
+        "status_detail": payment_info.get("status_detail"),
+        "external_reference": payment_info.get("external_reference"),
+        "amount": payment_info.get("transaction_amount"),
+        "currency": payment_info.get("currency_id"),
+        "payment_method": payment_info.get("payment_method_id"),
+        "date_created": _parse_date(payment_info.get("date_created")),
+        "date_approved": _parse_date(payment_info.get("date_approved")),
+        "date_last_updated": _parse_date(payment_info.get("date_last_updated")),
+        "raw": Binary(raw),
+        "raw_encoding": encoding,
+        "schema": SCHEMA_VERSION,
+    }
+
+
+async def save_payment_event(payment_info: dict) -> None:
+    """Guarda (upsert por ID de MP) el estado más reciente de un pago en forma compacta."""
+    document = to_payment_document(payment_info)
+    await get_collection("payments").update_one({"id": document["id"]}, {"$set": document}, upsert=True)
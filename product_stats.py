@@ -0,0 +1,263 @@
+"""
+Precálculo de estadísticas de productos a partir de los pedidos:
+- Ventas por producto (para el ranking de más vendidos).
+- Co-ocurrencia de productos en un mismo pedido ("frecuentemente comprados juntos").
+
+El job es incremental: procesa solo los pedidos creados después de la última
+marca de agua (`created_at`) guardada en la colección `job_state`. Los contadores
+se aplican con `$inc`, así que cada pasada toma un lease (`job_leases`): con
+varias réplicas o workers, solo uno procesa cada ventana de pedidos. Además la
+marca de agua se mueve con compare-and-set: si otro worker la movió mientras
+tanto (lease vencido), lo acumulado se descarta en vez de contarse dos veces.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+import asyncio
+import logging
+import resource
+import time
+
+from config import settings
+from database import get_collection, get_read_collection
+from job_leases import acquire_lease, release_lease, default_owner
+from models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "product_stats"
+
+# Solo cuentan los pedidos pagados (los pendientes pueden cancelarse)
+COUNTED_STATUSES = [OrderStatus.PROCESSING.value, OrderStatus.SHIPPED.value, OrderStatus.DELIVERED.value]
+
+# Límite de productos por pedido para calcular pares (n² crece rápido)
+MAX_ITEMS_FOR_PAIRS = 20
+
+# Cantidad de pares acumulados en memoria antes de volcarlos a MongoDB
+FLUSH_THRESHOLD = 50_000
+
+
+def _peak_rss_mb() -> float:
+    """Memoria residente máxima del proceso en MB (ru_maxrss está en KB en Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _flush(sales: Counter, order_counts: Counter, names: Dict[ObjectId, str], pairs: Counter) -> None:
+    """Aplica los contadores acumulados con un bulk_write por colección."""
+    now = datetime.utcnow()
+    if sales:
+        sales_ops = [
+            UpdateOne(
+                {"_id": product_id},
+                {
+                    "$inc": {"units_sold": units, "orders_count": order_counts[product_id]},
+                    "$set": {"name": names.get(product_id), "updated_at": now},
+                },
+                upsert=True,
+            )
+            for product_id, units in sales.items()
+        ]
+        await get_collection("product_sales").bulk_write(sales_ops, ordered=False)
+
+    if pairs:
+        pair_ops = [
+            UpdateOne(
+                {"product_id": product_id, "other_id": other_id},
+                {"$inc": {"count": count}},
+                upsert=True,
+            )
+            for (product_id, other_id), count in pairs.items()
+        ]
+        await get_collection("product_pairs").bulk_write(pair_ops, ordered=False)
+
+    sales.clear()
+    order_counts.clear()
+    names.clear()
+    pairs.clear()
+
+
+async def _stored_watermark() -> Optional[datetime]:
+    state = await get_collection("job_state").find_one({"_id": JOB_NAME}, projection={"watermark": 1}) or {}
+    return state.get("watermark")
+
+
+async def _save_watermark(previous: Optional[datetime], watermark: datetime) -> bool:
+    """Mueve la marca de agua solo si sigue en `previous` (compare-and-set)."""
+    try:
+        result = await get_collection("job_state").update_one(
+            {"_id": JOB_NAME, "watermark": previous},
+            {"$set": {"watermark": watermark, "updated_at": datetime.utcnow()}},
+            upsert=previous is None
+        )
+    except DuplicateKeyError:
+        # Primera pasada: otro worker creó el documento con su marca de agua en el medio
+        return False
+    return bool(result.matched_count or result.upserted_id)
+
+
+async def _flush_and_advance(sales: Counter, order_counts: Counter, names: Dict[ObjectId, str],
+                             pairs: Counter, previous: Optional[datetime], watermark: datetime) -> bool:
+    """
+    Vuelca los contadores y mueve la marca de agua de `previous` a `watermark` enseguida.
+
+    Si la marca de agua ya no es `previous` (otro worker procesó esta ventana, por
+    ejemplo porque este se trabó más que el lease y el otro lo tomó y lo liberó),
+    lo acumulado se descarta sin aplicarlo y devuelve False. Si el proceso muere
+    entre las dos escrituras, ese tramo se cuenta dos veces.
+    """
+    if await _stored_watermark() != previous:
+        logger.warning("⚠️ Otro worker movió la marca de agua de estadísticas de productos; se descarta esta pasada.")
+        return False
+    await _flush(sales, order_counts, names, pairs)
+    if not await _save_watermark(previous, watermark):
+        logger.error("❌ La marca de agua de estadísticas de productos cambió durante el volcado; puede haber conteo doble.")
+        return False
+    return True
+
+
+async def _renew_lease(owner: str, lease_ttl: int) -> bool:
+    """
+    Renueva el lease antes de cada volcado. Si se perdió (la pasada tardó más que
+    el lease y otro worker lo tomó), lo acumulado se descarta sin aplicarlo: el otro
+    worker lo procesa desde la última marca de agua.
+    """
+    if await acquire_lease(JOB_NAME, owner, lease_ttl):
+        return True
+    logger.warning("⚠️ Se perdió el lease de estadísticas de productos; se detiene esta pasada.")
+    return False
+
+
+async def compute_product_stats(
+    batch_size: int = 1000,
+    until: Optional[datetime] = None,
+    owner: Optional[str] = None,
+) -> dict:
+    """
+    Procesa los pedidos nuevos desde la marca de agua y actualiza `product_sales`
+    y `product_pairs` de forma incremental.
+
+    Para no contar pedidos que aún pueden pagarse o cancelarse, solo se procesan
+    los creados hace más de PRODUCT_STATS_SETTLE_HOURS horas.
+
+    Returns:
+        Resumen con pedidos procesados, duración y memoria máxima del proceso
+        (`skipped` si otro worker tiene el lease).
+    """
+    owner = owner or default_owner()
+    lease_ttl = settings.PRODUCT_STATS_LEASE_SECONDS
+    if not await acquire_lease(JOB_NAME, owner, lease_ttl):
+        logger.debug("Otro worker tiene el lease de estadísticas de productos; se omite esta pasada.")
+        return {"orders_processed": 0, "skipped": True}
+    try:
+        return await _compute_product_stats(batch_size, until, owner, lease_ttl)
+    finally:
+        await release_lease(JOB_NAME, owner)
+
+
+async def _compute_product_stats(batch_size: int, until: Optional[datetime], owner: str, lease_ttl: int) -> dict:
+    started = time.perf_counter()
+    orders_collection = get_collection("orders")
+    # Valor guardado (None si el job nunca corrió): cada volcado lo compara antes de moverlo
+    stored_watermark = await _stored_watermark()
+    watermark: datetime = stored_watermark or datetime(1970, 1, 1)
+    upper_bound = until or (datetime.utcnow() - timedelta(hours=settings.PRODUCT_STATS_SETTLE_HOURS))
+
+    if upper_bound <= watermark:
+        return {"orders_processed": 0, "watermark": watermark}
+
+    cursor = orders_collection.find(
+        {
+            "created_at": {"$gt": watermark, "$lte": upper_bound},
+            "status": {"$in": COUNTED_STATUSES},
+        },
+        projection={"created_at": 1, "items.product_id": 1, "items.quantity": 1, "items.name": 1},
+    ).sort("created_at", 1).batch_size(batch_size)
+
+    sales: Counter = Counter()
+    order_counts: Counter = Counter()
+    names: Dict[ObjectId, str] = {}
+    pairs: Counter = Counter()
+    orders_processed = 0
+    last_created_at: Optional[datetime] = None
+
+    async for order in cursor:
+        created_at = order["created_at"]
+        # Solo se vuelca en un cambio de created_at, así la marca de agua nunca
+        # deja pedidos con la misma fecha a medio procesar
+        if len(pairs) + len(sales) >= FLUSH_THRESHOLD and created_at != last_created_at:
+            if not await _renew_lease(owner, lease_ttl) or not await _flush_and_advance(
+                sales, order_counts, names, pairs, stored_watermark, last_created_at
+            ):
+                return {"orders_processed": orders_processed, "watermark": watermark, "interrupted": True}
+            stored_watermark = watermark = last_created_at
+
+        product_ids: List[ObjectId] = []
+        for item in order.get("items", []):
+            product_id = ObjectId(item["product_id"])
+            sales[product_id] += item.get("quantity", 0)
+            names[product_id] = item.get("name")
+            if product_id not in product_ids:
+                product_ids.append(product_id)
+                order_counts[product_id] += 1
+
+        product_ids = product_ids[:MAX_ITEMS_FOR_PAIRS]
+        for i, product_id in enumerate(product_ids):
+            for other_id in product_ids[i + 1:]:
+                pairs[(product_id, other_id)] += 1
+                pairs[(other_id, product_id)] += 1
+
+        orders_processed += 1
+        last_created_at = created_at
+
+    if not await _renew_lease(owner, lease_ttl) or not await _flush_and_advance(
+        sales, order_counts, names, pairs, stored_watermark, upper_bound
+    ):
+        return {"orders_processed": orders_processed, "watermark": watermark, "interrupted": True}
+
+    summary = {
+        "orders_processed": orders_processed,
+        "watermark": upper_bound,
+        "duration_seconds": round(time.perf_counter() - started, 3),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+    await get_collection("job_state").update_one({"_id": JOB_NAME}, {"$set": {"last_run": summary}})
+    logger.info(
+        f"📈 Estadísticas de productos actualizadas: {orders_processed} pedidos en "
+        f"{summary['duration_seconds']}s (RSS máx. {summary['peak_rss_mb']} MB)."
+    )
+    return summary
+
+
+async def product_stats_loop(interval_minutes: int) -> None:
+    """Ejecuta el job periódicamente (se lanza desde el lifespan de la app)."""
+    owner = default_owner()
+    while True:
+        try:
+            await compute_product_stats(owner=owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error al calcular estadísticas de productos: {e}", exc_info=True)
+        await asyncio.sleep(interval_minutes * 60)
+
+
+# --- Lecturas (usadas por los endpoints de productos) ---
+
+async def get_top_sellers(limit: int) -> List[Tuple[ObjectId, int]]:
+    """Devuelve [(product_id, unidades vendidas)] ordenado de mayor a menor."""
+    cursor = get_read_collection("product_sales", "catalog").find(
+        {}, projection={"units_sold": 1}
+    ).sort("units_sold", -1).limit(limit)
+    return [(doc["_id"], doc["units_sold"]) async for doc in cursor]
+
+
+async def get_frequently_bought_together(product_id: ObjectId, limit: int) -> List[Tuple[ObjectId, int]]:
+    """Devuelve [(other_id, veces comprados juntos)] para un producto."""
+    cursor = get_read_collection("product_pairs", "catalog").find(
+        {"product_id": product_id}, projection={"other_id": 1, "count": 1}
+    ).sort("count", -1).limit(limit)
+    return [(doc["other_id"], doc["count"]) async for doc in cursor]
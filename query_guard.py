@@ -0,0 +1,166 @@
+"""
+Guardia de consultas para los listados de administración.
+Cada endpoint declara qué combinaciones de filtros y ordenamiento están
+respaldadas por un índice; el resto se rechaza (o se reescribe) antes de
+llegar a MongoDB, evitando ordenamientos en memoria y escaneos completos.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+from fastapi import HTTPException, status
+from config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Etapas del plan de ejecución que consideramos inaceptables
+FORBIDDEN_PLAN_STAGES = {"COLLSCAN", "SORT"}
+
+
+@dataclass(frozen=True)
+class IndexedShape:
+    """
+    Combinación de filtros respaldada por un índice.
+    - filters: campos de filtro cubiertos por el prefijo del índice.
+    - sorts: campos por los que se puede ordenar usando ese mismo índice.
+    - index: nombre del índice (solo informativo).
+    """
+    filters: FrozenSet[str]
+    sorts: Tuple[str, ...]
+    index: str = ""
+
+
+@dataclass
+class QueryGuard:
+    """
+    Valida el ordenamiento de un listado contra las formas de consulta declaradas.
+
+    - sort_aliases: reescrituras de campos equivalentes (ej. users.created_at -> _id,
+      ya que el ObjectId ordena cronológicamente).
+    - residual_filters: filtros permitidos que no forman parte de ningún índice
+      (ej. búsqueda por regex); no cuentan para elegir la forma de la consulta.
+    """
+    name: str
+    shapes: List[IndexedShape]
+    default_sort: str
+    sort_aliases: Dict[str, str] = field(default_factory=dict)
+    residual_filters: FrozenSet[str] = frozenset()
+
+    def _filter_fields(self, query: dict) -> FrozenSet[str]:
+        return frozenset(key for key in query if key not in self.residual_filters)
+
+    def allowed_sorts(self, query: dict) -> Tuple[str, ...]:
+        """Campos de ordenamiento permitidos para los filtros de la consulta."""
+        filter_fields = self._filter_fields(query)
+        for shape in self.shapes:
+            if shape.filters == filter_fields:
+                return shape.sorts
+        return ()
+
+    def resolve_sort(self, query: dict, sort_by: str, sort_order: int) -> List[Tuple[str, int]]:
+        """
+        Devuelve la especificación de orden a usar con `.sort()`.
+        Lanza HTTPException 400 si la combinación no está respaldada por un índice
+        y QUERY_GUARD_MODE es "reject"; en modo "rewrite" usa el orden por defecto.
+        """
+        if sort_order not in (1, -1):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="sort_order debe ser 1 (ascendente) o -1 (descendente)."
+            )
+
+        field_name = self.sort_aliases.get(sort_by, sort_by)
+        allowed = self.allowed_sorts(query)
+
+        if field_name in allowed:
+            return [(field_name, sort_order)]
+
+        if settings.QUERY_GUARD_MODE == "rewrite" and allowed:
+            fallback = self.default_sort if self.default_sort in allowed else allowed[0]
+            logger.warning(
+                f"[{self.name}] Orden por '{sort_by}' no respaldado por índice para los filtros "
+                f"{sorted(self._filter_fields(query))}. Se reescribe a '{fallback}'."
+            )
+            return [(fallback, sort_order)]
+
+        if allowed:
+            detail = f"No se puede ordenar por '{sort_by}' con estos filtros. Campos permitidos: {', '.join(allowed)}."
+        else:
+            detail = f"La combinación de filtros {sorted(self._filter_fields(query))} no está soportada por ningún índice."
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    async def check_plan(self, collection, query: dict, sort: List[Tuple[str, int]], limit: int = 0) -> None:
+        """
+        En modo desarrollo (QUERY_GUARD_EXPLAIN), ejecuta explain() y falla si el plan
+        ganador contiene COLLSCAN o un SORT en memoria.
+        Las consultas con filtros residuales se omiten porque no pueden usar índice.
+        """
+        if not settings.QUERY_GUARD_EXPLAIN:
+            return
+        if any(key in self.residual_filters for key in query):
+            return
+
+        cursor = collection.find(query).sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        explain = await cursor.explain()
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages = set(iter_plan_stages(winning_plan))
+        offending = stages & FORBIDDEN_PLAN_STAGES
+        if offending:
+            logger.error(f"[{self.name}] Plan de consulta inválido ({', '.join(sorted(offending))}) para {query} ordenado por {sort}.")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"[{self.name}] La consulta usa etapas no permitidas: {', '.join(sorted(offending))}."
+            )
+
+
+def iter_plan_stages(plan: dict) -> Iterable[str]:
+    """Recorre recursivamente un plan de explain() y devuelve el nombre de cada etapa."""
+    if not isinstance(plan, dict):
+        return
+    # En el motor de ejecución SBE el plan clásico está anidado en queryPlan
+    if "queryPlan" in plan:
+        yield from iter_plan_stages(plan["queryPlan"])
+        return
+    stage = plan.get("stage")
+    if stage:
+        yield stage
+    if "inputStage" in plan:
+        yield from iter_plan_stages(plan["inputStage"])
+    for child in plan.get("inputStages", []):
+        yield from iter_plan_stages(child)
+
+
+# --- Formas de consulta declaradas para los listados de administración ---
+
+ADMIN_USERS_GUARD = QueryGuard(
+    name="GET /admin/users",
+    shapes=[
+        IndexedShape(frozenset(), ("_id", "username", "email"), "_id_ / idx_users_username / idx_users_email"),
+        IndexedShape(frozenset({"role"}), ("_id",), "idx_users_role_id"),
+        IndexedShape(frozenset({"age_verified"}), ("_id",), "idx_users_age_verified_id"),
+        IndexedShape(frozenset({"role", "age_verified"}), ("_id",), "idx_users_role_age_verified_id"),
+    ],
+    default_sort="_id",
+    # Los usuarios no guardan created_at; el _id (ObjectId) ordena por fecha de creación
+    sort_aliases={"created_at": "_id", "id": "_id"},
+    # La búsqueda por regex insensible a mayúsculas no puede usar índice
+    residual_filters=frozenset({"$or"}),
+)
+
+ADMIN_ORDERS_GUARD = QueryGuard(
+    name="GET /admin/orders",
+    shapes=[
+        IndexedShape(frozenset(), ("created_at", "_id"), "idx_orders_created_at / _id_"),
+        IndexedShape(frozenset({"created_at"}), ("created_at",), "idx_orders_created_at"),
+        IndexedShape(frozenset({"status"}), ("created_at",), "idx_orders_status_created_at"),
+        IndexedShape(frozenset({"status", "created_at"}), ("created_at",), "idx_orders_status_created_at"),
+        IndexedShape(frozenset({"user_id"}), ("created_at",), "idx_orders_user_created_at"),
+        IndexedShape(frozenset({"user_id", "created_at"}), ("created_at",), "idx_orders_user_created_at"),
+        IndexedShape(frozenset({"user_id", "status"}), ("created_at",), "idx_orders_user_status_created_at"),
+        IndexedShape(frozenset({"user_id", "status", "created_at"}), ("created_at",), "idx_orders_user_status_created_at"),
+    ],
+    default_sort="created_at",
+    sort_aliases={"id": "_id"},
+)
@@ -0,0 +1,225 @@
+"""
+Perfilado a pedido de solicitudes individuales.
+
+Un admin agrega el header `X-Profile: 1` a una solicitud autenticada con su
+token; si `get_current_admin_user` lo acepta, esa solicitud corre bajo un
+profiler y el resultado se guarda en la colección capped `request_profiles`.
+La respuesta incluye `X-Profile-Id` para recuperarlo desde
+`GET /admin/profiles/{profile_id}` (con `?format=collapsed`, stacks colapsados
+listos para flamegraph.pl o speedscope).
+
+- Profiler: pyinstrument (muestreo, con soporte async) si está instalado; si
+  no, cProfile. cProfile mide todo el hilo del event loop mientras dura la
+  solicitud, así que también incluye lo que hagan otras solicitudes en paralelo.
+- Se perfila una solicitud a la vez por proceso; si llega otra, se atiende sin perfilar.
+- Las solicitudes sin el header solo pagan la búsqueda de ese header; con
+  PROFILING_ENABLED=false el middleware ni se instala.
+"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+import cProfile
+import logging
+import pstats
+import time
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from config import settings
+from database import get_collection
+from db_monitoring import current_route
+from security import decode_access_token, get_current_admin_user
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:  # Dependencia opcional
+    SamplingProfiler = None
+
+logger = logging.getLogger(__name__)
+
+PROFILES_COLLECTION = "request_profiles"
+PROFILE_HEADER = b"x-profile"
+# Stacks colapsados que se guardan por perfil (los de más peso) y funciones en el resumen
+MAX_COLLAPSED_STACKS = 2000
+TOP_FUNCTIONS = 25
+MAX_STACK_DEPTH = 64
+
+
+def _requested_token(scope) -> Optional[str]:
+    """Token bearer si la solicitud pide perfilado; None en cualquier otro caso."""
+    wants_profile = False
+    token = None
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            wants_profile = value.strip() in (b"1", b"true")
+        elif name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode("latin-1")
+    return token if wants_profile else None
+
+
+async def _profiling_admin(token: str):
+    try:
+        return await get_current_admin_user(decode_access_token(token))
+    except HTTPException:
+        return None
+
+
+# --- Stacks colapsados ("a;b;c peso" por línea, peso en microsegundos) ---
+
+def _pyinstrument_stacks(session) -> List[Tuple[str, int]]:
+    root = session.root_frame() if session else None
+    stacks = []
+
+    def walk(frame, path, depth):
+        label = f"{frame.function} ({frame.file_path_short}:{frame.line_no})"
+        path = f"{path};{label}" if path else label
+        weight = int(frame.self_time * 1_000_000)
+        if weight:
+            stacks.append((path, weight))
+        if depth < MAX_STACK_DEPTH:
+            for child in frame.children:
+                walk(child, path, depth + 1)
+
+    if root is not None:
+        walk(root, "", 0)
+    return stacks
+
+
+def _function_label(func) -> str:
+    filename, line, name = func
+    return f"{name} ({filename}:{line})" if line else name
+
+
+def _cprofile_stacks(stats: dict) -> List[Tuple[str, int]]:
+    """
+    cProfile solo registra pares llamador -> llamado: los stacks se reconstruyen
+    recorriendo ese grafo desde las raíces y repartiendo el tiempo de cada función
+    según la proporción que aportó cada llamador (aproximado).
+    """
+    children = {}
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    stacks = []
+
+    def walk(func, path, fraction, depth, visiting):
+        own_time = stats[func][2]
+        path = f"{path};{_function_label(func)}" if path else _function_label(func)
+        weight = int(own_time * fraction * 1_000_000)
+        if weight:
+            stacks.append((path, weight))
+        if depth >= MAX_STACK_DEPTH:
+            return
+        for child, edge_cumulative in children.get(func, []):
+            child_cumulative = stats[child][3]
+            if child in visiting or not child_cumulative:
+                continue
+            child_fraction = fraction * edge_cumulative / child_cumulative
+            if child_fraction * child_cumulative * 1_000_000 >= 1:
+                walk(child, path, child_fraction, depth + 1, visiting | {child})
+
+    for root in roots:
+        walk(root, "", 1.0, 0, {root})
+    return stacks
+
+
+def _top_functions(stacks: List[Tuple[str, int]]) -> List[dict]:
+    """Funciones con más tiempo propio (la última entrada de cada stack)."""
+    totals = {}
+    for path, weight in stacks:
+        leaf = path.rsplit(";", 1)[-1]
+        totals[leaf] = totals.get(leaf, 0) + weight
+    top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:TOP_FUNCTIONS]
+    return [{"function": name, "self_ms": round(weight / 1000, 2)} for name, weight in top]
+
+
+class _ProfilerRun:
+    """Envuelve pyinstrument o cProfile con la misma interfaz."""
+
+    def __init__(self):
+        if SamplingProfiler is not None:
+            self.kind = "pyinstrument"
+            self._profiler = SamplingProfiler(interval=settings.PROFILING_INTERVAL_MS / 1000, async_mode="enabled")
+        else:
+            self.kind = "cProfile"
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self) -> List[Tuple[str, int]]:
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            return _pyinstrument_stacks(self._profiler.last_session)
+        self._profiler.disable()
+        return _cprofile_stacks(pstats.Stats(self._profiler).stats)
+
+
+async def save_profile(document: dict) -> None:
+    try:
+        await get_collection(PROFILES_COLLECTION).insert_one(document)
+    except Exception as e:
+        logger.error(f"❌ No se pudo guardar el perfil {document['_id']}: {e}")
+
+
+class RequestProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        token = _requested_token(scope) if scope["type"] == "http" else None
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        admin = await _profiling_admin(token)
+        if admin is None or self._busy:
+            if admin is None:
+                logger.warning(f"⚠️ Perfilado pedido sin token de admin válido en {scope['path']}; se ignora.")
+            await self.app(scope, receive, send)
+            return
+
+        self._busy = True
+        profile_id = ObjectId()
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", str(profile_id).encode())]}
+            await send(message)
+
+        run = _ProfilerRun()
+        started = time.perf_counter()
+        run.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self._busy = False
+            stacks = run.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+
+        stacks.sort(key=lambda item: item[1], reverse=True)
+        await save_profile({
+            "_id": profile_id,
+            "created_at": datetime.utcnow(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": current_route.get(),
+            "status_code": status_code,
+            "duration_ms": round(duration_ms, 2),
+            "profiler": run.kind,
+            "requested_by": admin.username,
+            "top_functions": _top_functions(stacks),
+            "collapsed": "\n".join(f"{path} {weight}" for path, weight in stacks[:MAX_COLLAPSED_STACKS]),
+        })
+        logger.info(f"🔬 Perfil {profile_id} de {scope['method']} {scope['path']} guardado ({duration_ms:.0f}ms, {run.kind}).")
@@ -1,26 +1,104 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from typing import List, Optional, Literal
 from bson import ObjectId
 from datetime import datetime, timedelta
 
 from models import Order, UserResponse, OrderStatus, UserRole, TokenData
-from database import get_database, get_collection
+from database import get_database, get_read_collection, get_collection
 from security import get_current_admin_user
+from config import settings
+from export_helpers import iter_cursor_batches, map_batches, build_export_stream, export_headers, export_media_type
+from query_guard import ADMIN_USERS_GUARD, ADMIN_ORDERS_GUARD
+from db_monitoring import db_command_monitor
+from loop_monitor import loop_monitor
+from request_profiling import PROFILES_COLLECTION
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Colecciones de MongoDB
+# Colecciones de MongoDB (solo lecturas de reportes: pueden ir a un secundario, ver REPORTING_READ_PREFERENCE)
 def get_users_collection(db=Depends(get_database)):
-    return get_collection("users")
+    return get_read_collection("users", "reporting")
 
 def get_orders_collection(db=Depends(get_database)):
-    return get_collection("orders")
+    return get_read_collection("orders", "reporting")
 
 def get_products_collection(db=Depends(get_database)):
-    return get_collection("products")
+    return get_read_collection("products", "reporting")
+
+def get_payments_collection(db=Depends(get_database)):
+    return get_read_collection("payments", "reporting")
+
+
+# --- Construcción de filtros (compartida entre listados y exportaciones) ---
+
+def build_users_query(
+    search: Optional[str] = None,
+    role: Optional[UserRole] = None,
+    age_verified: Optional[bool] = None
+) -> dict:
+    """Construye el filtro de MongoDB para el listado de usuarios."""
+    query = {}
+
+    if search:
+        query["$or"] = [
+            {"username": {"$regex": search, "$options": "i"}},
+            {"email": {"$regex": search, "$options": "i"}}
+        ]
+
+    if role:
+        query["role"] = role.value
+
+    if age_verified is not None:
+        query["age_verified"] = age_verified
+
+    return query
+
+def build_orders_query(
+    status_filter: Optional[OrderStatus] = None,
+    user_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None
+) -> dict:
+    """Construye el filtro de MongoDB para el listado de pedidos."""
+    query = {}
+
+    if status_filter:
+        query["status"] = status_filter.value
+
+    if user_id:
+        query["user_id"] = user_id
+
+    if start_date or end_date:
+        query["created_at"] = {}
+        if start_date:
+            query["created_at"]["$gte"] = start_date
+        if end_date:
+            query["created_at"]["$lte"] = end_date
+
+    return query
+
+async def get_users_info(users_collection, user_ids: List[str]) -> dict:
+    """
+    Obtiene username/email de varios usuarios con una sola consulta.
+    Devuelve un diccionario {user_id: {"username": ..., "email": ...}}.
+    """
+    object_ids = list({ObjectId(uid) for uid in user_ids if ObjectId.is_valid(uid)})
+    users_info = {}
+    if object_ids:
+        users_cursor = users_collection.find(
+            {"_id": {"$in": object_ids}},
+            projection={"username": 1, "email": 1}
+        )
+        async for user in users_cursor:
+            users_info[str(user["_id"])] = {
+                "username": user.get("username", "Desconocido"),
+                "email": user.get("email", "N/A")
+            }
+    return users_info
 
 
 # --- Endpoint de Estadísticas ---
@@ -121,34 +199,25 @@ async def get_admin_users(
     search: Optional[str] = Query(None, min_length=2, description="Buscar por email o username"),
     role: Optional[UserRole] = Query(None, description="Filtrar por rol"),
     age_verified: Optional[bool] = Query(None, description="Filtrar por verificación de edad"),
-    sort_by: str = Query("created_at", description="Campo por el cual ordenar"),
+    sort_by: str = Query("created_at", description="Campo por el cual ordenar (created_at, username, email)"),
     sort_order: int = Query(-1, description="Orden: 1 ascendente, -1 descendente")
 ):
     """
     [Admin] Obtiene la lista completa de usuarios con opciones de filtrado y paginación.
+    Solo se permiten ordenamientos respaldados por índices (ver query_guard.py).
     Requiere permisos de administrador.
     """
+    # Construir query y validar el ordenamiento contra los índices declarados
+    query = build_users_query(search, role, age_verified)
+    sort_spec = ADMIN_USERS_GUARD.resolve_sort(query, sort_by, sort_order)
+    await ADMIN_USERS_GUARD.check_plan(users_collection, query, sort_spec, limit=skip + limit)
+
     try:
-        # Construir query
-        query = {}
-        
-        if search:
-            query["$or"] = [
-                {"username": {"$regex": search, "$options": "i"}},
-                {"email": {"$regex": search, "$options": "i"}}
-            ]
-        
-        if role:
-            query["role"] = role.value
-        
-        if age_verified is not None:
-            query["age_verified"] = age_verified
-        
         # Contar total de usuarios que coinciden con el filtro
         total = await users_collection.count_documents(query)
         
         # Obtener usuarios con paginación
-        users_cursor = users_collection.find(query).sort(sort_by, sort_order).skip(skip).limit(limit)
+        users_cursor = users_collection.find(query).sort(sort_spec).skip(skip).limit(limit)
         users_list = []
         
         async for user_doc in users_cursor:
@@ -185,45 +254,34 @@ async def get_admin_orders(
     user_id: Optional[str] = Query(None, description="Filtrar por ID de usuario"),
     start_date: Optional[datetime] = Query(None, description="Fecha de inicio para filtrar pedidos"),
     end_date: Optional[datetime] = Query(None, description="Fecha de fin para filtrar pedidos"),
-    sort_by: str = Query("created_at", description="Campo por el cual ordenar"),
+    sort_by: str = Query("created_at", description="Campo por el cual ordenar (created_at, _id)"),
     sort_order: int = Query(-1, description="Orden: 1 ascendente, -1 descendente")
 ):
     """
     [Admin] Obtiene la lista completa de pedidos con opciones de filtrado y paginación.
     Incluye información del usuario asociado a cada pedido.
+    Solo se permiten ordenamientos respaldados por índices (ver query_guard.py).
     Requiere permisos de administrador.
     """
+    # Construir query y validar el ordenamiento contra los índices declarados
+    query = build_orders_query(status_filter, user_id, start_date, end_date)
+    sort_spec = ADMIN_ORDERS_GUARD.resolve_sort(query, sort_by, sort_order)
+    await ADMIN_ORDERS_GUARD.check_plan(orders_collection, query, sort_spec, limit=skip + limit)
+
     try:
-        # Construir query
-        query = {}
-        
-        if status_filter:
-            query["status"] = status_filter.value
-        
-        if user_id:
-            query["user_id"] = user_id
-        
-        if start_date or end_date:
-            query["created_at"] = {}
-            if start_date:
-                query["created_at"]["$gte"] = start_date
-            if end_date:
-                query["created_at"]["$lte"] = end_date
-        
         # Contar total de pedidos que coinciden con el filtro
         total = await orders_collection.count_documents(query)
         
         # Obtener pedidos con paginación
-        orders_cursor = orders_collection.find(query).sort(sort_by, sort_order).skip(skip).limit(limit)
+        orders_cursor = orders_collection.find(query).sort(sort_spec).skip(skip).limit(limit)
+        orders_docs = await orders_cursor.to_list(length=limit)
         orders_list = []
         
-        async for order_doc in orders_cursor:
-            # Obtener información del usuario
-            user = await users_collection.find_one({"_id": ObjectId(order_doc["user_id"])})
-            user_info = {
-                "username": user.get("username", "Desconocido") if user else "Desconocido",
-                "email": user.get("email", "N/A") if user else "N/A"
-            }
+        # Obtener la información de todos los usuarios de la página en una sola consulta
+        users_info = await get_users_info(users_collection, [order_doc["user_id"] for order_doc in orders_docs])
+        
+        for order_doc in orders_docs:
+            user_info = users_info.get(order_doc["user_id"], {"username": "Desconocido", "email": "N/A"})
             
             # Agregar información del usuario al pedido
             order_with_user = Order(**order_doc)
@@ -245,3 +303,231 @@ async def get_admin_orders(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error al obtener la lista de pedidos."
         )
+
+
+# --- Endpoints de Exportación (streaming) ---
+
+EXPORT_USER_FIELDS = ["id", "username", "email", "role", "age_verified", "birth_date", "created_at"]
+EXPORT_ORDER_FIELDS = [
+    "id", "user_id", "username", "email", "status", "total_amount", "items_count", "items",
+    "payment_id", "payment_preference_id", "created_at", "updated_at"
+]
+EXPORT_PAYMENT_FIELDS = [
+    "id", "status", "status_detail", "external_reference", "transaction_amount",
+    "currency_id", "payment_method_id", "date_created", "date_approved"
+]
+
+def _user_export_row(user_doc: dict) -> dict:
+    return {
+        "id": str(user_doc["_id"]),
+        "username": user_doc.get("username"),
+        "email": user_doc.get("email"),
+        "role": user_doc.get("role"),
+        "age_verified": user_doc.get("age_verified", False),
+        "birth_date": user_doc.get("birth_date"),
+        "created_at": user_doc.get("created_at", user_doc["_id"].generation_time),
+    }
+
+def _order_export_row(order_doc: dict, user_info: dict, export_format: str) -> dict:
+    items = [
+        {
+            "product_id": str(item.get("product_id")),
+            "name": item.get("name"),
+            "quantity": item.get("quantity"),
+            "price_at_purchase": item.get("price_at_purchase"),
+        }
+        for item in order_doc.get("items", [])
+    ]
+    if export_format == "csv":
+        # En CSV los ítems se aplanan en una sola columna legible
+        items = "; ".join(f"{item['name']} x{item['quantity']} @ {item['price_at_purchase']}" for item in items)
+    return {
+        "id": str(order_doc["_id"]),
+        "user_id": order_doc.get("user_id"),
+        "username": user_info.get("username", "Desconocido"),
+        "email": user_info.get("email", "N/A"),
+        "status": order_doc.get("status"),
+        "total_amount": order_doc.get("total_amount"),
+        "items_count": len(order_doc.get("items", [])),
+        "items": items,
+        "payment_id": order_doc.get("payment_id"),
+        "payment_preference_id": order_doc.get("payment_preference_id"),
+        "created_at": order_doc.get("created_at"),
+        "updated_at": order_doc.get("updated_at"),
+    }
+
+# Columnas de la exportación -> campo del documento compacto de payments (ver payment_store.py)
+COMPACT_PAYMENT_FIELDS = {"transaction_amount": "amount", "currency_id": "currency", "payment_method_id": "payment_method"}
+
+def _payment_export_row(payment_doc: dict) -> dict:
+    row = {field: payment_doc.get(COMPACT_PAYMENT_FIELDS.get(field, field), payment_doc.get(field)) for field in EXPORT_PAYMENT_FIELDS}
+    row["id"] = payment_doc.get("id", str(payment_doc["_id"]))
+    return row
+
+def _streaming_export(rows, filename: str, export_format: str, fieldnames: List[str], gzip: bool) -> StreamingResponse:
+    return StreamingResponse(
+        build_export_stream(rows, export_format, fieldnames, use_gzip=gzip),
+        media_type=export_media_type(export_format, gzip),
+        headers=export_headers(filename, export_format, gzip)
+    )
+
+
+@router.get("/export/users", tags=["Admin"])
+async def export_users(
+    users_collection = Depends(get_users_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    format: Literal["csv", "ndjson"] = Query("csv", description="Formato de exportación"),
+    gzip: bool = Query(False, description="Comprimir la exportación con gzip"),
+    search: Optional[str] = Query(None, min_length=2, description="Buscar por email o username"),
+    role: Optional[UserRole] = Query(None, description="Filtrar por rol"),
+    age_verified: Optional[bool] = Query(None, description="Filtrar por verificación de edad")
+):
+    """
+    [Admin] Exporta usuarios en CSV o NDJSON mediante streaming.
+    Acepta los mismos filtros que el listado de usuarios.
+    """
+    query = build_users_query(search, role, age_verified)
+    cursor = users_collection.find(query, projection={"hashed_password": 0}).sort("_id", 1)
+
+    async def transform(batch: List[dict]) -> List[dict]:
+        return [_user_export_row(user_doc) for user_doc in batch]
+
+    rows = map_batches(iter_cursor_batches(cursor, settings.EXPORT_BATCH_SIZE), transform)
+    logger.info(f"Admin {current_admin_user.username} inició una exportación de usuarios ({format}).")
+    return _streaming_export(rows, "users", format, EXPORT_USER_FIELDS, gzip)
+
+
+@router.get("/export/orders", tags=["Admin"])
+async def export_orders(
+    orders_collection = Depends(get_orders_collection),
+    users_collection = Depends(get_users_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    format: Literal["csv", "ndjson"] = Query("csv", description="Formato de exportación"),
+    gzip: bool = Query(False, description="Comprimir la exportación con gzip"),
+    status_filter: Optional[OrderStatus] = Query(None, description="Filtrar por estado del pedido"),
+    user_id: Optional[str] = Query(None, description="Filtrar por ID de usuario"),
+    start_date: Optional[datetime] = Query(None, description="Fecha de inicio para filtrar pedidos"),
+    end_date: Optional[datetime] = Query(None, description="Fecha de fin para filtrar pedidos")
+):
+    """
+    [Admin] Exporta pedidos en CSV o NDJSON mediante streaming.
+    Acepta los mismos filtros que el listado de pedidos e incluye username/email,
+    resueltos con una sola consulta por lote.
+    """
+    query = build_orders_query(status_filter, user_id, start_date, end_date)
+    cursor = orders_collection.find(query).sort("_id", 1)
+
+    async def transform(batch: List[dict]) -> List[dict]:
+        users_info = await get_users_info(users_collection, [order_doc["user_id"] for order_doc in batch])
+        return [
+            _order_export_row(order_doc, users_info.get(order_doc["user_id"], {}), format)
+            for order_doc in batch
+        ]
+
+    rows = map_batches(iter_cursor_batches(cursor, settings.EXPORT_BATCH_SIZE), transform)
+    logger.info(f"Admin {current_admin_user.username} inició una exportación de pedidos ({format}).")
+    return _streaming_export(rows, "orders", format, EXPORT_ORDER_FIELDS, gzip)
+
+
+@router.get("/export/payments", tags=["Admin"])
+async def export_payments(
+    payments_collection = Depends(get_payments_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    format: Literal["csv", "ndjson"] = Query("csv", description="Formato de exportación"),
+    gzip: bool = Query(False, description="Comprimir la exportación con gzip"),
+    payment_status: Optional[str] = Query(None, description="Filtrar por estado del pago en Mercado Pago (ej. 'approved')"),
+    external_reference: Optional[str] = Query(None, description="Filtrar por ID de pedido (external_reference)")
+):
+    """
+    [Admin] Exporta los eventos de pago recibidos de Mercado Pago en CSV o NDJSON.
+    """
+    query = {}
+    if payment_status:
+        query["status"] = payment_status
+    if external_reference:
+        query["external_reference"] = external_reference
+
+    projection = {field: 1 for field in [*EXPORT_PAYMENT_FIELDS, *COMPACT_PAYMENT_FIELDS.values()]}
+    cursor = payments_collection.find(query, projection=projection).sort("_id", 1)
+
+    async def transform(batch: List[dict]) -> List[dict]:
+        return [_payment_export_row(payment_doc) for payment_doc in batch]
+
+    rows = map_batches(iter_cursor_batches(cursor, settings.EXPORT_BATCH_SIZE), transform)
+    logger.info(f"Admin {current_admin_user.username} inició una exportación de pagos ({format}).")
+    return _streaming_export(rows, "payments", format, EXPORT_PAYMENT_FIELDS, gzip)
+
+
+# --- Diagnóstico de MongoDB ---
+
+@router.get("/diagnostics/db", tags=["Admin"])
+async def get_db_diagnostics(
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    limit: int = Query(20, ge=1, le=200, description="Cantidad de entradas por sección")
+):
+    """
+    [Admin] Comandos de MongoDB de este proceso: los que más tiempo acumulan (por
+    colección, comando y ruta), los últimos comandos lentos con el filtro redactado
+    y los explain muestreados (documentos examinados vs. devueltos, COLLSCAN).
+    Con varios workers cubre solo el que atiende la solicitud (campo `process`);
+    los totales de todos los workers están en /metrics.
+    """
+    return db_command_monitor.snapshot(limit)
+
+@router.delete("/diagnostics/db", status_code=status.HTTP_204_NO_CONTENT, tags=["Admin"])
+async def reset_db_diagnostics(
+    current_admin_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    [Admin] Reinicia los agregados del diagnóstico de MongoDB de este worker (no afecta /metrics).
+    """
+    db_command_monitor.reset()
+    logger.info(f"Admin {current_admin_user.username} reinició el diagnóstico de MongoDB.")
+
+@router.get("/diagnostics/loop", tags=["Admin"])
+async def get_loop_diagnostics(
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    limit: int = Query(20, ge=1, le=100, description="Cantidad de bloqueos recientes")
+):
+    """
+    [Admin] Lag del event loop de este proceso (p50/p95/p99) y los últimos bloqueos
+    con la ruta y el stack capturado. Requiere LOOP_MONITOR_ENABLED.
+    Con varios workers cubre solo el que atiende la solicitud (campo `process`).
+    """
+    return loop_monitor.snapshot(limit)
+
+@router.get("/profiles", tags=["Admin"])
+async def list_request_profiles(
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    limit: int = Query(20, ge=1, le=100, description="Cantidad de perfiles")
+):
+    """
+    [Admin] Últimos perfiles de solicitudes pedidos con el header `X-Profile: 1`
+    (sin los stacks; ver GET /admin/profiles/{profile_id}).
+    """
+    # Colección capped: el orden natural inverso devuelve los más recientes sin índice
+    cursor = get_collection(PROFILES_COLLECTION).find({}, projection={"collapsed": 0}).sort("$natural", -1).limit(limit)
+    profiles = []
+    async for profile in cursor:
+        profile["_id"] = str(profile["_id"])
+        profiles.append(profile)
+    return profiles
+
+@router.get("/profiles/{profile_id}", tags=["Admin"])
+async def get_request_profile(
+    profile_id: str,
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    format: Literal["json", "collapsed"] = Query("json", description="collapsed: stacks colapsados para flamegraph.pl / speedscope")
+):
+    """
+    [Admin] Perfil de una solicitud (el ID llega en el header `X-Profile-Id` de la respuesta).
+    """
+    if not ObjectId.is_valid(profile_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de perfil inválido.")
+    profile = await get_collection(PROFILES_COLLECTION).find_one({"_id": ObjectId(profile_id)})
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Perfil no encontrado (puede haber sido descartado de la colección capped).")
+    if format == "collapsed":
+        return PlainTextResponse(profile["collapsed"])
+    profile["_id"] = str(profile["_id"])
+    return profile
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm # Para el formulario de login OAuth2
 from fastapi_limiter.depends import RateLimiter
 from datetime import timedelta, datetime
@@ -10,6 +10,7 @@ from models import UserRegister, UserLogin, UserResponse, Token, TokenResponse,
 from security import get_password_hash, verify_password, create_access_token, create_refresh_token, hash_token, verify_refresh_token, get_current_user_token_data
 from database import get_database, get_collection
 from config import settings
+from audit_logger import log_audit, AuditEvent
 import logging
 
 logger = logging.getLogger(__name__)
@@ -73,6 +74,7 @@ async def create_user_in_db(collection, user_data: UserRegister) -> UserResponse
 @router.post("/register", status_code=status.HTTP_201_CREATED, operation_id="auth_register_user")
 async def register_user(
     user_data: UserRegister,
+    request: Request,
     users_collection = Depends(get_users_collection)
 ):
     """
@@ -95,6 +97,7 @@ async def register_user(
 
     # Crear el usuario en la base de datos
     new_user = await create_user_in_db(users_collection, user_data)
+    log_audit(AuditEvent.USER_REGISTERED, request, {"user_id": str(new_user.id), "username": new_user.username})
     
     logger.info(f"Usuario {new_user.username} registrado con éxito.")
     return new_user
@@ -103,6 +106,7 @@ async def register_user(
 @router.post("/token", response_model=TokenResponse, operation_id="auth_login_token", dependencies=[Depends(RateLimiter(times=5, seconds=60))])
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    request: Request,
     users_collection = Depends(get_users_collection),
     refresh_tokens_collection = Depends(get_refresh_tokens_collection)
 ):
@@ -112,6 +116,7 @@ async def login_for_access_token(
     """
     user = await get_user_by_username_or_email(users_collection, form_data.username)
     if not user or not verify_password(form_data.password, user["hashed_password"]):
+        log_audit(AuditEvent.USER_LOGIN_FAILED, request, {"username": form_data.username, "user_exists": user is not None})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nombre de usuario o contraseña incorrectos",
@@ -149,6 +154,7 @@ async def login_for_access_token(
         "revoked": False
     }
     await refresh_tokens_collection.insert_one(refresh_token_data)
+    log_audit(AuditEvent.USER_LOGIN_SUCCESS, request, {"user_id": str(user["_id"]), "username": user["username"]})
     
     logger.info(f"Usuario {user['username']} ha iniciado sesión y recibido tokens.")
     return {
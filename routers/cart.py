@@ -3,8 +3,10 @@ from typing import List, Optional
 from bson import ObjectId
 
 from models import Cart, CartItem, Product, TokenData, UserRole
-from database import get_database, get_collection
+from database import get_database, get_collection, get_consistent_collection, get_causal_session
 from security import get_current_active_user_id, get_current_verified_user # Importamos dependencia para usuario activo y verificado
+from config import settings
+from stock_holds import place_hold, release_hold, release_user_holds
 
 import logging
 
@@ -14,26 +16,26 @@ router = APIRouter()
 
 # Colecciones de MongoDB
 def get_carts_collection(db=Depends(get_database)):
-    return get_collection("carts")
+    return get_consistent_collection("carts")
 
 def get_products_collection(db=Depends(get_database)):
     return get_collection("products")
 
 # --- Funciones auxiliares para el carrito ---
-async def get_user_cart(carts_collection, user_id: str) -> Optional[Cart]:
+async def get_user_cart(carts_collection, user_id: str, session=None) -> Optional[Cart]:
     """Obtiene el carrito de un usuario, o crea uno si no existe."""
-    cart_db = await carts_collection.find_one({"user_id": user_id})
+    cart_db = await carts_collection.find_one({"user_id": user_id}, session=session)
     if cart_db:
         cart_db["_id"] = str(cart_db["_id"]) # Convertir ObjectId a str para Pydantic
         return Cart(**cart_db)
     
     # Si no existe, creamos un carrito vacío para el usuario
     new_cart_data = {"user_id": user_id, "items": []}
-    result = await carts_collection.insert_one(new_cart_data)
+    result = await carts_collection.insert_one(new_cart_data, session=session)
     new_cart_data["_id"] = str(result.inserted_id) # Aseguramos que el ID esté presente para Pydantic
     return Cart(**new_cart_data)
 
-async def save_cart(carts_collection, cart: Cart):
+async def save_cart(carts_collection, cart: Cart, session=None):
     """Guarda o actualiza un carrito en la base de datos."""
     cart_dict = cart.model_dump(by_alias=True, exclude_unset=True)
     
@@ -41,10 +43,11 @@ async def save_cart(carts_collection, cart: Cart):
     if cart.id:
         await carts_collection.update_one(
             {"_id": ObjectId(cart.id)},
-            {"$set": {"items": cart_dict["items"], "user_id": cart_dict["user_id"]}}
+            {"$set": {"items": cart_dict["items"], "user_id": cart_dict["user_id"]}},
+            session=session
         )
     else: # Si no tiene _id, es un nuevo carrito
-        result = await carts_collection.insert_one(cart_dict)
+        result = await carts_collection.insert_one(cart_dict, session=session)
         cart.id = str(result.inserted_id) # Actualizamos el ID en el objeto Python
     return cart
 
@@ -53,6 +56,7 @@ async def save_cart(carts_collection, cart: Cart):
 async def get_cart(
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
+    session = Depends(get_causal_session),
     # Requiere que el usuario esté verificado para ver el carrito de bebidas alcohólicas
     # Opcional: podrías permitir ver el carrito sin verificar, pero no avanzar al checkout
     current_verified_user: TokenData = Depends(get_current_verified_user) 
@@ -61,7 +65,7 @@ async def get_cart(
     Obtiene el carrito de compras del usuario autenticado. Si no existe, crea uno vacío.
     Requiere que el usuario haya verificado su mayoría de edad.
     """
-    cart = await get_user_cart(carts_collection, user_id)
+    cart = await get_user_cart(carts_collection, user_id, session)
     return cart
 
 @router.post("/add", response_model=Cart)
@@ -69,6 +73,7 @@ async def add_to_cart(
     cart_item_data: CartItem,
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
+    session = Depends(get_causal_session),
     products_collection = Depends(get_products_collection),
     current_verified_user: TokenData = Depends(get_current_verified_user)
 ):
@@ -77,12 +82,12 @@ async def add_to_cart(
     Requiere que el usuario haya verificado su mayoría de edad.
     """
     # 1. Verificar que el producto exista
-    product_db = await products_collection.find_one({"_id": ObjectId(cart_item_data.product_id)})
+    product_db = await products_collection.find_one({"_id": ObjectId(cart_item_data.product_id)}, session=session)
     if not product_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
     
     # 2. Obtener o crear el carrito del usuario
-    cart = await get_user_cart(carts_collection, user_id)
+    cart = await get_user_cart(carts_collection, user_id, session)
 
     # 3. Calcular la cantidad total que tendría el producto en el carrito
     existing_quantity = 0
@@ -94,7 +99,10 @@ async def add_to_cart(
     total_quantity = existing_quantity + cart_item_data.quantity
     
     # 4. Verificar que el stock sea suficiente para la cantidad TOTAL
-    if product_db.get("stock", 0) < total_quantity:
+    if settings.CART_RESERVATIONS_ENABLED:
+        # Reserva con vencimiento: descuenta las unidades reservadas en otros carritos
+        await place_hold(user_id, product_db, total_quantity)
+    elif product_db.get("stock", 0) < total_quantity:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Stock insuficiente para el producto '{product_db['name']}'. Solo quedan {product_db.get('stock', 0)} unidades y ya tienes {existing_quantity} en el carrito."
@@ -112,7 +120,7 @@ async def add_to_cart(
         cart.items.append(cart_item_data)
     
     # 6. Guardar el carrito actualizado
-    await save_cart(carts_collection, cart)
+    await save_cart(carts_collection, cart, session)
     logger.info(f"Usuario {user_id} añadió/actualizó producto {cart_item_data.product_id} en el carrito. Cantidad total: {total_quantity}")
     return cart
 
@@ -121,6 +129,7 @@ async def update_cart_item_quantity(
     cart_item_data: CartItem, # product_id y la nueva cantidad total deseada
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
+    session = Depends(get_causal_session),
     products_collection = Depends(get_products_collection),
     current_verified_user: TokenData = Depends(get_current_verified_user)
 ):
@@ -131,18 +140,22 @@ async def update_cart_item_quantity(
     """
     # 1. Verificar stock si la cantidad es > 0
     if cart_item_data.quantity > 0:
-        product_db = await products_collection.find_one({"_id": ObjectId(cart_item_data.product_id)})
+        product_db = await products_collection.find_one({"_id": ObjectId(cart_item_data.product_id)}, session=session)
         if not product_db:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
         
-        if product_db.get("stock", 0) < cart_item_data.quantity:
+        if settings.CART_RESERVATIONS_ENABLED:
+            await place_hold(user_id, product_db, cart_item_data.quantity)
+        elif product_db.get("stock", 0) < cart_item_data.quantity:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Stock insuficiente para el producto '{product_db['name']}'. Solo quedan {product_db.get('stock', 0)} unidades."
             )
+    elif settings.CART_RESERVATIONS_ENABLED:
+        await release_hold(user_id, ObjectId(cart_item_data.product_id))
             
     # 2. Obtener el carrito del usuario
-    cart = await get_user_cart(carts_collection, user_id)
+    cart = await get_user_cart(carts_collection, user_id, session)
 
     # 3. Actualizar la cantidad o eliminar
     updated_items = []
@@ -163,7 +176,7 @@ async def update_cart_item_quantity(
     cart.items = updated_items
     
     # 4. Guardar el carrito actualizado
-    await save_cart(carts_collection, cart)
+    await save_cart(carts_collection, cart, session)
     logger.info(f"Usuario {user_id} actualizó cantidad de producto {cart_item_data.product_id} a {cart_item_data.quantity} en el carrito.")
     return cart
 
@@ -172,6 +185,7 @@ async def remove_from_cart(
     product_id: str,
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
+    session = Depends(get_causal_session),
     current_verified_user: TokenData = Depends(get_current_verified_user)
 ):
     """
@@ -181,7 +195,7 @@ async def remove_from_cart(
     if not ObjectId.is_valid(product_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de producto inválido.")
 
-    cart = await get_user_cart(carts_collection, user_id)
+    cart = await get_user_cart(carts_collection, user_id, session)
     
     original_item_count = len(cart.items)
     cart.items = [item for item in cart.items if item.product_id != product_id]
@@ -189,7 +203,9 @@ async def remove_from_cart(
     if len(cart.items) == original_item_count:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="El producto no está en el carrito.")
 
-    await save_cart(carts_collection, cart)
+    await save_cart(carts_collection, cart, session)
+    if settings.CART_RESERVATIONS_ENABLED:
+        await release_hold(user_id, ObjectId(product_id))
     logger.info(f"Usuario {user_id} eliminó producto {product_id} del carrito.")
     return cart
 
@@ -197,14 +213,17 @@ async def remove_from_cart(
 async def clear_cart(
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
+    session = Depends(get_causal_session),
     current_verified_user: TokenData = Depends(get_current_verified_user)
 ):
     """
     Vacía completamente el carrito de compras del usuario.
     Requiere que el usuario haya verificado su mayoría de edad.
     """
-    cart = await get_user_cart(carts_collection, user_id)
+    cart = await get_user_cart(carts_collection, user_id, session)
     cart.items = [] # Vaciar la lista de ítems
-    await save_cart(carts_collection, cart)
+    await save_cart(carts_collection, cart, session)
+    if settings.CART_RESERVATIONS_ENABLED:
+        await release_user_holds(user_id)
     logger.info(f"Usuario {user_id} ha vaciado su carrito.")
     return cart
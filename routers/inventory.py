@@ -1,20 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+from typing import List, Optional
 from bson import ObjectId
 from datetime import datetime
+from collections import Counter
+import base64
+from pymongo import UpdateOne, ReturnDocument
 
-from models import Product, InventoryAlert, TokenData
+from models import StockMovementReason, Product, InventoryAlert, InventoryAlertStatus, InventoryAlertPage, InventoryAlertSummary, TokenData, StockUpdateMode, BulkStockUpdate, BulkStockItemResult, BulkStockUpdateResponse
 from database import get_database, get_collection
 from security import get_current_admin_user
+from config import settings
+from stock_alerts import LOW_STOCK_THRESHOLD
+from inventory_ledger import StockMovement, run_stock_write
+from stock_shards import compensate_stock_set, enable_stock_shards, disable_stock_shards, current_stock
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Umbral para generar alertas de bajo inventario
-LOW_STOCK_THRESHOLD = 10
-
 # Colecciones de MongoDB
 def get_products_collection(db=Depends(get_database)):
     return get_collection("products")
@@ -22,39 +26,103 @@ def get_alerts_collection(db=Depends(get_database)):
     return get_collection("inventory_alerts")
 
 
-async def check_and_create_alert(products_collection, alerts_collection, product_id: str):
+# --- Endpoints de Inventario (Solo Admin) ---
+
+@router.put("/stock/bulk", response_model=BulkStockUpdateResponse)
+async def bulk_update_stock(
+    payload: BulkStockUpdate,
+    products_collection = Depends(get_products_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user)
+):
     """
-    Verifica el stock de un producto y crea una alerta si es bajo.
+    [Admin] Actualiza el stock de muchos productos en una sola llamada.
+    Cada ítem puede establecer el stock ('set') o sumarle una cantidad ('add').
+    Todos los cambios se aplican con un único bulk_write no ordenado; las
+    alertas de bajo stock las evalúa el detector en segundo plano.
     """
-    product = await products_collection.find_one({"_id": ObjectId(product_id)})
-    if product and product.get("stock", 0) <= LOW_STOCK_THRESHOLD:
-        alert_message = f"El stock del producto '{product['name']}' es bajo ({product['stock']})."
-        
-        # Opcional: Evitar duplicar alertas si ya existe una reciente
-        existing_alert = await alerts_collection.find_one({
-            "product_id": product_id,
-            "message": alert_message
-        })
-        if not existing_alert:
-            alert = InventoryAlert(
-                _id = None,
-                product_id=product_id,
-                product_name=product["name"],
-                current_stock=product["stock"],
-                threshold=LOW_STOCK_THRESHOLD,
-                message=alert_message
+    # Un resultado por ítem, en el orden del pedido (un mismo product_id puede venir más de una vez)
+    results: List[Optional[BulkStockItemResult]] = [None] * len(payload.items)
+    operations = []
+    movements = {}
+    valid_ids: List[ObjectId] = []
+    item_index = {}
+    # Un producto repetido se rechaza: con un bulk_write no ordenado el resultado dependería del orden de ejecución
+    occurrences = Counter(ObjectId(item.product_id) for item in payload.items if ObjectId.is_valid(item.product_id))
+
+    # 1. Validar ítems y construir las operaciones
+    for index, item in enumerate(payload.items):
+        if not ObjectId.is_valid(item.product_id):
+            results[index] = BulkStockItemResult(product_id=item.product_id, status="invalid", detail="ID de producto inválido.")
+            continue
+        product_oid = ObjectId(item.product_id)
+        if occurrences[product_oid] > 1:
+            results[index] = BulkStockItemResult(product_id=item.product_id, status="invalid", detail="Producto repetido en el lote.")
+            continue
+
+        update = {"$set": {"stock": item.quantity}} if item.mode == StockUpdateMode.SET else {"$inc": {"stock": item.quantity}}
+        operations.append(UpdateOne({"_id": product_oid}, update))
+        movements[product_oid] = StockMovement(
+            product_id=product_oid,
+            reason=StockMovementReason.MANUAL_SET if item.mode == StockUpdateMode.SET else StockMovementReason.MANUAL_ADD,
+            delta=item.quantity if item.mode == StockUpdateMode.ADD else 0,
+            set_to=item.quantity if item.mode == StockUpdateMode.SET else None
+        )
+        valid_ids.append(product_oid)
+        item_index[product_oid] = index  # El resultado se completa después de la escritura
+
+    matched = modified = 0
+
+    if operations:
+        async def write_batch(session):
+            # 2. Aplicar todos los cambios con un solo round trip
+            bulk_result = await products_collection.bulk_write(operations, ordered=False, session=session)
+
+            # 3. Leer el estado final del lote con una sola consulta
+            products_cursor = products_collection.find(
+                {"_id": {"$in": valid_ids}},
+                projection={"name": 1, "stock": 1, "stock_shards": 1, "stock_cached": 1},
+                session=session
             )
-            await alerts_collection.insert_one(alert.model_dump())
-            logger.warning(f"ALERTA DE INVENTARIO: {alert_message}")
+            updated_products = [p async for p in products_cursor]
 
-# --- Endpoints de Inventario (Solo Admin) ---
+            # Productos con stock en shards: los 'set' se compensan para que el total real sea el fijado
+            await compensate_stock_set([p for p in updated_products if movements[p["_id"]].set_to is not None], session=session)
+
+            # 4. Movimientos de los productos existentes, para el ledger
+            return (bulk_result, updated_products), [movements[p["_id"]] for p in updated_products]
+
+        # Cambios de stock y ledger en el mismo lote (avisa al detector de bajo stock, que evalúa fuera del request)
+        bulk_result, updated_products = await run_stock_write(write_batch)
+        matched, modified = bulk_result.matched_count, bulk_result.modified_count
+
+        found = {p["_id"]: p for p in updated_products}
+        for oid in valid_ids:
+            index = item_index[oid]
+            pid = payload.items[index].product_id
+            product = found.get(oid)
+            if product:
+                results[index] = BulkStockItemResult(
+                    product_id=pid,
+                    status="updated",
+                    stock=product.get("stock"),
+                    low_stock=product.get("stock", 0) <= LOW_STOCK_THRESHOLD
+                )
+            else:
+                results[index] = BulkStockItemResult(product_id=pid, status="not_found", detail="Producto no encontrado.")
+
+    logger.info(f"Admin {current_admin_user.username} actualizó el stock de {matched} productos en lote ({len(payload.items)} ítems recibidos).")
+    return BulkStockUpdateResponse(
+        matched=matched,
+        modified=modified,
+        low_stock_count=sum(1 for r in results if r.low_stock),
+        results=results
+    )
 
 @router.put("/{product_id}/stock", response_model=Product)
 async def update_product_stock(
     product_id: str,
     new_stock: int = Body(..., embed=True, ge=0), # Recibe un JSON como {"new_stock": 50}
     products_collection = Depends(get_products_collection),
-    alerts_collection = Depends(get_alerts_collection),
     current_admin_user: TokenData = Depends(get_current_admin_user)
 ):
     """
@@ -63,18 +131,28 @@ async def update_product_stock(
     if not ObjectId.is_valid(product_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de producto inválido.")
 
-    result = await products_collection.update_one(
-        {"_id": ObjectId(product_id)},
-        {"$set": {"stock": new_stock}}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
-
-    # Verificar si se debe generar una alerta después de la actualización
-    await check_and_create_alert(products_collection, alerts_collection, product_id)
-    
-    updated_product = await products_collection.find_one({"_id": ObjectId(product_id)})
+    async def set_stock(session):
+        # Actualizar y obtener el documento previo en una sola operación (para registrar el delta exacto)
+        previous_product = await products_collection.find_one_and_update(
+            {"_id": ObjectId(product_id)},
+            {"$set": {"stock": new_stock}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not previous_product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
+        updated_product = {**previous_product, "stock": new_stock}
+        await compensate_stock_set([updated_product], session=session)
+        return updated_product, [StockMovement(
+            product_id=product_id,
+            reason=StockMovementReason.MANUAL_SET,
+            delta=new_stock - previous_product.get("stock", 0),
+            set_to=new_stock
+        )]
+
+    # Cambio de stock y movimiento en el ledger en el mismo lote (avisa al detector de bajo stock)
+    updated_product = await run_stock_write(set_stock)
+
     logger.info(f"Admin {current_admin_user.username} actualizó el stock del producto {product_id} a {new_stock}.")
     return Product(**updated_product)
 
@@ -83,7 +161,6 @@ async def add_to_product_stock(
     product_id: str,
     quantity_to_add: int = Body(..., embed=True, gt=0), # Recibe {"quantity_to_add": 10}
     products_collection = Depends(get_products_collection),
-    alerts_collection = Depends(get_alerts_collection),
     current_admin_user: TokenData = Depends(get_current_admin_user)
 ):
     """
@@ -92,28 +169,110 @@ async def add_to_product_stock(
     if not ObjectId.is_valid(product_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de producto inválido.")
 
-    result = await products_collection.update_one(
-        {"_id": ObjectId(product_id)},
-        {"$inc": {"stock": quantity_to_add}}
-    )
+    async def add_stock(session):
+        # Actualizar y obtener el documento resultante en una sola operación
+        updated_product = await products_collection.find_one_and_update(
+            {"_id": ObjectId(product_id)},
+            {"$inc": {"stock": quantity_to_add}},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if not updated_product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
+        return updated_product, [StockMovement(
+            product_id=product_id,
+            reason=StockMovementReason.MANUAL_ADD,
+            delta=quantity_to_add
+        )]
+
+    # Cambio de stock y movimiento en el ledger en el mismo lote (avisa al detector de bajo stock)
+    updated_product = await run_stock_write(add_stock)
 
-    if result.matched_count == 0:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
-    
-    # Verificar si se debe generar una alerta
-    await check_and_create_alert(products_collection, alerts_collection, product_id)
-    
-    updated_product = await products_collection.find_one({"_id": ObjectId(product_id)})
     logger.info(f"Admin {current_admin_user.username} añadió {quantity_to_add} unidades al stock del producto {product_id}.")
     return Product(**updated_product)
 
-@router.get("/alerts", response_model=List[InventoryAlert])
+@router.put("/{product_id}/stock/shards", response_model=Product)
+async def set_product_stock_shards(
+    product_id: str,
+    shards: int = Body(..., embed=True, ge=0, le=settings.STOCK_SHARDS_MAX), # Recibe {"shards": 8}; 0 desactiva
+    current_admin_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    [Admin] Reparte el stock de un producto en N contadores (shards) para soportar
+    muchas compras concurrentes (ej. ventas flash). Con 0 se vuelve al modo normal.
+    En este modo el stock de los listados se actualiza cada STOCK_SHARDS_REFRESH_SECONDS.
+    """
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de producto inválido.")
+
+    if shards > 0:
+        product = await enable_stock_shards(ObjectId(product_id), shards)
+    else:
+        product = await disable_stock_shards(ObjectId(product_id))
+
+    product["stock"] = max(await current_stock(product), 0)
+    logger.info(f"Admin {current_admin_user.username} configuró {shards} shards de stock para el producto {product_id}.")
+    return Product(**product)
+
+# --- Feed de alertas (paginación por cursor sobre el índice (timestamp, _id)) ---
+
+def encode_alert_cursor(alert: dict) -> str:
+    """Codifica la posición (timestamp, _id) de la última alerta de una página."""
+    raw = f"{alert['timestamp'].isoformat()}|{alert['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_alert_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, alert_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(alert_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido.")
+
+@router.get("/alerts", response_model=InventoryAlertPage)
 async def get_inventory_alerts(
+    alerts_collection = Depends(get_alerts_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user),
+    alert_status: Optional[InventoryAlertStatus] = Query(None, alias="status", description="Filtrar por estado (open / resolved)"),
+    limit: int = Query(50, ge=1, le=200, description="Cantidad de alertas por página"),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto por la página anterior")
+):
+    """
+    [Admin] Obtiene las alertas de bajo inventario, de la más reciente a la más antigua.
+    Cada producto tiene como máximo una alerta abierta; las resueltas conservan su historial
+    durante INVENTORY_ALERTS_RETENTION_DAYS días.
+    Usa paginación por cursor: pasar `next_cursor` para obtener la página siguiente.
+    """
+    query = {}
+    if alert_status:
+        query["status"] = alert_status.value
+
+    if cursor:
+        last_timestamp, last_id = decode_alert_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": last_timestamp}},
+            {"timestamp": last_timestamp, "_id": {"$lt": last_id}}
+        ]
+
+    # Pedimos un elemento extra para saber si hay página siguiente
+    alerts_cursor = alerts_collection.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1)
+    alerts = await alerts_cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        next_cursor = encode_alert_cursor(alerts[-1])
+
+    return InventoryAlertPage(items=[InventoryAlert(**alert) for alert in alerts], next_cursor=next_cursor)
+
+@router.get("/alerts/summary", response_model=InventoryAlertSummary)
+async def get_inventory_alerts_summary(
     alerts_collection = Depends(get_alerts_collection),
     current_admin_user: TokenData = Depends(get_current_admin_user)
 ):
     """
-    [Admin] Obtiene una lista de todas las alertas de bajo inventario.
+    [Admin] Cantidad de alertas abiertas y resueltas.
+    Se resuelve con conteos sobre el índice de estado, sin leer los documentos.
     """
-    alerts_cursor = alerts_collection.find().sort("timestamp", -1)
-    return [InventoryAlert(**alert) async for alert in alerts_cursor]
\ No newline at end of file
+    open_count = await alerts_collection.count_documents({"status": InventoryAlertStatus.OPEN.value})
+    resolved_count = await alerts_collection.count_documents({"status": InventoryAlertStatus.RESOLVED.value})
+    return InventoryAlertSummary(open=open_count, resolved=resolved_count)
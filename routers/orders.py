@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
+from typing import List, Optional
 from bson import ObjectId
 from datetime import datetime
 
-from models import Order, OrderCreate, OrderItem, OrderStatus, Product, Cart, TokenData
-from database import get_database, get_collection
+from models import Order, OrderCreate, OrderItem, OrderStatus, Product, Cart, TokenData, StockMovementReason, BulkOrderStatusUpdate, BulkOrderStatusResult, BulkOrderStatusResponse
+from database import get_database, get_collection, get_consistent_collection, get_causal_session
 from security import get_current_active_user_id, get_current_verified_user, get_current_admin_user
+from inventory_ledger import StockMovement, apply_stock_movements
+from stock_shards import is_sharded, reserve_sharded_stock, release_sharded_stock
+from stock_holds import held_quantities, release_user_holds
+from config import settings
+from idempotency import run_idempotent, request_fingerprint
+from order_transitions import transition_order, bulk_transition_orders
+from audit_logger import log_audit, AuditEvent
 # from stock_helpers import validate_and_reserve_stock, update_stock_atomic  # Descomenta cuando uses MongoDB M10+
 import logging
 
@@ -15,26 +22,59 @@ router = APIRouter()
 
 # Colecciones de MongoDB
 def get_orders_collection(db=Depends(get_database)):
-    return get_collection("orders")
+    return get_consistent_collection("orders")
 
 def get_products_collection(db=Depends(get_database)):
     return get_collection("products")
 
 def get_carts_collection(db=Depends(get_database)):
-    return get_collection("carts")
+    return get_consistent_collection("carts")
 
 # Endpoint para crear un pedido
 
 @router.post("/", response_model=Order, status_code=status.HTTP_201_CREATED)
 async def create_order(
     order_data: OrderCreate,
+    request: Request,
     user_id: str = Depends(get_current_active_user_id),
     carts_collection = Depends(get_carts_collection),
     products_collection = Depends(get_products_collection),
     orders_collection = Depends(get_orders_collection),
+    session = Depends(get_causal_session),
     # Es crucial que el usuario esté verificado para hacer un pedido
-    current_verified_user: TokenData = Depends(get_current_verified_user)
+    current_verified_user: TokenData = Depends(get_current_verified_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255, description="Clave para reintentos seguros: la misma clave devuelve el mismo pedido")
 ):
+    """
+    Crea un nuevo pedido a partir del carrito del usuario.
+    Con el header `Idempotency-Key`, los reintentos con la misma clave devuelven
+    el pedido ya creado en lugar de crear otro.
+    Requiere que el usuario haya verificado su mayoría de edad.
+    """
+    async def create_and_audit():
+        order = await _create_order_from_cart(order_data, user_id, carts_collection, products_collection, orders_collection, session)
+        # Solo al crear: un reintento con la misma Idempotency-Key no vuelve a auditar
+        log_audit(AuditEvent.ORDER_CREATED, request, {"order_id": str(order.id), "user_id": user_id, "total_amount": order.total_amount})
+        return order
+
+    return await run_idempotent(
+        idempotency_key,
+        scope="orders.create",
+        user_id=user_id,
+        fingerprint=request_fingerprint(order_data),
+        handler=create_and_audit,
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+async def _create_order_from_cart(
+    order_data: OrderCreate,
+    user_id: str,
+    carts_collection,
+    products_collection,
+    orders_collection,
+    session=None
+) -> Order:
     """
     Crea un nuevo pedido a partir del carrito del usuario.
     - Valida el stock de los productos.
@@ -47,7 +87,7 @@ async def create_order(
     el código en la sección "VERSIÓN CON TRANSACCIONES" más abajo.
     """
     # 1. Obtener el carrito del usuario
-    cart_db = await carts_collection.find_one({"user_id": user_id})
+    cart_db = await carts_collection.find_one({"user_id": user_id}, session=session)
     if not cart_db or not cart_db.get("items"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Tu carrito está vacío.")
     
@@ -56,16 +96,24 @@ async def create_order(
     order_items: List[OrderItem] = []
     total_amount = 0.0
 
+    # Con reservas de carrito, las unidades reservadas por otros usuarios no están disponibles
+    held_by_others = {}
+    if settings.CART_RESERVATIONS_ENABLED:
+        held_by_others = await held_quantities([ObjectId(item.product_id) for item in cart.items], exclude_user=user_id)
+
     # 2. Iterar sobre los ítems del carrito para validar y construir el pedido
     product_ids_to_update = []
     for item in cart.items:
-        product = await products_collection.find_one({"_id": ObjectId(item.product_id)})
+        product = await products_collection.find_one({"_id": ObjectId(item.product_id)}, session=session)
         
         if not product:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Producto con ID {item.product_id} no encontrado.")
         
-        if product.get("stock", 0) < item.quantity:
-            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Stock insuficiente para '{product['name']}'. Disponible: {product.get('stock', 0)}, Solicitado: {item.quantity}.")
+        # En productos con stock repartido en shards, products.stock es un total cacheado:
+        # la disponibilidad real la decide la reserva sobre los shards (paso 3)
+        available = product.get("stock", 0) - held_by_others.get(product["_id"], 0)
+        if not is_sharded(product) and available < item.quantity:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Stock insuficiente para '{product['name']}'. Disponible: {max(available, 0)}, Solicitado: {item.quantity}.")
 
         # Construir el OrderItem con los datos actuales del producto
         order_item = OrderItem(
@@ -80,10 +128,23 @@ async def create_order(
         # Guardar la info para actualizar el stock después
         product_ids_to_update.append({
             "id": ObjectId(item.product_id),
-            "quantity_to_decrement": item.quantity
+            "quantity_to_decrement": item.quantity,
+            "name": product["name"],
+            "stock_shards": product.get("stock_shards")
         })
 
-    # 3. Crear el documento del pedido
+    # 3. Reservar el stock de los productos repartidos en shards (descuento con guarda, sin sobreventa)
+    sharded_items = [p for p in product_ids_to_update if p["stock_shards"]]
+    reservations = []
+    for p in sharded_items:
+        allocation = await reserve_sharded_stock(p["id"], p["stock_shards"], p["quantity_to_decrement"])
+        if allocation is None:
+            for product_oid, previous_allocation in reservations:
+                await release_sharded_stock(product_oid, previous_allocation)
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Stock insuficiente para '{p['name']}'. Por favor, intenta nuevamente.")
+        reservations.append((p["id"], allocation))
+
+    # 3.1 Crear el documento del pedido
     new_order = Order(
         user_id=user_id,
         items=order_items,
@@ -93,27 +154,46 @@ async def create_order(
     )
     
     order_dict = new_order.model_dump(exclude={"_id"}, by_alias=False)
-    result = await orders_collection.insert_one(order_dict)
+    try:
+        result = await orders_collection.insert_one(order_dict, session=session)
+    except Exception:
+        for product_oid, allocation in reservations:
+            await release_sharded_stock(product_oid, allocation)
+        raise
     
     if not result.inserted_id:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="No se pudo crear el pedido.")
 
-    # 4. Decrementar el stock de los productos
-    for p in product_ids_to_update:
-        await products_collection.update_one(
-            {"_id": p["id"]},
-            {"$inc": {"stock": -p["quantity_to_decrement"]}}
+    # 4. Decrementar el stock de los productos (un bulk_write + registro en el ledger)
+    movements = [
+        StockMovement(
+            product_id=p["id"],
+            delta=-p["quantity_to_decrement"],
+            reason=StockMovementReason.ORDER,
+            order_id=result.inserted_id
         )
+        for p in product_ids_to_update
+    ]
+    # Los productos en shards ya se descontaron en el paso 3: solo se registran en el ledger, en el mismo lote
+    await apply_stock_movements(
+        [m for m, p in zip(movements, product_ids_to_update) if not p["stock_shards"]],
+        applied_elsewhere=[m for m, p in zip(movements, product_ids_to_update) if p["stock_shards"]]
+    )
 
     # 5. Vaciar el carrito del usuario
     await carts_collection.update_one(
         {"user_id": user_id},
-        {"$set": {"items": []}}
+        {"$set": {"items": []}},
+        session=session
     )
+
+    # 6. Las reservas del carrito ya se convirtieron en el descuento de stock del pedido
+    if settings.CART_RESERVATIONS_ENABLED:
+        await release_user_holds(user_id, [p["id"] for p in product_ids_to_update])
     
     logger.info(f"Pedido {result.inserted_id} creado para el usuario {user_id}.")
     
-    created_order = await orders_collection.find_one({"_id": result.inserted_id})
+    created_order = await orders_collection.find_one({"_id": result.inserted_id}, session=session)
     return Order(**created_order)
 
     # ============================================================================
@@ -211,10 +291,11 @@ async def create_order(
 @router.get("/me", response_model=List[Order])
 async def get_my_orders(
     user_id: str = Depends(get_current_active_user_id),
-    orders_collection = Depends(get_orders_collection)
+    orders_collection = Depends(get_orders_collection),
+    session = Depends(get_causal_session)
 ):
     """Obtiene el historial de pedidos del usuario autenticado."""
-    orders_cursor = orders_collection.find({"user_id": user_id}).sort("created_at", -1)
+    orders_cursor = orders_collection.find({"user_id": user_id}, session=session).sort("created_at", -1)
     return [Order(**order) async for order in orders_cursor]
 
 
@@ -222,7 +303,8 @@ async def get_my_orders(
 async def get_order_details(
     order_id: str,
     user_id: str = Depends(get_current_active_user_id),
-    orders_collection = Depends(get_orders_collection)
+    orders_collection = Depends(get_orders_collection),
+    session = Depends(get_causal_session)
 ):
     """
     Obtiene los detalles de un pedido específico del usuario autenticado.
@@ -231,7 +313,7 @@ async def get_order_details(
     if not ObjectId.is_valid(order_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de pedido inválido.")
     
-    order = await orders_collection.find_one({"_id": ObjectId(order_id)})
+    order = await orders_collection.find_one({"_id": ObjectId(order_id)}, session=session)
     
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado.")
@@ -244,58 +326,58 @@ async def get_order_details(
 
 # --- Endpoints para Administradores ---
 
+@router.put("/admin/status/bulk", response_model=BulkOrderStatusResponse, tags=["Admin"])
+async def bulk_update_order_status(
+    payload: BulkOrderStatusUpdate,
+    request: Request,
+    orders_collection = Depends(get_orders_collection),
+    current_admin_user: TokenData = Depends(get_current_admin_user)
+):
+    """
+    [Admin] Cambia el estado de muchos pedidos en una sola llamada (ej. marcar cientos como enviados).
+    Solo se aplican las transiciones permitidas por la máquina de estados; cada pedido
+    informa su resultado. La reposición de stock (cancelación/reembolso) se hace en un único lote.
+    """
+    valid_ids = [ObjectId(oid) for oid in payload.order_ids if ObjectId.is_valid(oid)]
+
+    results = await bulk_transition_orders(valid_ids, payload.new_status, orders_collection=orders_collection)
+
+    # Un resultado por ID recibido, en el mismo orden que `order_ids`
+    response_results = [
+        BulkOrderStatusResult(order_id=oid, result=results[ObjectId(oid)] if ObjectId.is_valid(oid) else "invalid_id")
+        for oid in payload.order_ids
+    ]
+    updated = sum(1 for result in results.values() if result == "updated")
+    if updated:
+        log_audit(AuditEvent.ORDER_STATUS_CHANGED, request, {
+            "order_ids": [str(oid) for oid, result in results.items() if result == "updated"],
+            "new_status": payload.new_status.value,
+            "admin": current_admin_user.username,
+        })
+
+    logger.info(f"Admin {current_admin_user.username} pasó {updated} de {len(payload.order_ids)} pedidos a '{payload.new_status.value}'.")
+    return BulkOrderStatusResponse(updated=updated, results=response_results)
+
+
 @router.put("/admin/{order_id}/status", response_model=Order, tags=["Admin"])
 async def update_order_status(
     order_id: str,
     new_status: OrderStatus, # Recibe el nuevo estado directamente como un valor del enum
+    request: Request,
     orders_collection = Depends(get_orders_collection),
-    products_collection = Depends(get_products_collection),
     current_admin_user: TokenData = Depends(get_current_admin_user)
 ):
     """
     [Admin] Actualiza el estado de un pedido.
+    Solo se permiten las transiciones declaradas en la máquina de estados (order_transitions.py);
+    si el pedido cambió de estado en paralelo, responde 409.
     Requiere permisos de administrador.
     """
-    # 1. Validar el ID
     if not ObjectId.is_valid(order_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de pedido inválido.")
-    
-    # 2. Obtener el pedido actual
-    current_order = await orders_collection.find_one({"_id": ObjectId(order_id)})
-    if not current_order:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado.")
-    current_status = str(current_order["status"])
-
-    # 3. Reposición de stock si corresponde
-    # Lógica de reposición de stock
-    if new_status in [OrderStatus.CANCELLED, OrderStatus.REFUNDED] and current_status not in [
-    OrderStatus.CANCELLED.value, OrderStatus.REFUNDED.value
-    ]:
-        logger.info(f"El pedido {order_id} se está cancelando/reembolsando. Reponiendo stock...")
-    for item in current_order["items"]:
-        try:
-            product_oid = ObjectId(item["product_id"])
-        except Exception:
-            logger.error(f"El product_id {item['product_id']} no es válido, no se repone stock.")
-            continue
-
-        result = await products_collection.update_one(
-            {"_id": product_oid},
-            {"$inc": {"stock": item["quantity"]}}
-        )
 
-        if result.modified_count:
-            logger.info(f"Stock del producto {item['product_id']} incrementado en {item['quantity']}.")
-        else:
-            logger.warning(f"No se encontró producto con id {item['product_id']} para reponer stock.")
+    updated_order = await transition_order(order_id, new_status, orders_collection=orders_collection)
+    log_audit(AuditEvent.ORDER_STATUS_CHANGED, request, {"order_ids": [order_id], "new_status": new_status.value, "admin": current_admin_user.username})
 
-   # 4. Actualizamos el estado del pedido
-    await orders_collection.update_one(
-        {"_id": ObjectId(order_id)},
-        {"$set": {"status": new_status.value, "updated_at": datetime.utcnow()}}
-    )
-    
-    # 5. Devolver el pedido actualizado
-    updated_order = await orders_collection.find_one({"_id": ObjectId(order_id)})
     logger.info(f"Admin {current_admin_user.username} actualizó el estado del pedido {order_id} a '{new_status.value}'.")
-    return Order(**updated_order)
\ No newline at end of file
+    return Order(**updated_order)
@@ -1,44 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
 from fastapi.responses import Response
 from bson import ObjectId
-import mercadopago
+from typing import Optional
 import logging
 import hmac
 import hashlib
+import json
+from datetime import datetime, timedelta, timezone
 
 from models import Order, OrderStatus, TokenData
-from database import get_database, get_collection
+from database import get_database, get_collection, get_consistent_collection, get_causal_session
 from security import get_current_active_user_id
 from config import settings
+from idempotency import run_idempotent, request_fingerprint
+from payment_gateway import mercadopago_gateway
+from payment_store import save_payment_event
+from payment_reconciler import apply_payment_status, next_check_at
+from audit_logger import log_audit, AuditEvent
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Configura el SDK de Mercado Pago al iniciar
-sdk = mercadopago.SDK(settings.MERCADOPAGO_ACCESS_TOKEN)
-
 # Colecciones de MongoDB
 def get_orders_collection(db=Depends(get_database)):
-    return get_collection("orders")
+    return get_consistent_collection("orders")
 def get_payments_collection(db=Depends(get_database)):
     return get_collection("payments")
 
+def preference_fingerprint(items_for_mp: list, total_amount) -> str:
+    """Hash del contenido que se cobra (ítems, montos y URLs de retorno) de una preferencia."""
+    raw = json.dumps(
+        {"items": items_for_mp, "total": total_amount, "frontend": settings.FRONTEND_URL},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_reusable_preference(order: dict, fingerprint: str) -> Optional[dict]:
+    """
+    Devuelve la preferencia guardada en el pedido si cobra exactamente lo mismo
+    y le queda al menos PAYMENT_PREFERENCE_MIN_REMAINING_MINUTES de vigencia.
+    """
+    stored = order.get("payment_preference")
+    if not stored or stored.get("fingerprint") != fingerprint:
+        return None
+    min_expiry = datetime.utcnow() + timedelta(minutes=settings.PAYMENT_PREFERENCE_MIN_REMAINING_MINUTES)
+    if stored.get("expires_at") is None or stored["expires_at"] <= min_expiry:
+        return None
+    return stored
+
+
 @router.post("/create-preference/{order_id}", response_model=dict)
 async def create_payment_preference(
     order_id: str,
     user_id: str = Depends(get_current_active_user_id),
-    orders_collection = Depends(get_orders_collection)
+    orders_collection = Depends(get_orders_collection),
+    session = Depends(get_causal_session),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255, description="Clave para reintentos seguros: la misma clave devuelve la misma preferencia")
 ):
     """
     Crea una preferencia de pago en Mercado Pago para un pedido existente.
     Devuelve la URL de checkout a la que el frontend debe redirigir al usuario.
+    Con el header `Idempotency-Key`, los reintentos devuelven la misma preferencia
+    sin volver a llamar a Mercado Pago.
     """
+    return await run_idempotent(
+        idempotency_key,
+        scope="payments.create_preference",
+        user_id=user_id,
+        fingerprint=request_fingerprint(order_id),
+        handler=lambda: _create_preference_for_order(order_id, user_id, orders_collection, session)
+    )
+
+
+async def _create_preference_for_order(order_id: str, user_id: str, orders_collection, session=None) -> dict:
+    """Valida el pedido y crea su preferencia de pago en Mercado Pago."""
     if not ObjectId.is_valid(order_id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de pedido inválido.")
 
     # 1. Buscar el pedido y verificar que pertenece al usuario
-    order = await orders_collection.find_one({"_id": ObjectId(order_id)})
+    order = await orders_collection.find_one({"_id": ObjectId(order_id)}, session=session)
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Pedido no encontrado.")
     if order["user_id"] != user_id:
@@ -56,7 +98,23 @@ async def create_payment_preference(
             "currency_id": "ARS" # O la moneda correspondiente (CLP, MXN, etc.)
         })
 
-    # 3. Crear la preferencia de pago
+    # 2.1 Reutilizar la preferencia ya creada si el contenido del pedido no cambió y no está por vencer
+    fingerprint = preference_fingerprint(items_for_mp, order.get("total_amount"))
+    stored = get_reusable_preference(order, fingerprint)
+    if stored:
+        logger.info(f"Reutilizando la preferencia de pago {stored['id']} del pedido {order_id}.")
+        return {"preference_id": stored["id"], "init_point": stored["init_point"]}
+
+    # 3. Crear la preferencia de pago (vence junto con la copia guardada en el pedido).
+    #    Con el sweeper activo no puede vencer después que el pedido: un pago aprobado
+    #    sobre un pedido ya cancelado cobraría stock que se repuso
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(minutes=settings.PAYMENT_PREFERENCE_TTL_MINUTES)
+    if settings.SWEEPER_ENABLED:
+        order_expires_at = order["created_at"].replace(tzinfo=timezone.utc) + timedelta(minutes=settings.PENDING_ORDER_EXPIRY_MINUTES)
+        expires_at = min(expires_at, order_expires_at)
+        if expires_at <= now + timedelta(minutes=settings.PAYMENT_PREFERENCE_MIN_REMAINING_MINUTES):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El pedido está por vencer. Vuelve a crearlo desde el carrito.")
     preference_data = {
         "items": items_for_mp,
         "external_reference": order_id, # MUY IMPORTANTE: vincula el pago a nuestro pedido
@@ -68,10 +126,13 @@ async def create_payment_preference(
         # NOTA: notification_url debe configurarse desde el panel de Mercado Pago
         # La API rechaza la URL con error "invalid format" cuando se incluye aquí
         "auto_return": "approved",
+        "expires": True,
+        "expiration_date_from": now.isoformat(timespec="milliseconds"),
+        "expiration_date_to": expires_at.isoformat(timespec="milliseconds"),
     }
     
     try:
-        preference_response = sdk.preference().create(preference_data)
+        preference_response = await mercadopago_gateway.create_preference(preference_data)
         
         # Log completo de la respuesta para debugging
         logger.info(f"Respuesta completa de Mercado Pago: {preference_response}")
@@ -94,10 +155,21 @@ async def create_payment_preference(
                 detail="La preferencia de Mercado Pago no contiene los campos necesarios"
             )
         
-        # Guardar el ID de preferencia en el pedido
+        # Guardar la preferencia en el pedido para reutilizarla en los próximos intentos de pago
         await orders_collection.update_one(
             {"_id": ObjectId(order_id)},
-            {"$set": {"payment_preference_id": preference["id"]}}
+            {"$set": {
+                "payment_preference_id": preference["id"],
+                "payment_preference": {
+                    "id": preference["id"],
+                    "init_point": preference["init_point"],
+                    "fingerprint": fingerprint,
+                    "expires_at": expires_at.replace(tzinfo=None),
+                },
+                # Si el webhook no llega, el conciliador consulta el pago a partir de este momento
+                "next_payment_check_at": next_check_at(order["created_at"], datetime.utcnow()),
+            }},
+            session=session
         )
         
         logger.info(f"Preferencia de pago {preference['id']} creada para el pedido {order_id}.")
@@ -188,77 +260,39 @@ async def handle_mercadopago_webhook(
     
     topic = query_params.get("topic")
     payment_id = query_params.get("id")
+    log_audit(AuditEvent.PAYMENT_WEBHOOK_RECEIVED, request, {
+        "topic": topic, "payment_id": payment_id, "x_request_id": x_request_id, "signed": bool(x_signature)
+    })
     
     if topic == "payment" and payment_id:
         try:
-            # 1. VALIDACIÓN DE IDEMPOTENCIA
-            # Verificar si ya procesamos este payment_id
-            existing_payment = await payments_collection.find_one({"id": int(payment_id)})
-            if existing_payment:
+            # 1. Obtener la información completa del pago desde Mercado Pago
+            payment_response = await mercadopago_gateway.get_payment(payment_id)
+            if payment_response["status"] != 200:
+                logger.error(f"❌ Mercado Pago respondió {payment_response['status']} al consultar el pago {payment_id}.")
+                return Response(status_code=status.HTTP_200_OK)
+            payment_info = payment_response["response"]
+
+            # 2. VALIDACIÓN DE IDEMPOTENCIA
+            # Un mismo pago notifica cada cambio de estado (ej. in_process -> approved):
+            # solo se ignora si ya procesamos este pago con este mismo estado
+            existing_payment = await payments_collection.find_one({"id": payment_info.get("id")}, projection={"status": 1})
+            if existing_payment and existing_payment.get("status") == payment_info.get("status"):
                 logger.info(f"Webhook para pago {payment_id} ya fue procesado anteriormente. Ignorando.")
                 return Response(status_code=status.HTTP_200_OK)
             
-            # 2. Obtener la información completa del pago desde Mercado Pago
-            payment_info = sdk.payment().get(payment_id)["response"]
-            
-            # 3. Guardar el evento de pago completo para auditoría
-            await payments_collection.insert_one(payment_info)
+            # 3. Guardar el pago (campos consultables + payload completo comprimido para auditoría)
+            await save_payment_event(payment_info)
             logger.info(f"Evento de pago {payment_id} guardado en la base de datos.")
             
             order_id = payment_info.get("external_reference")
-            payment_status = payment_info.get("status")
-            payment_status_detail = payment_info.get("status_detail", "N/A")
 
-            if not order_id:
-                logger.warning(f"Webhook para pago {payment_id} recibido sin external_reference.")
+            if not order_id or not ObjectId.is_valid(order_id):
+                logger.warning(f"Webhook para pago {payment_id} recibido sin external_reference válido.")
                 return Response(status_code=status.HTTP_200_OK)
 
-            # 4. Actualizar el estado del pedido en nuestra base de datos
-            order = await orders_collection.find_one({"_id": ObjectId(order_id)})
-            if order:
-                current_order_status = order["status"]
-                
-                # Solo actualizar si el pedido está en un estado que permite cambios
-                if payment_status == "approved" and current_order_status == OrderStatus.PENDING.value:
-                    await orders_collection.update_one(
-                        {"_id": ObjectId(order_id)},
-                        {"$set": {
-                            "status": OrderStatus.PROCESSING.value, 
-                            "payment_id": payment_id,
-                            "payment_status": payment_status,
-                            "payment_status_detail": payment_status_detail
-                        }}
-                    )
-                    logger.info(f"✅ Pedido {order_id} actualizado a 'En Proceso' por pago aprobado.")
-                
-                elif payment_status in ["rejected", "cancelled"]:
-                    await orders_collection.update_one(
-                        {"_id": ObjectId(order_id)},
-                        {"$set": {
-                            "status": OrderStatus.CANCELLED.value, 
-                            "payment_id": payment_id,
-                            "payment_status": payment_status,
-                            "payment_status_detail": payment_status_detail
-                        }}
-                    )
-                    logger.info(f"❌ Pedido {order_id} actualizado a 'Cancelado' por pago rechazado/cancelado.")
-                
-                elif payment_status == "in_process":
-                    # Algunos pagos quedan pendientes (ej: transferencia bancaria)
-                    await orders_collection.update_one(
-                        {"_id": ObjectId(order_id)},
-                        {"$set": {
-                            "payment_id": payment_id,
-                            "payment_status": payment_status,
-                            "payment_status_detail": payment_status_detail
-                        }}
-                    )
-                    logger.info(f"⏳ Pedido {order_id} marcado como pendiente - pago en proceso.")
-                
-                else:
-                    logger.info(f"ℹ️ Pedido {order_id} en estado '{current_order_status}' - no se actualiza por pago '{payment_status}'.")
-            else:
-                logger.warning(f"⚠️ Pedido con ID {order_id} no encontrado para actualizar desde webhook.")
+            # 4. Actualizar el estado del pedido con una transición condicionada (solo desde "Pendiente")
+            await apply_payment_status(order_id, payment_info, source="webhook")
 
         except Exception as e:
             logger.error(f"❌ Error procesando webhook de Mercado Pago: {e}", exc_info=True)
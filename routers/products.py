@@ -2,9 +2,15 @@ from fastapi import APIRouter, Depends, HTTPException, status , Query, Response
 from typing import List, Optional
 from bson import ObjectId
 
-from models import Product, ProductCategory, UserRole, TokenData, PaginationMeta
-from database import get_database, get_collection
+from models import Product, ProductCategory, UserRole, TokenData, PaginationMeta, StockMovementReason
+from database import get_database, get_collection, get_read_collection
 from security import get_current_admin_user # Importamos la dependencia para admins
+from catalog_cache import catalog_cache
+from config import settings
+from stock_shards import is_sharded, current_stock, compensate_stock_set
+from stock_holds import with_available_stock
+from inventory_ledger import StockMovement, run_stock_write
+from product_stats import get_top_sellers, get_frequently_bought_together
 import logging
 import math
 
@@ -16,6 +22,10 @@ router = APIRouter()
 def get_products_collection():
     return get_collection("products")
 
+# Lecturas del catálogo: pueden ir a un secundario (ver CATALOG_READ_PREFERENCE)
+def get_catalog_products_collection():
+    return get_read_collection("products", "catalog")
+
 #Endpoint para la gestión de productos
 @router.post("/", response_model=Product, status_code=status.HTTP_201_CREATED)
 async def create_product(
@@ -35,12 +45,22 @@ async def create_product(
             status_code=status.HTTP_409_CONFLICT,
             detail="El nombre del producto ya existe."
         )
-    product_dict = product.model_dump(exclude_unset=True, exclude={"id"}, by_alias=True)
-    result = await products_collection.insert_one(product_dict)
-    
-    if not result.inserted_id:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="No se pudo crear el producto.")
-    
+    product_dict = product.model_dump(exclude_unset=True, exclude={"id", "available_stock"}, by_alias=True)
+
+    async def insert_product(session):
+        result = await products_collection.insert_one(product_dict, session=session)
+        if not result.inserted_id:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="No se pudo crear el producto.")
+        return result, [StockMovement(
+            product_id=result.inserted_id,
+            reason=StockMovementReason.PRODUCT,
+            delta=product.stock,
+            set_to=product.stock
+        )]
+
+    # Alta del producto y su stock inicial en el ledger en el mismo lote
+    result = await run_stock_write(insert_product)
+
     # Obtener el producto recién creado para devolver el ID
     created_product = await products_collection.find_one({"_id": result.inserted_id})
     if created_product:
@@ -50,7 +70,7 @@ async def create_product(
     
 @router.get("/")
 async def read_products(
-    products_collection = Depends(get_products_collection),
+    products_collection = Depends(get_catalog_products_collection),
     category: Optional[ProductCategory] = Query(None, description="Filtrar por categoría de producto"),
     min_price: Optional[float] = Query(None, ge=0, description="Precio mínimo del producto"),
     max_price: Optional[float] = Query(None, ge=0, description="Precio máximo del producto"),
@@ -96,9 +116,11 @@ async def read_products(
     
     # Obtener productos paginados
     products_cursor = products_collection.find(query).skip(skip).limit(page_size)
-    products_list = []
-    async for product_doc in products_cursor:
-        products_list.append(Product(**product_doc))
+    product_docs = await products_cursor.to_list(length=page_size)
+    if settings.CART_RESERVATIONS_ENABLED:
+        # Totales reservados de toda la página con una consulta (cacheados unos segundos)
+        await with_available_stock(product_docs)
+    products_list = [Product(**product_doc) for product_doc in product_docs]
     
     # Construir metadatos de paginación
     meta = PaginationMeta(
@@ -115,6 +137,66 @@ async def read_products(
         "meta": meta
     }
 
+async def _load_products_by_id(products_collection, product_ids: List[ObjectId]) -> dict:
+    """Obtiene varios productos con una sola consulta, indexados por ID."""
+    if not product_ids:
+        return {}
+    cursor = products_collection.find({"_id": {"$in": product_ids}})
+    return {doc["_id"]: doc async for doc in cursor}
+
+@router.get("/top-sellers")
+async def read_top_sellers(
+    products_collection = Depends(get_catalog_products_collection),
+    limit: int = Query(10, ge=1, le=50, description="Cantidad de productos a devolver")
+):
+    """
+    Obtiene los productos más vendidos (con stock disponible).
+    Se sirve desde estadísticas precalculadas y la caché del catálogo.
+    Accesible para cualquier usuario.
+    """
+    async def load():
+        # Pedimos algunos extra para compensar los que no tengan stock
+        ranking = await get_top_sellers(limit * 2)
+        products = await _load_products_by_id(products_collection, [product_id for product_id, _ in ranking])
+        items = []
+        for product_id, units_sold in ranking:
+            product_doc = products.get(product_id)
+            if product_doc and product_doc.get("stock", 0) > 0:
+                items.append({"product": Product(**product_doc), "units_sold": units_sold})
+            if len(items) >= limit:
+                break
+        return items
+
+    return await catalog_cache.get_or_load(("top_sellers", limit), load)
+
+@router.get("/{product_id}/frequently-bought-together")
+async def read_frequently_bought_together(
+    product_id: str,
+    products_collection = Depends(get_catalog_products_collection),
+    limit: int = Query(5, ge=1, le=20, description="Cantidad de sugerencias a devolver")
+):
+    """
+    Obtiene los productos que se compran con más frecuencia junto al indicado.
+    Se sirve desde estadísticas precalculadas y la caché del catálogo.
+    Accesible para cualquier usuario.
+    """
+    if not ObjectId.is_valid(product_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de producto inválido.")
+
+    async def load():
+        pairs = await get_frequently_bought_together(ObjectId(product_id), limit * 2)
+        products = await _load_products_by_id(products_collection, [other_id for other_id, _ in pairs])
+        items = []
+        for other_id, count in pairs:
+            product_doc = products.get(other_id)
+            if product_doc and product_doc.get("stock", 0) > 0:
+                items.append({"product": Product(**product_doc), "times_bought_together": count})
+            if len(items) >= limit:
+                break
+        return items
+
+    return await catalog_cache.get_or_load(("frequently_bought_together", product_id, limit), load)
+
 @router.get("/{product_id}", response_model=Product)
 async def read_product(
     product_id: str,
@@ -129,6 +211,11 @@ async def read_product(
 
     product_db = await products_collection.find_one({"_id": ObjectId(product_id)})
     if product_db:
+        if is_sharded(product_db):
+            # Stock repartido en shards: en el detalle se muestra la suma exacta (los listados usan el total cacheado)
+            product_db["stock"] = max(await current_stock(product_db), 0)
+        if settings.CART_RESERVATIONS_ENABLED:
+            await with_available_stock([product_db])
         return Product(**product_db)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
 
@@ -156,15 +243,35 @@ async def update_product(
         del update_data["_id"]
     if "id" in update_data:
         del update_data["id"]
+    # Campo calculado, no se guarda
+    update_data.pop("available_stock", None)
 
-    result = await products_collection.update_one(
-        {"_id": ObjectId(product_id)},
-        {"$set": update_data}
-    )
+    async def update_product_fields(session):
+        result = await products_collection.update_one(
+            {"_id": ObjectId(product_id)},
+            {"$set": update_data},
+            session=session
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado para actualizar.")
+        if "stock" not in update_data:
+            return result, []
+        product_db = await products_collection.find_one(
+            {"_id": ObjectId(product_id)}, projection={"stock": 1, "stock_shards": 1, "stock_cached": 1}, session=session
+        )
+        await compensate_stock_set([product_db] if product_db else [], session=session)
+        return result, [StockMovement(
+            product_id=product_id,
+            reason=StockMovementReason.PRODUCT,
+            set_to=update_data["stock"]
+        )]
+
+    if "stock" in update_data:
+        # El cambio de stock y su movimiento en el ledger van en el mismo lote
+        await run_stock_write(update_product_fields)
+    else:
+        await update_product_fields(None)
 
-    if result.matched_count == 0:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado para actualizar.")
-    
     updated_product = await products_collection.find_one({"_id": ObjectId(product_id)})
     if updated_product:
         return Product(**updated_product)
@@ -0,0 +1,126 @@
+"""
+Benchmark del costo por evento de auditoría en el camino de la solicitud.
+
+Compara:
+- anterior: `json.dumps` + StreamHandler síncrono (escribiendo a /dev/null)
+- pipeline: `log_audit` encolando en la cola acotada, con el QueueListener
+  drenando en su hilo (sin MongoDB: el lote se descarta)
+
+y, con una cola chica, cuántos eventos descarta cada política de
+contrapresión ante una ráfaga.
+
+Uso:
+    python scripts/benchmark_audit.py --events 50000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import queue
+import statistics
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from prometheus_client import REGISTRY
+from audit_logger import AuditEvent, AuditQueueHandler, audit_pipeline, log_audit
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REQUEST = SimpleNamespace(client=SimpleNamespace(host="127.0.0.1"), method="POST", url=SimpleNamespace(path="/orders/"))
+DETAILS = {"order_id": "6650f1c2a1b2c3d4e5f60718", "user_id": "6650f1c2a1b2c3d4e5f60719", "total_amount": 15999.5}
+
+
+def previous_log_audit(stream_logger):
+    """Implementación anterior: serializa y escribe en el hilo de la solicitud."""
+    def log(event, request, details):
+        log_data = {
+            "event": event.value,
+            "client_ip": request.client.host,
+            "method": request.method,
+            "path": request.url.path,
+            "timestamp": datetime.utcnow().isoformat(),
+            "details": details
+        }
+        stream_logger.info(json.dumps(log_data, ensure_ascii=False))
+    return log
+
+
+def measure(log, events: int) -> list:
+    """Costo por evento en µs."""
+    latencies = []
+    for _ in range(events):
+        started = time.perf_counter()
+        log(AuditEvent.ORDER_CREATED, REQUEST, DETAILS)
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    return latencies
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def dropped_events() -> float:
+    return REGISTRY.get_sample_value("audit_events_total", {"result": "dropped"}) or 0.0
+
+
+def burst_drops(policy: str, queue_size: int, events: int) -> int:
+    """Eventos descartados por una política al encolar una ráfaga sin nadie drenando."""
+    settings.AUDIT_BACKPRESSURE = policy
+    settings.AUDIT_BLOCK_TIMEOUT_MS = 1
+    handler = AuditQueueHandler(queue.Queue(maxsize=queue_size))
+    record_logger = logging.getLogger(f"audit-burst-{policy}")
+    record_logger.propagate = False
+    record_logger.addHandler(handler)
+    dropped_before = dropped_events()
+    for _ in range(events):
+        record_logger.info("x", extra={"audit": DETAILS})
+    return int(dropped_events() - dropped_before)
+
+
+async def main(args):
+    devnull = open(os.devnull, "w")
+    stream_logger = logging.getLogger("audit-previous")
+    stream_logger.propagate = False
+    stream_logger.addHandler(logging.StreamHandler(devnull))
+    previous = previous_log_audit(stream_logger)
+
+    await audit_pipeline.start()
+    results = {"anterior": [], "pipeline": []}
+    try:
+        for _ in range(args.rounds):
+            results["anterior"] += measure(previous, args.events)
+            results["pipeline"] += measure(log_audit, args.events)
+            audit_pipeline._batch.clear()  # sin MongoDB: el lote se descarta
+    finally:
+        if audit_pipeline._listener:
+            audit_pipeline._listener.stop()
+        audit_pipeline._batch.clear()
+        devnull.close()
+
+    logger.info("\n" + "=" * 60)
+    logger.info(f"Eventos por variante: {args.events * args.rounds}")
+    for name, values in results.items():
+        logger.info(f"  {name:>9}: p50={statistics.median(values):.2f}µs p95={percentile(values, 0.95):.2f}µs")
+    logger.info(f"\nRáfaga de {args.burst} eventos con cola de {args.burst_queue} (sin drenar):")
+    for policy in ("drop_newest", "drop_oldest", "block"):
+        logger.info(f"  {policy:>11}: {burst_drops(policy, args.burst_queue, args.burst)} descartados")
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la auditoría asíncrona.")
+    parser.add_argument("--events", type=int, default=50000, help="Eventos por variante y ronda")
+    parser.add_argument("--rounds", type=int, default=5, help="Rondas intercaladas")
+    parser.add_argument("--burst", type=int, default=5000, help="Eventos de la ráfaga de contrapresión")
+    parser.add_argument("--burst-queue", type=int, default=1000, help="Tamaño de cola para la ráfaga")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,106 @@
+"""
+Benchmark del costo por acción de carrito con y sin reservas de stock.
+
+Compara, para N acciones concurrentes de "agregar al carrito" sobre un producto
+temporal:
+- sin reservas: leer el producto y comparar con su stock (comportamiento actual)
+- con reservas: leer el producto + `place_hold` (upsert de la reserva y suma de
+  las reservas de otros usuarios)
+
+Informa latencia p50/p95 por acción y la sobrecarga de las reservas.
+Los documentos temporales se borran al terminar. No usar contra producción.
+
+Uso:
+    python scripts/benchmark_cart_holds.py --actions 5000 --users 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from config import settings
+from models import ProductCategory
+from database import connect_db, close_db, get_collection
+from stock_holds import place_hold
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run_actions(action, actions: int, concurrency: int) -> list:
+    """Ejecuta `actions` llamadas a `action()` con `concurrency` en paralelo; devuelve latencias en ms."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await action()
+            except HTTPException:
+                pass  # Sin stock disponible: también cuenta como acción
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(actions)))
+    return latencies
+
+
+async def main(args):
+    if settings.ENV == "production":
+        logger.error("❌ Este benchmark no está permitido en producción.")
+        sys.exit(1)
+
+    await connect_db()
+    products_collection = get_collection("products")
+    result = await products_collection.insert_one({
+        "name": "benchmark-cart-holds", "price": 1.0, "category": ProductCategory.BEER.value, "stock": args.users * 3
+    })
+    product_id = result.inserted_id
+    users = [f"benchmark-user-{i}" for i in range(args.users)]
+
+    async def without_holds():
+        product = await products_collection.find_one({"_id": product_id})
+        if product.get("stock", 0) < 1:
+            raise HTTPException(status_code=400)
+
+    async def with_holds():
+        product = await products_collection.find_one({"_id": product_id})
+        await place_hold(random.choice(users), product, random.randint(1, 3))
+
+    try:
+        baseline = await run_actions(without_holds, args.actions, args.concurrency)
+        holds = await run_actions(with_holds, args.actions, args.concurrency)
+    finally:
+        await get_collection("stock_holds").delete_many({"product_id": product_id})
+        await products_collection.delete_one({"_id": product_id})
+        await close_db()
+
+    logger.info("\n" + "=" * 60)
+    logger.info(f"Acciones: {args.actions} | usuarios: {args.users} | concurrencia: {args.concurrency}")
+    for label, values in (("sin reservas", baseline), ("con reservas", holds)):
+        logger.info(f"  {label:>13}: p50={statistics.median(values):.2f}ms p95={percentile(values, 0.95):.2f}ms")
+    overhead = statistics.median(holds) - statistics.median(baseline)
+    logger.info(f"  Sobrecarga por acción (p50): {overhead:+.2f}ms")
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de reservas de stock en el carrito.")
+    parser.add_argument("--actions", type=int, default=5000, help="Cantidad de acciones de carrito")
+    parser.add_argument("--users", type=int, default=500, help="Usuarios distintos")
+    parser.add_argument("--concurrency", type=int, default=50, help="Acciones en paralelo")
+    asyncio.run(main(parser.parse_args()))
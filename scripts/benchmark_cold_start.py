@@ -0,0 +1,91 @@
+"""
+Benchmark de arranque en frío: latencia de las primeras consultas con y sin
+precalentar el pool de conexiones de MongoDB.
+
+En cada ronda se crea un cliente nuevo con las opciones de la configuración
+(connect_db), se precalienta o no el pool (warm_up_pool) y se lanza enseguida
+una ráfaga de N consultas concurrentes del catálogo, como las primeras
+solicitudes que recibe un worker recién levantado. Se informa la latencia
+p50 / p95 / máxima de la ráfaga en cada modo.
+
+Las rondas alternan los modos para que ambos vean el mismo estado del servidor.
+Conviene correrlo contra un MongoDB remoto o con TLS: en localhost el handshake
+es casi gratis y la diferencia es chica.
+
+Uso:
+    python scripts/benchmark_cold_start.py --requests 50 --rounds 5 [--warm-connections 20]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from database import connect_db, close_db, get_collection, warm_up_pool
+import logging
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+async def first_requests_burst(requests: int) -> list:
+    """Lanza `requests` consultas de catálogo concurrentes y devuelve la latencia de cada una en ms."""
+    products_collection = get_collection("products")
+
+    async def catalog_query() -> float:
+        started = time.perf_counter()
+        await products_collection.find({}, projection={"name": 1, "price": 1, "stock": 1}).limit(20).to_list(length=20)
+        return (time.perf_counter() - started) * 1000
+
+    return await asyncio.gather(*(catalog_query() for _ in range(requests)))
+
+
+async def run_round(warm: bool, requests: int, warm_connections: int) -> dict:
+    await connect_db()
+    try:
+        warm_up_ms = await warm_up_pool(warm_connections) if warm else 0.0
+        latencies = sorted(await first_requests_burst(requests))
+    finally:
+        await close_db()
+    return {
+        "warm_up_ms": warm_up_ms,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+        "max": latencies[-1],
+    }
+
+
+def summarize(label: str, rounds: list) -> None:
+    def avg(key):
+        return statistics.mean(r[key] for r in rounds)
+    print(f"\n⏱️  {label} ({len(rounds)} rondas, promedio)")
+    print(f"   Precalentamiento: {avg('warm_up_ms'):.1f} ms")
+    print(f"   Primeras consultas p50: {avg('p50'):.1f} ms | p95: {avg('p95'):.1f} ms | máx: {avg('max'):.1f} ms")
+
+
+async def main(args):
+    warm_connections = args.warm_connections if args.warm_connections is not None else settings.MONGO_MIN_POOL_SIZE
+    results = {False: [], True: []}
+    for round_number in range(args.rounds):
+        for warm in (False, True):
+            results[warm].append(await run_round(warm, args.requests, warm_connections))
+        print(f"   Ronda {round_number + 1}/{args.rounds} completa")
+
+    print(f"\nConfiguración: maxPoolSize={settings.MONGO_MAX_POOL_SIZE}, compresores='{settings.MONGO_COMPRESSORS}', "
+          f"{args.requests} consultas concurrentes, {warm_connections} conexiones precalentadas")
+    summarize("Sin precalentar", results[False])
+    summarize("Con precalentamiento", results[True])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia de las primeras consultas con y sin precalentar el pool.")
+    parser.add_argument("--requests", type=int, default=50, help="Consultas concurrentes de la ráfaga inicial")
+    parser.add_argument("--rounds", type=int, default=5, help="Rondas por modo")
+    parser.add_argument("--warm-connections", type=int, default=None, help="Conexiones a precalentar (por defecto MONGO_MIN_POOL_SIZE)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,131 @@
+"""
+Benchmark de la sobrecarga por solicitud del middleware de métricas HTTP.
+
+Arma la app con los mismos routers que main.py más una ruta trivial al final
+(así la resolución de la plantilla recorre todas las rutas, el peor caso) y la
+llama directamente por ASGI, sin red ni base de datos, en cuatro variantes:
+
+- sin middleware
+- middleware "http" anterior (BaseHTTPMiddleware que solo fijaba la ruta)
+- RequestMetricsMiddleware solo fijando la ruta (HTTP_METRICS_ENABLED=false)
+- RequestMetricsMiddleware con métricas
+
+Informa el costo por solicitud (p50/p95 en µs) y la diferencia contra la app
+sin middleware.
+
+Uso:
+    python scripts/benchmark_http_metrics.py --requests 20000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from db_monitoring import current_route, route_template
+from http_metrics import RequestMetricsMiddleware
+from routers import auth, products, age_verification, cart, orders, payments, inventory, admin
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROUTERS = [
+    (products.router, "/products"), (auth.router, "/auth"), (age_verification.router, "/age-verification"),
+    (cart.router, "/cart"), (orders.router, "/orders"), (payments.router, "/payments"),
+    (inventory.router, "/inventory"), (admin.router, "/admin"),
+]
+
+
+def build_app(variant: str) -> FastAPI:
+    app = FastAPI()
+    for router, prefix in ROUTERS:
+        app.include_router(router, prefix=prefix)
+
+    @app.get("/benchmark/{item_id}")
+    async def benchmark_endpoint(item_id: str):
+        return {"item_id": item_id}
+
+    if variant == "base_http_middleware":
+        @app.middleware("http")
+        async def tag_current_route(request: Request, call_next):
+            token = current_route.set(route_template(request))
+            try:
+                return await call_next(request)
+            finally:
+                current_route.reset(token)
+    elif variant == "route_only":
+        app.add_middleware(RequestMetricsMiddleware, record_metrics=False)
+    elif variant == "metrics":
+        app.add_middleware(RequestMetricsMiddleware, record_metrics=True)
+    return app
+
+
+async def call(app, path: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234), "server": ("localhost", 8000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests: int) -> list:
+    """Latencias por solicitud en µs."""
+    latencies = []
+    for i in range(requests):
+        started = time.perf_counter()
+        await call(app, f"/benchmark/{i}")
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    return latencies
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def main(args):
+    variants = ["none", "base_http_middleware", "route_only", "metrics"]
+    apps = {variant: build_app(variant) for variant in variants}
+    results = {variant: [] for variant in variants}
+
+    for variant in variants:
+        await measure(apps[variant], min(args.requests, 1000))  # calentamiento
+    # Rondas intercaladas para repartir el ruido entre variantes
+    for _ in range(args.rounds):
+        for variant in variants:
+            results[variant] += await measure(apps[variant], args.requests)
+
+    baseline = statistics.median(results["none"])
+    logger.info("\n" + "=" * 60)
+    logger.info(f"Solicitudes por variante: {args.requests * args.rounds}")
+    for variant in variants:
+        values = results[variant]
+        median = statistics.median(values)
+        logger.info(
+            f"  {variant:>20}: p50={median:.1f}µs p95={percentile(values, 0.95):.1f}µs "
+            f"sobrecarga p50={median - baseline:+.1f}µs"
+        )
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del middleware de métricas HTTP.")
+    parser.add_argument("--requests", type=int, default=20000, help="Solicitudes por variante y ronda")
+    parser.add_argument("--rounds", type=int, default=5, help="Rondas intercaladas")
+    asyncio.run(main(parser.parse_args()))
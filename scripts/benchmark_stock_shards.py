@@ -0,0 +1,170 @@
+"""
+Benchmark de concurrencia: descuento de stock en un solo documento vs. en shards.
+
+Crea un producto temporal con STOCK unidades y lanza N compradores concurrentes
+que compran de a 1 (o de a --quantity) hasta agotarlo, primero con `$inc` con
+guarda sobre `products` y luego con el stock repartido en shards. Informa el
+throughput de cada modo y verifica que no haya sobreventa (vendido == stock
+inicial y stock final == 0). Los documentos temporales se borran al terminar.
+
+Antes del benchmark verifica que, si el admin baja el stock por debajo de lo que
+tienen los shards, el descuento se reparta sin dejar shards en negativo y no se
+pueda vender más de lo fijado.
+
+No usar contra la base de producción.
+
+Uso:
+    python scripts/benchmark_stock_shards.py --stock 20000 --workers 200 --shards 16
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from models import ProductCategory
+from database import connect_db, close_db, get_collection
+from pymongo import ReturnDocument
+from stock_shards import (
+    enable_stock_shards, disable_stock_shards, reserve_sharded_stock, sharded_totals,
+    compensate_stock_set, refresh_sharded_totals,
+)
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def run_buyers(buy, workers: int) -> tuple:
+    """Lanza `workers` compradores que llaman a `buy()` hasta que devuelva 0. Devuelve (vendido, segundos)."""
+    sold = 0
+
+    async def buyer():
+        nonlocal sold
+        while True:
+            bought = await buy()
+            if not bought:
+                return
+            sold += bought
+
+    started = time.perf_counter()
+    await asyncio.gather(*(buyer() for _ in range(workers)))
+    return sold, time.perf_counter() - started
+
+
+async def benchmark_single_document(stock: int, workers: int, quantity: int) -> dict:
+    products_collection = get_collection("products")
+    result = await products_collection.insert_one({"name": "benchmark-single", "price": 1.0, "category": ProductCategory.BEER.value, "stock": stock})
+    product_id = result.inserted_id
+
+    async def buy():
+        updated = await products_collection.update_one(
+            {"_id": product_id, "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}}
+        )
+        return quantity if updated.modified_count else 0
+
+    try:
+        sold, elapsed = await run_buyers(buy, workers)
+        final = (await products_collection.find_one({"_id": product_id}))["stock"]
+    finally:
+        await products_collection.delete_one({"_id": product_id})
+    return {"mode": "documento único", "sold": sold, "final": final, "elapsed": elapsed}
+
+
+async def benchmark_sharded(stock: int, workers: int, quantity: int, shards: int) -> dict:
+    products_collection = get_collection("products")
+    result = await products_collection.insert_one({"name": "benchmark-sharded", "price": 1.0, "category": ProductCategory.BEER.value, "stock": stock})
+    product_id = result.inserted_id
+
+    async def buy():
+        allocation = await reserve_sharded_stock(product_id, shards, quantity)
+        return sum(taken for _, taken in allocation) if allocation else 0
+
+    try:
+        await enable_stock_shards(product_id, shards)
+        sold, elapsed = await run_buyers(buy, workers)
+        final = (await sharded_totals([product_id])).get(product_id, 0)
+    finally:
+        await disable_stock_shards(product_id)
+        await products_collection.delete_one({"_id": product_id})
+    return {"mode": f"{shards} shards", "sold": sold, "final": final, "elapsed": elapsed}
+
+
+async def check_lowered_stock(shards: int = 4) -> bool:
+    """
+    Stock 10 en 4 shards (3/3/2/2); el admin lo fija en 1 y después en 0, como en
+    PUT /inventory/{id}/stock. Después de cada ajuste y su refresco solo se
+    puede vender lo fijado y ningún shard queda en negativo.
+    """
+    products_collection = get_collection("products")
+    result = await products_collection.insert_one({"name": "check-lowered-stock", "price": 1.0, "category": ProductCategory.BEER.value, "stock": 10})
+    product_id = result.inserted_id
+    ok = True
+    try:
+        await enable_stock_shards(product_id, shards)
+        for new_stock in (1, 0):
+            previous = await products_collection.find_one_and_update(
+                {"_id": product_id}, {"$set": {"stock": new_stock}}, return_document=ReturnDocument.BEFORE
+            )
+            await compensate_stock_set([{**previous, "stock": new_stock}])
+            await refresh_sharded_totals([await products_collection.find_one({"_id": product_id})])
+
+            sold = 0
+            while await reserve_sharded_stock(product_id, shards, 1):
+                sold += 1
+            counters = await get_collection("stock_counters").find({"p": product_id}).to_list(length=None)
+            negative = [c["n"] for c in counters if c["stock"] < 0]
+            step_ok = sold == new_stock and not negative
+            ok = ok and step_ok
+            logger.info(
+                f"{'✅' if step_ok else '❌'} Stock fijado en {new_stock}: vendidas {sold} unidades"
+                f"{f', shards negativos: {negative}' if negative else ''}"
+            )
+    finally:
+        await disable_stock_shards(product_id)
+        await products_collection.delete_one({"_id": product_id})
+    return ok
+
+
+async def main(args):
+    if settings.ENV == "production":
+        logger.error("❌ Este benchmark no está permitido en producción.")
+        sys.exit(1)
+
+    await connect_db()
+    oversold = False
+    try:
+        oversold = not await check_lowered_stock()
+        results = [
+            await benchmark_single_document(args.stock, args.workers, args.quantity),
+            await benchmark_sharded(args.stock, args.workers, args.quantity, args.shards),
+        ]
+        logger.info("\n" + "=" * 60)
+        logger.info(f"Stock inicial: {args.stock} | compradores: {args.workers} | unidades por compra: {args.quantity}")
+        for r in results:
+            ok = r["sold"] <= args.stock and r["sold"] + r["final"] == args.stock and r["final"] >= 0
+            oversold = oversold or not ok
+            logger.info(
+                f"  {r['mode']:>16}: {r['sold'] / args.quantity / r['elapsed']:,.0f} compras/s "
+                f"({r['elapsed']:.2f}s) vendido={r['sold']} final={r['final']} {'✅' if ok else '❌ SOBREVENTA'}"
+            )
+        logger.info("=" * 60)
+    finally:
+        await close_db()
+    if oversold:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de stock en un documento vs. en shards.")
+    parser.add_argument("--stock", type=int, default=20000, help="Stock inicial del producto")
+    parser.add_argument("--workers", type=int, default=200, help="Compradores concurrentes")
+    parser.add_argument("--quantity", type=int, default=1, help="Unidades por compra")
+    parser.add_argument("--shards", type=int, default=16, help="Cantidad de shards del modo repartido")
+    asyncio.run(main(parser.parse_args()))
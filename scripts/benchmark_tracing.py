@@ -0,0 +1,128 @@
+"""
+Benchmark de la sobrecarga de las trazas por solicitud.
+
+Simula una solicitud de checkout a través de TracingMiddleware sobre una app
+ASGI mínima que dispara los mismos ganchos que la API real: 8 comandos de
+MongoDB (eventos del TracingCommandListener), 1 llamada a Redis y 1 a Mercado
+Pago (spans de cliente). No usa red ni base de datos; los spans muestreados
+van al exportador pero no se exportan durante la medición.
+
+Variantes:
+- sin trazas (la app sin middleware ni ganchos)
+- muestreo 0% (caso normal en producción: solicitud descartada)
+- muestreo 0% con traceparent entrante descartado (se propaga sin registrar)
+- muestreo 100%
+
+Uso:
+    python scripts/benchmark_tracing.py --requests 20000 --rounds 5
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracing import tracer, TracingMiddleware, tracing_command_listener
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MONGO_COMMANDS_PER_REQUEST = 8
+
+
+def command_events(request_id: int):
+    started = SimpleNamespace(
+        command_name="find", command={"find": "orders", "filter": {}}, database_name="bench",
+        request_id=request_id, connection_id=("localhost", 27017),
+    )
+    succeeded = SimpleNamespace(request_id=request_id, connection_id=("localhost", 27017))
+    return started, succeeded
+
+
+async def checkout_app(scope, receive, send, traced: bool):
+    """Ganchos de una solicitud de checkout: Mongo, Redis y Mercado Pago."""
+    for i in range(MONGO_COMMANDS_PER_REQUEST):
+        started, succeeded = command_events(i)
+        if traced:
+            tracing_command_listener.started(started)
+            tracing_command_listener.succeeded(succeeded)
+    if traced:
+        with tracer.span("redis EVALSHA", "client", {"db.system": "redis"}):
+            pass
+        with tracer.span("mercadopago POST", "client", {"http.method": "POST"}):
+            tracer.outgoing_headers()
+    await send({"type": "http.response.start", "status": 201, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def make_scope(headers):
+    return {"type": "http", "method": "POST", "path": "/orders/", "headers": headers}
+
+
+async def measure(app, headers, requests: int) -> list:
+    """Latencias por solicitud en µs."""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await app(make_scope(headers), receive, send)
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    tracer.exporter._queue.clear()  # los spans no se exportan durante el benchmark
+    return latencies
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def main(args):
+    async def untraced(scope, receive, send):
+        await checkout_app(scope, receive, send, traced=False)
+
+    async def traced(scope, receive, send):
+        await checkout_app(scope, receive, send, traced=True)
+
+    middleware = TracingMiddleware(traced)
+    unsampled_parent = [(b"traceparent", b"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00")]
+    variants = {
+        "sin trazas": (untraced, [], None),
+        "muestreo 0%": (middleware, [], 0.0),
+        "0% + traceparent": (middleware, unsampled_parent, 0.0),
+        "muestreo 100%": (middleware, [], 1.0),
+    }
+    results = {name: [] for name in variants}
+
+    for _ in range(args.rounds):
+        for name, (app, headers, rate) in variants.items():
+            if rate is not None:
+                tracer.sample_rate = rate
+            results[name] += await measure(app, headers, args.requests)
+
+    baseline = statistics.median(results["sin trazas"])
+    logger.info("\n" + "=" * 60)
+    logger.info(f"Solicitudes por variante: {args.requests * args.rounds} "
+                f"({MONGO_COMMANDS_PER_REQUEST} comandos Mongo + Redis + Mercado Pago c/u)")
+    for name, values in results.items():
+        median = statistics.median(values)
+        logger.info(f"  {name:>18}: p50={median:.1f}µs p95={percentile(values, 0.95):.1f}µs sobrecarga p50={median - baseline:+.1f}µs")
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la sobrecarga de las trazas.")
+    parser.add_argument("--requests", type=int, default=20000, help="Solicitudes por variante y ronda")
+    parser.add_argument("--rounds", type=int, default=5, help="Rondas intercaladas")
+    asyncio.run(main(parser.parse_args()))
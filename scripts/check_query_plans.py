@@ -0,0 +1,464 @@
+"""
+Verificación de planes de consulta de todos los routers.
+
+Levanta un mongod local temporal (o usa --url), aplica los índices de
+index_registry.py, carga datos representativos y ejecuta `explain()` sobre cada
+forma de consulta de la API (productos, carrito, pedidos, admin, inventario,
+pagos, auth y los workers que las acompañan). Cada caso falla si el plan:
+
+- usa COLLSCAN,
+- ordena en memoria (etapa SORT),
+- examina más de `max_ratio` documentos por documento devuelto/coincidente.
+
+Los fallos nombran el endpoint. Los problemas ya conocidos (`known_issue`) se
+informan como advertencia y solo fallan con --strict; si uno deja de fallar se
+avisa para quitarlo de la lista.
+
+Uso:
+    python scripts/check_query_plans.py                       # mongod del PATH, datos en un directorio temporal
+    python scripts/check_query_plans.py --mongod /opt/mongodb/bin/mongod --scale 2
+    python scripts/check_query_plans.py --url mongodb://localhost:27017   # servidor existente (base temporal)
+    python scripts/check_query_plans.py --strict --only /admin
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from index_registry import ensure_indexes
+from models import OrderStatus, UserRole, ProductCategory, InventoryAlertStatus
+from payment_store import to_payment_document
+from query_guard import ADMIN_USERS_GUARD, ADMIN_ORDERS_GUARD, FORBIDDEN_PLAN_STAGES, iter_plan_stages
+import logging
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RATIO = 2.0
+
+
+@dataclass
+class PlanCase:
+    """
+    Una forma de consulta de un endpoint.
+    - kind: "find", "count" (count_documents) o "aggregate" (usa `pipeline`).
+    - max_ratio: documentos examinados por documento devuelto (find) o coincidente (count/aggregate).
+    """
+    endpoint: str
+    collection: str
+    filter: dict
+    kind: str = "find"
+    sort: Optional[list] = None
+    limit: int = 0
+    projection: Optional[dict] = None
+    pipeline: Optional[list] = None
+    max_ratio: float = DEFAULT_MAX_RATIO
+    known_issue: Optional[str] = None
+
+
+# --- mongod temporal ---
+
+class TemporaryMongod:
+    def __init__(self, binary: str, port: int):
+        self.binary = binary
+        self.port = port
+        self.dbpath = None
+        self.process = None
+
+    def start(self) -> str:
+        if shutil.which(self.binary) is None and not os.path.exists(self.binary):
+            raise RuntimeError(f"No se encontró '{self.binary}'. Instalá MongoDB o pasá --mongod / --url.")
+        self.dbpath = tempfile.mkdtemp(prefix="query-plans-")
+        self.process = subprocess.Popen(
+            [self.binary, "--dbpath", self.dbpath, "--port", str(self.port), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT
+        )
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def stop(self) -> None:
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.dbpath:
+            shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+async def wait_for_server(client, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.admin.command("ping")
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise RuntimeError("mongod no respondió a tiempo.")
+            await asyncio.sleep(0.5)
+
+
+# --- Datos representativos ---
+
+async def seed(db, scale: int) -> dict:
+    """Carga datos con distribuciones parecidas a producción. Devuelve valores de ejemplo para los filtros."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    categories = [category.value for category in ProductCategory]
+    statuses = [status.value for status in OrderStatus]
+
+    users = [{
+        "_id": ObjectId(),
+        "username": f"user{i}",
+        "email": f"user{i}@example.com",
+        "hashed_password": "x",
+        "role": UserRole.ADMIN.value if i % 50 == 0 else UserRole.CUSTOMER.value,
+        "age_verified": rng.random() < 0.7,
+    } for i in range(2000 * scale)]
+    await db.users.insert_many(users)
+    user_ids = [str(user["_id"]) for user in users]
+
+    products = [{
+        "_id": ObjectId(),
+        "name": f"Producto {i}",
+        "description": f"Descripción del producto {i}",
+        "category": rng.choice(categories),
+        "price": round(rng.uniform(500, 50000), 2),
+        "stock": 0 if rng.random() < 0.1 else rng.randint(1, 500),
+    } for i in range(400 * scale)]
+    await db.products.insert_many(products)
+    product_ids = [product["_id"] for product in products]
+
+    await db.carts.insert_many([
+        {"user_id": user_id, "items": [{"product_id": str(rng.choice(product_ids)), "quantity": rng.randint(1, 5)}]}
+        for user_id in user_ids
+    ])
+
+    orders = []
+    for i in range(6000 * scale):
+        status = rng.choice(statuses)
+        created_at = now - timedelta(minutes=rng.randint(0, 180 * 24 * 60))
+        order = {
+            "_id": ObjectId(),
+            "user_id": rng.choice(user_ids),
+            "items": [],
+            "total_amount": round(rng.uniform(1000, 100000), 2),
+            "status": status,
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        if status == OrderStatus.PENDING.value and rng.random() < 0.5:
+            order["payment_preference_id"] = f"pref-{i}"
+            order["next_payment_check_at"] = now + timedelta(minutes=rng.randint(-60, 600))
+            if rng.random() < 0.2:
+                order["payment_status"] = "in_process"
+        orders.append(order)
+    await db.orders.insert_many(orders)
+
+    mp_statuses = ["approved", "rejected", "pending", "in_process", "cancelled"]
+    await db.payments.insert_many([
+        to_payment_document({
+            "id": 1000000000 + i,
+            "status": rng.choice(mp_statuses),
+            "status_detail": "accredited",
+            "external_reference": str(rng.choice(orders)["_id"]),
+            "transaction_amount": round(rng.uniform(1000, 100000), 2),
+            "currency_id": "ARS",
+            "payment_method_id": "visa",
+            "date_created": (now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))).isoformat() + "Z",
+        })
+        for i in range(3000 * scale)
+    ])
+
+    alerts = []
+    for i, product_id in enumerate(product_ids[: 200 * scale]):
+        for j in range(4):
+            is_open = j == 3 and i % 3 == 0
+            timestamp = now - timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+            alert = {
+                "product_id": str(product_id),
+                "product_name": f"Producto {i}",
+                "stock": rng.randint(0, 10),
+                "threshold": 10,
+                "status": InventoryAlertStatus.OPEN.value if is_open else InventoryAlertStatus.RESOLVED.value,
+                "timestamp": timestamp,
+            }
+            if not is_open:
+                alert["resolved_at"] = timestamp + timedelta(hours=1)
+            alerts.append(alert)
+    await db.inventory_alerts.insert_many(alerts)
+
+    await db.refresh_tokens.insert_many([{
+        "token": uuid.uuid4().hex,
+        "user_id": rng.choice(user_ids),
+        "revoked": rng.random() < 0.3,
+        "expires_at": now + timedelta(days=rng.randint(1, 7)),
+    } for _ in range(3000 * scale)])
+
+    holds = {}
+    for _ in range(600 * scale):
+        key = (rng.choice(product_ids), rng.choice(user_ids))
+        holds[key] = {"product_id": key[0], "user_id": key[1], "quantity": rng.randint(1, 3), "expires_at": now + timedelta(minutes=rng.randint(-5, 15))}
+    await db.stock_holds.insert_many(list(holds.values()))
+
+    await db.product_sales.insert_many([{"_id": product_id, "units_sold": rng.randint(0, 5000)} for product_id in product_ids])
+    pairs = {}
+    for _ in range(3000 * scale):
+        a, b = rng.sample(product_ids, 2)
+        pairs[(a, b)] = {"product_id": a, "other_id": b, "count": rng.randint(1, 300)}
+    await db.product_pairs.insert_many(list(pairs.values()))
+
+    return {
+        "user_id": user_ids[7],
+        "user_oid": users[7]["_id"],
+        "username": users[7]["username"],
+        "product_id": product_ids[3],
+        "product_ids": product_ids[:20],
+        "order_id": orders[11]["_id"],
+        "order_ids": [str(order["_id"]) for order in orders[:20]],
+        "payment_mp_id": 1000000000 + 5,
+        "category": categories[0],
+        "now": now,
+    }
+
+
+# --- Casos por endpoint ---
+
+GUARD_SAMPLE_VALUES = {
+    "role": lambda s: UserRole.CUSTOMER.value,
+    "age_verified": lambda s: True,
+    "status": lambda s: OrderStatus.PENDING.value,
+    "user_id": lambda s: s["user_id"],
+    "created_at": lambda s: {"$gte": s["now"] - timedelta(days=30)},
+}
+
+
+def guard_cases(guard, collection: str, samples: dict) -> List[PlanCase]:
+    """Todas las combinaciones de filtros y orden que el QueryGuard declara como respaldadas por índice."""
+    cases = []
+    for shape in guard.shapes:
+        query = {field_name: GUARD_SAMPLE_VALUES[field_name](samples) for field_name in sorted(shape.filters)}
+        label = ",".join(sorted(shape.filters)) or "sin filtros"
+        cases.append(PlanCase(f"{guard.name} (count, {label})", collection, query, kind="count"))
+        for sort_field in shape.sorts:
+            for direction in (1, -1):
+                cases.append(PlanCase(
+                    f"{guard.name} ({label}; sort {sort_field} {direction})",
+                    collection, query, sort=[(sort_field, direction)], limit=50
+                ))
+    return cases
+
+
+def build_cases(s: dict) -> List[PlanCase]:
+    now = s["now"]
+    pending = OrderStatus.PENDING.value
+    return [
+        # ---------- products ----------
+        PlanCase("GET /products/", "products", {"stock": {"$gt": 0}}, limit=20),
+        PlanCase("GET /products/ (count)", "products", {"stock": {"$gt": 0}}, kind="count"),
+        PlanCase("GET /products/?category", "products", {"stock": {"$gt": 0}, "category": s["category"]}, limit=20),
+        PlanCase("GET /products/?category&min_price&max_price", "products",
+                 {"stock": {"$gt": 0}, "category": s["category"], "price": {"$gte": 1000, "$lte": 20000}}, limit=20),
+        PlanCase("GET /products/?search", "products",
+                 {"stock": {"$gt": 0}, "$or": [{"name": {"$regex": "prod", "$options": "i"}}, {"description": {"$regex": "prod", "$options": "i"}}]},
+                 limit=20, known_issue="la búsqueda por regex insensible a mayúsculas en name/description no puede usar índice"),
+        PlanCase("GET /products/{id}", "products", {"_id": s["product_id"]}, limit=1),
+        PlanCase("GET /products/top-sellers", "product_sales", {}, sort=[("units_sold", -1)], limit=20),
+        PlanCase("GET /products/top-sellers (productos)", "products", {"_id": {"$in": s["product_ids"]}}),
+        PlanCase("GET /products/{id}/frequently-bought-together", "product_pairs", {"product_id": s["product_id"]}, sort=[("count", -1)], limit=10),
+
+        # ---------- cart ----------
+        PlanCase("GET /cart/", "carts", {"user_id": s["user_id"]}, limit=1),
+        PlanCase("POST /cart/add (producto)", "products", {"_id": s["product_id"]}, limit=1),
+        PlanCase("POST /cart/add (reservas activas)", "stock_holds",
+                 {"product_id": {"$in": s["product_ids"]}, "expires_at": {"$gt": now}, "user_id": {"$ne": s["user_id"]}}, kind="aggregate",
+                 pipeline=[{"$group": {"_id": "$product_id", "held": {"$sum": "$quantity"}}}]),
+
+        # ---------- orders ----------
+        PlanCase("GET /orders/me", "orders", {"user_id": s["user_id"]}, sort=[("created_at", -1)]),
+        PlanCase("GET /orders/{id}", "orders", {"_id": s["order_id"]}, limit=1),
+
+        # ---------- admin ----------
+        PlanCase("GET /admin/stats (usuarios)", "users", {}, kind="count",
+                 known_issue="count_documents({}) recorre la colección; estimated_document_count() usa los metadatos"),
+        PlanCase("GET /admin/stats (productos)", "products", {}, kind="count",
+                 known_issue="count_documents({}) recorre la colección; estimated_document_count() usa los metadatos"),
+        PlanCase("GET /admin/stats (pedidos)", "orders", {}, kind="count",
+                 known_issue="count_documents({}) recorre la colección; estimated_document_count() usa los metadatos"),
+        *[PlanCase(f"GET /admin/stats (pedidos {status.value})", "orders", {"status": status.value}, kind="count")
+          for status in (OrderStatus.PENDING, OrderStatus.PROCESSING, OrderStatus.DELIVERED, OrderStatus.CANCELLED)],
+        PlanCase("GET /admin/stats (ingresos)", "orders", {"status": OrderStatus.DELIVERED.value}, kind="aggregate",
+                 pipeline=[{"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}]),
+        PlanCase("GET /admin/stats (ingresos 30 días)", "orders",
+                 {"status": OrderStatus.DELIVERED.value, "created_at": {"$gte": now - timedelta(days=30)}}, kind="aggregate",
+                 pipeline=[{"$group": {"_id": None, "total": {"$sum": "$total_amount"}}}]),
+        PlanCase("GET /admin/stats (bajo stock)", "products", {"stock": {"$lt": 10}}, kind="count"),
+        PlanCase("GET /admin/stats (verificados)", "users", {"age_verified": True}, kind="count"),
+        *guard_cases(ADMIN_USERS_GUARD, "users", s),
+        PlanCase("GET /admin/users?search", "users",
+                 {"$or": [{"username": {"$regex": "user1", "$options": "i"}}, {"email": {"$regex": "user1", "$options": "i"}}]},
+                 sort=[("_id", 1)], limit=50, known_issue="la búsqueda por regex insensible a mayúsculas no puede usar índice"),
+        *guard_cases(ADMIN_ORDERS_GUARD, "orders", s),
+        PlanCase("GET /admin/orders (usuarios del lote)", "users", {"_id": {"$in": [s["user_oid"]]}}, projection={"username": 1, "email": 1}),
+        PlanCase("GET /admin/export/users", "users", {}, sort=[("_id", 1)], projection={"hashed_password": 0}),
+        PlanCase("GET /admin/export/orders", "orders", {}, sort=[("_id", 1)]),
+        PlanCase("GET /admin/export/orders?status_filter", "orders", {"status": pending}, sort=[("_id", 1)],
+                 known_issue="exportación filtrada ordenada por _id: no hay índice (status, _id)"),
+        PlanCase("GET /admin/export/payments", "payments", {}, sort=[("_id", 1)]),
+        PlanCase("GET /admin/export/payments?external_reference", "payments", {"external_reference": s["order_ids"][0]}, sort=[("_id", 1)]),
+
+        # ---------- inventory ----------
+        PlanCase("PUT /inventory/stock/bulk (lectura del lote)", "products", {"_id": {"$in": s["product_ids"]}},
+                 projection={"name": 1, "stock": 1, "stock_shards": 1, "stock_cached": 1}),
+        PlanCase("GET /inventory/alerts", "inventory_alerts", {}, sort=[("timestamp", -1), ("_id", -1)], limit=51),
+        PlanCase("GET /inventory/alerts?status", "inventory_alerts", {"status": InventoryAlertStatus.RESOLVED.value},
+                 sort=[("timestamp", -1), ("_id", -1)], limit=51),
+        PlanCase("GET /inventory/alerts?cursor", "inventory_alerts",
+                 {"$or": [{"timestamp": {"$lt": now - timedelta(days=10)}},
+                          {"timestamp": now - timedelta(days=10), "_id": {"$lt": ObjectId()}}]},
+                 sort=[("timestamp", -1), ("_id", -1)], limit=51),
+        PlanCase("GET /inventory/alerts/summary (abiertas)", "inventory_alerts", {"status": InventoryAlertStatus.OPEN.value}, kind="count"),
+        PlanCase("GET /inventory/alerts/summary (resueltas)", "inventory_alerts", {"status": InventoryAlertStatus.RESOLVED.value}, kind="count"),
+
+        # ---------- payments ----------
+        PlanCase("POST /payments/create-preference/{order_id}", "orders", {"_id": s["order_id"]}, limit=1),
+        PlanCase("POST /payments/webhook (pago ya procesado)", "payments", {"id": s["payment_mp_id"]}, projection={"status": 1}, limit=1),
+        PlanCase("worker conciliación de pagos", "orders",
+                 {"status": pending, "payment_preference_id": {"$exists": True}, "next_payment_check_at": {"$lte": now}},
+                 sort=[("next_payment_check_at", 1)], limit=100, projection={"created_at": 1}),
+        PlanCase("worker sweeper de pedidos vencidos", "orders",
+                 {"status": pending, "created_at": {"$lt": now - timedelta(hours=1)}, "payment_status": {"$nin": ["in_process", "pending", "authorized"]}},
+                 sort=[("created_at", 1)], limit=200, projection={"_id": 1}),
+
+        # ---------- auth ----------
+        PlanCase("POST /auth/token", "users", {"$or": [{"username": s["username"]}, {"email": s["username"]}]}, limit=1),
+        PlanCase("POST /auth/refresh (tokens)", "refresh_tokens", {"revoked": False},
+                 known_issue="refresh lee todos los tokens no revocados y compara el hash en Python (sin índice en revoked)"),
+        PlanCase("GET /auth/me", "users", {"_id": s["user_oid"]}, limit=1),
+        PlanCase("POST /age-verification/verify-age", "users", {"_id": s["user_oid"]}, limit=1),
+    ]
+
+
+# --- Explain ---
+
+def _plan_parts(explain: dict):
+    """(queryPlanner, executionStats) de un explain de find o de aggregate."""
+    if "stages" in explain:
+        cursor_stage = explain["stages"][0].get("$cursor", {})
+        return cursor_stage.get("queryPlanner", {}), cursor_stage.get("executionStats", {})
+    return explain.get("queryPlanner", {}), explain.get("executionStats", {})
+
+
+async def explain_case(db, case: PlanCase) -> dict:
+    collection = db[case.collection]
+    if case.kind == "find":
+        cursor = collection.find(case.filter, projection=case.projection)
+        if case.sort:
+            cursor = cursor.sort(case.sort)
+        if case.limit:
+            cursor = cursor.limit(case.limit)
+        explain = await cursor.explain()
+    else:
+        # count_documents se ejecuta como aggregate [$match, $group]
+        pipeline = [{"$match": case.filter}]
+        pipeline += case.pipeline if case.kind == "aggregate" else [{"$group": {"_id": 1, "n": {"$sum": 1}}}]
+        explain = await db.command({
+            "explain": {"aggregate": case.collection, "pipeline": pipeline, "cursor": {}},
+            "verbosity": "executionStats",
+        })
+
+    planner, stats = _plan_parts(explain)
+    stages = set(iter_plan_stages(planner.get("winningPlan", {})))
+    docs_examined = stats.get("totalDocsExamined", 0)
+    if case.kind == "find":
+        reference = stats.get("nReturned", 0)
+    else:
+        reference = await collection.count_documents(case.filter)
+    return {
+        "stages": stages,
+        "docs_examined": docs_examined,
+        "reference": reference,
+        "ratio": docs_examined / max(reference, 1),
+    }
+
+
+def problems_for(case: PlanCase, result: dict) -> List[str]:
+    problems = []
+    for stage in sorted(result["stages"] & FORBIDDEN_PLAN_STAGES):
+        problems.append("COLLSCAN" if stage == "COLLSCAN" else "SORT en memoria")
+    if result["ratio"] > case.max_ratio:
+        problems.append(f"examina {result['docs_examined']} documentos para {result['reference']} (ratio {result['ratio']:.1f} > {case.max_ratio})")
+    return problems
+
+
+async def run_checks(db, cases: List[PlanCase], strict: bool) -> int:
+    failures = 0
+    for case in cases:
+        result = await explain_case(db, case)
+        problems = problems_for(case, result)
+        if not problems:
+            if case.known_issue:
+                print(f"🎉 {case.endpoint}: el problema conocido ya no ocurre ({case.known_issue}); quitar known_issue")
+            else:
+                print(f"✅ {case.endpoint} [{case.collection}] ratio {result['ratio']:.2f}")
+            continue
+        detail = "; ".join(problems)
+        if case.known_issue and not strict:
+            print(f"⚠️  {case.endpoint} [{case.collection}]: {detail} (conocido: {case.known_issue})")
+            continue
+        failures += 1
+        print(f"❌ {case.endpoint} [{case.collection}]: {detail}")
+    return failures
+
+
+async def main(args) -> int:
+    mongod = None
+    url = args.url
+    if not url:
+        mongod = TemporaryMongod(args.mongod, args.port)
+        url = mongod.start()
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=5000)
+    database_name = f"query_plans_{uuid.uuid4().hex[:8]}"
+    db = client[database_name]
+    try:
+        await wait_for_server(client)
+        report = await ensure_indexes(db, background=False)
+        if report["failed"]:
+            print(f"❌ No se pudieron crear índices: {report['failed']}")
+            return 1
+        samples = await seed(db, args.scale)
+        cases = [case for case in build_cases(samples) if not args.only or args.only in case.endpoint]
+        failures = await run_checks(db, cases, args.strict)
+        print(f"\n{len(cases)} formas de consulta verificadas, {failures} con problemas.")
+        return 1 if failures else 0
+    finally:
+        await client.drop_database(database_name)
+        client.close()
+        if mongod:
+            mongod.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica con explain() que las consultas de la API usen índices.")
+    parser.add_argument("--mongod", default="mongod", help="Binario de mongod a levantar")
+    parser.add_argument("--port", type=int, default=27999, help="Puerto del mongod temporal")
+    parser.add_argument("--url", default=None, help="Usar un servidor existente en lugar de levantar mongod")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplicador del volumen de datos")
+    parser.add_argument("--strict", action="store_true", help="Los problemas conocidos también fallan")
+    parser.add_argument("--only", default=None, help="Solo los endpoints que contengan este texto")
+    sys.exit(asyncio.run(main(parser.parse_args())))
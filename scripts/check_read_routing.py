@@ -0,0 +1,96 @@
+"""
+Verifica el enrutamiento de lecturas contra un replica set (ver
+docker-compose.replicaset.yaml):
+
+1. Las lecturas de los perfiles "catalog" y "reporting" se sirven desde un
+   secundario (se compara el host de `explain` con el primario actual).
+2. Leer las propias escrituras: se inserta un documento en el primario y se lee
+   enseguida desde un secundario, con y sin sesión causal. Con sesión causal
+   (y concerns "majority") la lectura siempre lo encuentra; sin sesión, las
+   lecturas pueden no verlo todavía por el retraso de replicación.
+
+Los documentos de prueba se borran al terminar.
+
+Uso:
+    DATABASE_URL="mongodb://localhost:27021,localhost:27022,localhost:27023/?replicaSet=rs0" \\
+        python scripts/check_read_routing.py [--writes 200]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo.read_preferences import Secondary
+from database import connect_db, close_db, db, get_read_collection, get_consistent_collection
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEST_COLLECTION = "read_routing_check"
+
+
+async def check_profile_routing() -> bool:
+    hello = await db.client.admin.command("hello")
+    if not hello.get("setName"):
+        logger.error("❌ DATABASE_URL no apunta a un replica set.")
+        return False
+    primary = hello["primary"]
+    primary_port = int(primary.rsplit(":", 1)[1])
+    ok = True
+    for profile in ("catalog", "reporting"):
+        explain = await get_read_collection("products", profile).find({}).limit(1).explain()
+        server = explain.get("serverInfo", {})
+        host = f"{server.get('host')}:{server.get('port')}"
+        # serverInfo.host es el hostname del servidor, no la dirección del replica set: se compara el puerto
+        served_by_secondary = server.get("port") != primary_port
+        logger.info(f"{'✅' if served_by_secondary else '⚠️ '} Perfil '{profile}' servido por {host} (primario: {primary})")
+        ok = ok and served_by_secondary
+    return ok
+
+
+async def check_read_your_writes(writes: int) -> bool:
+    writer = get_consistent_collection(TEST_COLLECTION)
+    # Lectura forzada a un secundario para que el retraso de replicación sea visible
+    secondary_reader = get_consistent_collection(TEST_COLLECTION).with_options(read_preference=Secondary())
+    misses_without_session = 0
+    misses_with_session = 0
+    try:
+        for i in range(writes):
+            result = await writer.insert_one({"n": i, "mode": "plain"})
+            if not await secondary_reader.find_one({"_id": result.inserted_id}):
+                misses_without_session += 1
+
+            async with await db.client.start_session(causal_consistency=True) as session:
+                result = await writer.insert_one({"n": i, "mode": "causal"}, session=session)
+                if not await secondary_reader.find_one({"_id": result.inserted_id}, session=session):
+                    misses_with_session += 1
+    finally:
+        await db.db.drop_collection(TEST_COLLECTION)
+
+    logger.info(f"   Sin sesión causal: {misses_without_session}/{writes} lecturas no vieron su escritura")
+    logger.info(f"   Con sesión causal: {misses_with_session}/{writes} lecturas no vieron su escritura")
+    ok = misses_with_session == 0
+    logger.info(f"{'✅' if ok else '❌'} Lecturas de las propias escrituras con sesión causal")
+    return ok
+
+
+async def main(args):
+    await connect_db()
+    try:
+        routing_ok = await check_profile_routing()
+        causal_ok = await check_read_your_writes(args.writes)
+    finally:
+        await close_db()
+    if not (routing_ok and causal_ok):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica el enrutamiento de lecturas en un replica set.")
+    parser.add_argument("--writes", type=int, default=200, help="Escrituras para la prueba de lecturas propias")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,98 @@
+"""
+Script para calcular (de forma incremental) las estadísticas de productos:
+más vendidos y "frecuentemente comprados juntos".
+Pensado para ejecutarse periódicamente (cron / Railway cron) si el job no
+corre dentro de la app (PRODUCT_STATS_INTERVAL_MINUTES=0).
+
+Uso:
+    python scripts/compute_product_stats.py
+    python scripts/compute_product_stats.py --reset            # recalcula desde cero
+    python scripts/compute_product_stats.py --seed 5000000     # benchmark con pedidos sintéticos (no producción)
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from config import settings
+from database import connect_db, close_db, get_collection
+from models import OrderStatus
+from product_stats import compute_product_stats, JOB_NAME
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEED_BATCH_SIZE = 10_000
+
+
+async def seed_orders(count: int, products: int = 500) -> None:
+    """Inserta pedidos sintéticos pagados, repartidos en los últimos 90 días."""
+    orders_collection = get_collection("orders")
+    product_ids = [ObjectId() for _ in range(products)]
+    # Distribución sesgada: pocos productos concentran la mayoría de las ventas
+    weights = [1 / (rank + 1) for rank in range(products)]
+    start = datetime.utcnow() - timedelta(days=90)
+    status_choices = [OrderStatus.PROCESSING.value, OrderStatus.SHIPPED.value, OrderStatus.DELIVERED.value]
+
+    inserted = 0
+    started = time.perf_counter()
+    while inserted < count:
+        batch = []
+        for _ in range(min(SEED_BATCH_SIZE, count - inserted)):
+            chosen = set(random.choices(product_ids, weights=weights, k=random.randint(1, 5)))
+            batch.append({
+                "user_id": str(ObjectId()),
+                "items": [
+                    {"product_id": str(pid), "name": f"Producto {pid}", "quantity": random.randint(1, 3), "price_at_purchase": 1000.0}
+                    for pid in chosen
+                ],
+                "total_amount": 1000.0 * len(chosen),
+                "status": random.choice(status_choices),
+                "created_at": start + timedelta(seconds=random.randint(0, 80 * 24 * 3600)),
+            })
+        await orders_collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+        if inserted % (SEED_BATCH_SIZE * 50) == 0 or inserted == count:
+            logger.info(f"  ✓ {inserted} pedidos sintéticos insertados ({time.perf_counter() - started:.1f}s)")
+
+
+async def main(args):
+    await connect_db()
+    try:
+        if args.reset:
+            await get_collection("product_sales").delete_many({})
+            await get_collection("product_pairs").delete_many({})
+            await get_collection("job_state").delete_one({"_id": JOB_NAME})
+            logger.info("🧹 Estadísticas y marca de agua reiniciadas.")
+
+        if args.seed:
+            if settings.ENV == "production":
+                logger.error("❌ --seed no está permitido en producción.")
+                sys.exit(1)
+            logger.info(f"🌱 Insertando {args.seed} pedidos sintéticos...")
+            await seed_orders(args.seed)
+
+        summary = await compute_product_stats(batch_size=args.batch_size)
+        if summary.get("skipped"):
+            logger.warning("⚠️ Otro proceso está calculando las estadísticas (lease tomado); intenta más tarde.")
+        else:
+            logger.info(f"✅ Resultado: {summary}")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcula estadísticas de productos a partir de los pedidos.")
+    parser.add_argument("--reset", action="store_true", help="Borra las estadísticas y recalcula desde cero")
+    parser.add_argument("--seed", type=int, default=0, help="Inserta N pedidos sintéticos antes de calcular (benchmark)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Tamaño de lote del cursor de pedidos")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,142 @@
+"""
+Servidor falso de la API de Mercado Pago para desarrollo y pruebas locales.
+
+Implementa (en memoria) lo que usa payment_gateway.py:
+    POST /checkout/preferences
+    GET  /v1/payments/{id}
+    GET  /v1/payments/search?external_reference=...
+
+y endpoints para simular pagos sin pasar por el checkout real:
+    POST /_fake/payments            {"external_reference": "<order_id>", "status": "approved", "transaction_amount": 1500}
+    PUT  /_fake/payments/{id}       {"status": "approved"}
+    POST /_fake/reset
+
+Además puede agregar latencia y errores para probar la conciliación bajo fallas.
+
+Uso:
+    python scripts/fake_mercadopago.py --port 9000 [--latency-ms 200] [--error-rate 0.1]
+    # y en el .env de la API:
+    MERCADOPAGO_API_BASE_URL=http://localhost:9000
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import uvicorn
+
+app = FastAPI(title="Fake Mercado Pago")
+
+payments: dict = {}
+preferences: dict = {}
+_ids = itertools.count(1000000001)
+options = {"latency_ms": 0, "error_rate": 0.0}
+
+
+class FakePayment(BaseModel):
+    external_reference: str
+    status: str = "approved"
+    status_detail: Optional[str] = None
+    transaction_amount: float = 0.0
+
+
+class FakePaymentUpdate(BaseModel):
+    status: str
+    status_detail: Optional[str] = None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+@app.middleware("http")
+async def simulate_network(request: Request, call_next):
+    """Latencia y errores 500 simulados (solo para la API, no para /_fake)."""
+    if not request.url.path.startswith("/_fake"):
+        if options["latency_ms"]:
+            await asyncio.sleep(options["latency_ms"] / 1000)
+        if random.random() < options["error_rate"]:
+            return JSONResponse({"message": "simulated error", "status": 500}, status_code=500)
+    return await call_next(request)
+
+
+# --- API compatible con Mercado Pago ---
+
+@app.post("/checkout/preferences", status_code=201)
+async def create_preference(preference: dict):
+    preference_id = f"fake-pref-{next(_ids)}"
+    preferences[preference_id] = {**preference, "id": preference_id, "date_created": _now()}
+    return {
+        "id": preference_id,
+        "init_point": f"http://localhost/fake-checkout/{preference_id}",
+        "sandbox_init_point": f"http://localhost/fake-checkout/{preference_id}",
+        "external_reference": preference.get("external_reference"),
+    }
+
+
+@app.get("/v1/payments/search")
+async def search_payments(external_reference: Optional[str] = None, limit: int = 30, criteria: str = "desc"):
+    results = [p for p in payments.values() if external_reference is None or p["external_reference"] == external_reference]
+    results.sort(key=lambda p: p["date_created"], reverse=(criteria == "desc"))
+    return {"paging": {"total": len(results), "limit": limit, "offset": 0}, "results": results[:limit]}
+
+
+@app.get("/v1/payments/{payment_id}")
+async def get_payment(payment_id: int):
+    if payment_id not in payments:
+        raise HTTPException(status_code=404, detail={"message": "Payment not found", "status": 404})
+    return payments[payment_id]
+
+
+# --- Control del servidor falso ---
+
+@app.post("/_fake/payments", status_code=201)
+async def fake_create_payment(payment: FakePayment):
+    payment_id = next(_ids)
+    payments[payment_id] = {
+        "id": payment_id,
+        "external_reference": payment.external_reference,
+        "status": payment.status,
+        "status_detail": payment.status_detail or ("accredited" if payment.status == "approved" else payment.status),
+        "transaction_amount": payment.transaction_amount,
+        "currency_id": "ARS",
+        "payment_method_id": "visa",
+        "date_created": _now(),
+        "date_last_updated": _now(),
+    }
+    return payments[payment_id]
+
+
+@app.put("/_fake/payments/{payment_id}")
+async def fake_update_payment(payment_id: int, update: FakePaymentUpdate):
+    if payment_id not in payments:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    payments[payment_id].update({
+        "status": update.status,
+        "status_detail": update.status_detail or update.status,
+        "date_last_updated": _now(),
+    })
+    return payments[payment_id]
+
+
+@app.post("/_fake/reset")
+async def fake_reset():
+    payments.clear()
+    preferences.clear()
+    return {"ok": True}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de Mercado Pago.")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=int, default=0, help="Latencia agregada a cada llamada")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas que responden 500")
+    args = parser.parse_args()
+    options.update(latency_ms=args.latency_ms, error_rate=args.error_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
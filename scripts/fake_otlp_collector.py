@@ -0,0 +1,74 @@
+"""
+Collector OTLP mínimo para desarrollo: recibe trazas por OTLP/HTTP JSON y las
+guarda en memoria (y opcionalmente en un archivo JSON lines).
+
+    POST /v1/traces          lo que envía tracing.py con TRACING_EXPORTER=otlp
+    GET  /_fake/traces       spans recibidos agrupados por traza, con su duración
+    POST /_fake/reset
+
+Uso:
+    python scripts/fake_otlp_collector.py --port 4318 [--output traces.jsonl]
+    # y en el .env de la API:
+    TRACING_ENABLED=true
+    TRACING_EXPORTER=otlp
+    TRACING_OTLP_ENDPOINT=http://localhost:4318/v1/traces
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Optional
+
+from fastapi import FastAPI, Request
+import uvicorn
+
+app = FastAPI(title="Fake OTLP collector")
+
+spans: list = []
+options = {"output": None}
+
+
+@app.post("/v1/traces")
+async def receive_traces(request: Request):
+    payload = await request.json()
+    received = [
+        span
+        for resource_spans in payload.get("resourceSpans", [])
+        for scope_spans in resource_spans.get("scopeSpans", [])
+        for span in scope_spans.get("spans", [])
+    ]
+    spans.extend(received)
+    if options["output"]:
+        with open(options["output"], "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(span) + "\n" for span in received)
+    return {"partialSuccess": {}}
+
+
+@app.get("/_fake/traces")
+async def fake_traces(trace_id: Optional[str] = None):
+    traces = defaultdict(list)
+    for span in spans:
+        if trace_id is None or span["traceId"] == trace_id:
+            traces[span["traceId"]].append({
+                "name": span["name"],
+                "span_id": span["spanId"],
+                "parent_id": span.get("parentSpanId"),
+                "duration_ms": (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1_000_000,
+                "status": span.get("status", {}).get("code"),
+            })
+    return traces
+
+
+@app.post("/_fake/reset")
+async def fake_reset():
+    spans.clear()
+    return {"ok": True}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collector OTLP/HTTP JSON falso.")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default=None, help="Archivo JSON lines donde agregar los spans recibidos")
+    args = parser.parse_args()
+    options.update(output=args.output)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
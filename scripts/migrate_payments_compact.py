@@ -0,0 +1,135 @@
+"""
+Migra los documentos de `payments` al formato compacto (ver payment_store.py):
+campos consultables + payload original de MP comprimido.
+
+Mide el tamaño de la colección (collStats) y la latencia de las consultas
+habituales antes y después de migrar, para comparar.
+
+Uso:
+    python scripts/migrate_payments_compact.py --dry-run     # solo mide
+    python scripts/migrate_payments_compact.py [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import ReplaceOne
+from database import connect_db, close_db, get_database
+from payment_store import SCHEMA_VERSION, to_payment_document
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUERY_REPETITIONS = 20
+
+
+async def collection_stats(db) -> dict:
+    stats = await db.command("collStats", "payments")
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "storageSize": stats.get("storageSize", 0),
+        "avgObjSize": stats.get("avgObjSize", 0),
+        "totalIndexSize": stats.get("totalIndexSize", 0),
+    }
+
+
+async def _time_query(run) -> float:
+    """Mediana en ms de QUERY_REPETITIONS ejecuciones."""
+    timings = []
+    for _ in range(QUERY_REPETITIONS):
+        start = time.perf_counter()
+        await run()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def query_latencies(db) -> dict:
+    payments = db.payments
+    sample = await payments.find_one({"external_reference": {"$exists": True}}, projection={"external_reference": 1})
+    external_reference = sample["external_reference"] if sample else "inexistente"
+    return {
+        "por_external_reference": await _time_query(
+            lambda: payments.find({"external_reference": external_reference}).to_list(length=None)
+        ),
+        "aprobados_recientes": await _time_query(
+            lambda: payments.find({"status": "approved"}).sort("date_created", -1).limit(50).to_list(length=50)
+        ),
+        "ultimos_pagos": await _time_query(
+            lambda: payments.find().sort("date_created", -1).limit(50).to_list(length=50)
+        ),
+    }
+
+
+async def migrate(db, batch_size: int) -> int:
+    payments = db.payments
+    migrated = 0
+    cursor = payments.find({"schema": {"$ne": SCHEMA_VERSION}}, batch_size=batch_size)
+    operations = []
+    async for document in cursor:
+        compact = to_payment_document(document)
+        operations.append(ReplaceOne({"_id": document["_id"]}, compact))
+        if len(operations) >= batch_size:
+            await payments.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+            logger.info(f"   {migrated} pagos migrados...")
+    if operations:
+        await payments.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    return migrated
+
+
+def print_report(label: str, stats: dict, latencies: dict) -> None:
+    print(f"\n📊 {label}")
+    print(f"   Documentos:        {stats['count']}")
+    print(f"   Tamaño de datos:   {stats['size'] / 1024:.1f} KiB")
+    print(f"   Almacenamiento:    {stats['storageSize'] / 1024:.1f} KiB")
+    print(f"   Tamaño promedio:   {stats['avgObjSize']} bytes")
+    print(f"   Índices:           {stats['totalIndexSize'] / 1024:.1f} KiB")
+    for name, millis in latencies.items():
+        print(f"   {name}: {millis:.2f} ms (mediana de {QUERY_REPETITIONS})")
+
+
+async def main(args):
+    await connect_db()
+    try:
+        db = await get_database()
+        before_stats = await collection_stats(db)
+        before_latencies = await query_latencies(db)
+        print_report("Antes de migrar", before_stats, before_latencies)
+
+        if args.dry_run:
+            pending = await db.payments.count_documents({"schema": {"$ne": SCHEMA_VERSION}})
+            print(f"\n🔎 Modo dry-run: {pending} pagos por migrar.")
+            return
+
+        migrated = await migrate(db, args.batch_size)
+        logger.info(f"✅ {migrated} pagos migrados al formato compacto.")
+
+        # collStats no refleja el espacio liberado hasta que WiredTiger lo reutiliza;
+        # `compact` lo devuelve al sistema si hace falta
+        after_stats = await collection_stats(db)
+        after_latencies = await query_latencies(db)
+        print_report("Después de migrar", after_stats, after_latencies)
+
+        if before_stats["size"]:
+            reduction = 100 * (1 - after_stats["size"] / before_stats["size"])
+            print(f"\n📉 Reducción del tamaño de datos: {reduction:.1f}%")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migra los pagos al formato compacto y mide el resultado.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo medir, sin migrar")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documentos por bulk_write")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,70 @@
+"""
+Script de mantenimiento del ledger de inventario.
+
+Uso:
+    python scripts/reconcile_inventory.py --baseline     # snapshot inicial desde products.stock (una vez)
+    python scripts/reconcile_inventory.py --compact      # compacta movimientos en snapshots
+    python scripts/reconcile_inventory.py --reconcile    # compara ledger vs products.stock
+    python scripts/reconcile_inventory.py --stock-at <product_id> [--at 2025-01-31T23:59:59]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_db, close_db
+from inventory_ledger import create_baseline_snapshots, compact_snapshots, reconcile, stock_at
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def main(args):
+    await connect_db()
+    try:
+        if args.baseline:
+            await create_baseline_snapshots(batch_size=args.batch_size)
+
+        if args.compact:
+            summary = await compact_snapshots(batch_size=args.batch_size)
+            logger.info(f"✅ Compactación: {summary}")
+
+        if args.stock_at:
+            at = datetime.fromisoformat(args.at) if args.at else None
+            stock = await stock_at(args.stock_at, at)
+            logger.info(f"📦 Stock del producto {args.stock_at} según el ledger{f' al {at}' if at else ''}: {stock}")
+
+        if args.reconcile:
+            mismatches = await reconcile(batch_size=args.batch_size)
+            if not mismatches:
+                logger.info("✅ El ledger coincide con products.stock para todos los productos.")
+            for m in mismatches:
+                logger.warning(
+                    f"  ⚠️  {m['product_id']} ({m['name']}): ledger={m['ledger_stock']} "
+                    f"products={m['products_stock']} diferencia={m['difference']:+d}"
+                )
+            if mismatches:
+                sys.exit(2)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento del ledger de inventario.")
+    parser.add_argument("--baseline", action="store_true", help="Crea snapshots base con el stock actual")
+    parser.add_argument("--compact", action="store_true", help="Compacta los movimientos nuevos en snapshots")
+    parser.add_argument("--reconcile", action="store_true", help="Compara el ledger con products.stock")
+    parser.add_argument("--stock-at", help="Calcula el stock de un producto según el ledger")
+    parser.add_argument("--at", help="Fecha ISO para --stock-at (por defecto: ahora)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Tamaño de lote de los recorridos")
+    parsed = parser.parse_args()
+    if not (parsed.baseline or parsed.compact or parsed.reconcile or parsed.stock_at):
+        parser.print_help()
+        sys.exit(1)
+    asyncio.run(main(parsed))
@@ -0,0 +1,60 @@
+"""
+Conciliación manual de pagos con Mercado Pago.
+
+Uso:
+    python scripts/reconcile_payments.py              # una pasada (como el worker de la app)
+    python scripts/reconcile_payments.py --backfill   # programa la consulta de pedidos pendientes
+                                                      # creados antes de existir el conciliador
+
+Para probar contra el servidor falso:
+    python scripts/fake_mercadopago.py --port 9000 &
+    MERCADOPAGO_API_BASE_URL=http://localhost:9000 python scripts/reconcile_payments.py
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+# Agregar el directorio raíz al path para importar módulos
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_db, close_db, get_collection
+from models import OrderStatus
+from payment_reconciler import reconcile_payments
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def backfill() -> None:
+    """Marca para consulta inmediata los pedidos pendientes con preferencia y sin próxima consulta."""
+    result = await get_collection("orders").update_many(
+        {
+            "status": OrderStatus.PENDING.value,
+            "payment_preference_id": {"$exists": True},
+            "next_payment_check_at": {"$exists": False},
+        },
+        {"$set": {"next_payment_check_at": datetime.utcnow()}}
+    )
+    logger.info(f"🗓️  {result.modified_count} pedidos pendientes programados para conciliación.")
+
+
+async def main(args):
+    await connect_db()
+    try:
+        if args.backfill:
+            await backfill()
+        summary = await reconcile_payments(batch_size=args.batch_size)
+        logger.info(f"✅ Conciliación terminada: {summary}")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concilia pedidos pendientes con los pagos de Mercado Pago.")
+    parser.add_argument("--backfill", action="store_true", help="Programa los pedidos pendientes anteriores al conciliador")
+    parser.add_argument("--batch-size", type=int, default=None, help="Pedidos por lote")
+    asyncio.run(main(parser.parse_args()))
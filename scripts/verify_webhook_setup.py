@@ -84,7 +84,7 @@ async def verify_webhook_setup():
                 payment_id = payment.get("id", "N/A")
                 status = payment.get("status", "N/A")
                 external_ref = payment.get("external_reference", "N/A")
-                amount = payment.get("transaction_amount", 0)
+                amount = payment.get("amount", payment.get("transaction_amount", 0))
                 date_created = payment.get("date_created", "N/A")
                 
                 print(f"\n   Payment ID: {payment_id}")
@@ -0,0 +1,260 @@
+"""
+Detector asíncrono de bajo stock.
+
+Escucha los cambios de stock de los productos y mantiene como máximo UNA alerta
+abierta por producto (upsert sobre un índice único parcial). Cuando el stock se
+repone por encima del umbral, la alerta abierta se resuelve automáticamente.
+
+Fuentes de eventos:
+- Change stream de MongoDB sobre `products` (requiere replica set).
+- Hook en la aplicación (`notify_stock_change`) cuando no hay change streams.
+
+Todo el trabajo de alertas ocurre fuera del request: los endpoints solo
+encolan IDs de productos.
+"""
+
+from typing import Iterable, List, Optional, Set, Union
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+import asyncio
+import logging
+
+from config import settings
+from database import get_collection
+from models import InventoryAlertStatus
+
+logger = logging.getLogger(__name__)
+
+# Umbral para generar alertas de bajo inventario
+LOW_STOCK_THRESHOLD = 10
+
+# Cantidad máxima de productos evaluados por consulta en modo hook
+EVENT_BATCH_SIZE = 500
+
+# Pipeline del change stream: solo inserciones/reemplazos o updates que tocan el stock
+CHANGE_STREAM_PIPELINE = [
+    {
+        "$match": {
+            "$or": [
+                {"operationType": {"$in": ["insert", "replace"]}},
+                {"updateDescription.updatedFields.stock": {"$exists": True}},
+            ]
+        }
+    }
+]
+
+
+def build_alert_message(product: dict) -> str:
+    return f"El stock del producto '{product['name']}' es bajo ({product['stock']})."
+
+
+class LowStockDetector:
+    """Evalúa cambios de stock en segundo plano y mantiene las alertas al día."""
+
+    def __init__(self, threshold: int = LOW_STOCK_THRESHOLD, queue_size: int = 10000):
+        self.threshold = threshold
+        self.mode: Optional[str] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._pending: Set[ObjectId] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Ciclo de vida ---
+
+    async def start(self) -> None:
+        """Decide la fuente de eventos y lanza la tarea en segundo plano."""
+        mode = settings.INVENTORY_ALERTS_MODE
+        if mode == "off":
+            logger.info("🔕 Detector de bajo stock deshabilitado.")
+            return
+
+        if mode in ("auto", "change_stream") and await self._change_streams_available():
+            self.mode = "change_stream"
+            self._task = asyncio.create_task(self._run_change_stream())
+        elif mode == "change_stream":
+            raise RuntimeError("INVENTORY_ALERTS_MODE=change_stream pero MongoDB no soporta change streams (requiere replica set).")
+        else:
+            self.mode = "events"
+            self._task = asyncio.create_task(self._run_event_queue())
+        logger.info(f"🔔 Detector de bajo stock iniciado (modo: {self.mode}).")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _change_streams_available(self) -> bool:
+        try:
+            stream = get_collection("products").watch(CHANGE_STREAM_PIPELINE, max_await_time_ms=1)
+            await stream.try_next()
+            await stream.close()
+            return True
+        except PyMongoError as e:
+            # Standalone sin replica set (OperationFailure), servidor caído, timeout, etc.
+            logger.info(f"Change streams no disponibles ({e}); se usará el hook de la aplicación.")
+            return False
+
+    # --- Hook de la aplicación ---
+
+    def notify(self, product_ids: Iterable[Union[str, ObjectId]]) -> None:
+        """
+        Encola productos cuyo stock cambió. No bloquea ni hace I/O.
+        En modo change stream no hace nada (los cambios llegan solos).
+        """
+        if self.mode != "events":
+            return
+        for product_id in product_ids:
+            oid = ObjectId(product_id) if not isinstance(product_id, ObjectId) else product_id
+            if oid in self._pending:
+                continue
+            try:
+                self._queue.put_nowait(oid)
+                self._pending.add(oid)
+            except asyncio.QueueFull:
+                logger.warning(f"Cola del detector de bajo stock llena; se descarta el evento de {oid}.")
+                return
+
+    async def _run_event_queue(self) -> None:
+        products_collection = get_collection("products")
+        while True:
+            # Esperar al menos un evento y luego drenar lo acumulado en un solo lote
+            batch = [await self._queue.get()]
+            while len(batch) < EVENT_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._pending.difference_update(batch)
+            try:
+                products = await products_collection.find(
+                    {"_id": {"$in": batch}}, projection={"name": 1, "stock": 1}
+                ).to_list(length=len(batch))
+                await self.evaluate(products)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Cualquier error (documento inválido, Mongo, etc.) se registra y el detector sigue
+                logger.error(f"❌ Error al evaluar alertas de bajo stock: {e}", exc_info=True)
+
+    # --- Change stream ---
+
+    async def _run_change_stream(self) -> None:
+        resume_token = None
+        while True:
+            try:
+                async with get_collection("products").watch(
+                    CHANGE_STREAM_PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=resume_token,
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        product = change.get("fullDocument")
+                        if product:
+                            await self.evaluate([product])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Change stream de productos interrumpido: {e}. Reintentando en 5s...", exc_info=True)
+                await asyncio.sleep(5)
+
+    # --- Evaluación ---
+
+    async def evaluate(self, products: List[dict]) -> None:
+        """
+        Abre/actualiza (upsert) la alerta de los productos con bajo stock y resuelve
+        la alerta abierta de los que ya fueron repuestos. Un solo bulk_write por lote.
+        """
+        now = datetime.utcnow()
+        operations = []
+        for product in products:
+            product_id = str(product["_id"])
+            stock = product.get("stock", 0)
+            if stock <= self.threshold:
+                operations.append(UpdateOne(
+                    {"product_id": product_id, "status": InventoryAlertStatus.OPEN.value},
+                    {
+                        "$set": {
+                            "product_name": product.get("name"),
+                            "current_stock": stock,
+                            "threshold": self.threshold,
+                            "message": build_alert_message(product),
+                            "updated_at": now,
+                        },
+                        "$setOnInsert": {"timestamp": now},
+                    },
+                    upsert=True,
+                ))
+            else:
+                operations.append(UpdateOne(
+                    {"product_id": product_id, "status": InventoryAlertStatus.OPEN.value},
+                    {"$set": {"status": InventoryAlertStatus.RESOLVED.value, "current_stock": stock, "resolved_at": now, "updated_at": now}},
+                ))
+
+        if not operations:
+            return
+        try:
+            result = await get_collection("inventory_alerts").bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Dos upserts concurrentes del mismo producto: el índice único deja solo uno
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+            return
+        if result.upserted_count:
+            logger.warning(f"ALERTA DE INVENTARIO: {result.upserted_count} productos con bajo stock.")
+        if result.modified_count:
+            logger.info(f"Alertas de inventario actualizadas/resueltas: {result.modified_count}.")
+
+
+# Instancia compartida (se inicia desde el lifespan de la app)
+low_stock_detector = LowStockDetector()
+
+# Alertas creadas antes del campo `status` (una por evento, nunca resueltas)
+LEGACY_ALERTS_FILTER = {"status": {"$exists": False}}
+
+
+async def backfill_alert_status(threshold: int = LOW_STOCK_THRESHOLD) -> dict:
+    """
+    Completa `status` en las alertas viejas, que el feed, el resumen, el detector y la
+    retención TTL no ven. La más reciente de cada producto queda "open" si el producto
+    sigue con bajo stock y no tiene ya una alerta abierta; el resto queda "resolved"
+    (con resolved_at = ahora, así las elimina la retención).
+    Devuelve {"opened": n, "resolved": n}.
+    """
+    alerts_collection = get_collection("inventory_alerts")
+    latest = await alerts_collection.aggregate([
+        {"$match": LEGACY_ALERTS_FILTER},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {"_id": "$product_id", "alert_id": {"$first": "$_id"}}},
+    ]).to_list(length=None)
+    if not latest:
+        return {"opened": 0, "resolved": 0}
+
+    product_ids = [doc["_id"] for doc in latest]
+    low_stock = {
+        str(product["_id"]) async for product in get_collection("products").find(
+            {"_id": {"$in": [ObjectId(pid) for pid in product_ids if ObjectId.is_valid(pid)]}, "stock": {"$lte": threshold}},
+            projection={"_id": 1}
+        )
+    }
+    already_open = set(await alerts_collection.distinct(
+        "product_id", {"product_id": {"$in": product_ids}, "status": InventoryAlertStatus.OPEN.value}
+    ))
+    to_open = [doc["alert_id"] for doc in latest if doc["_id"] in low_stock and doc["_id"] not in already_open]
+
+    now = datetime.utcnow()
+    opened = await alerts_collection.update_many(
+        {"_id": {"$in": to_open}, **LEGACY_ALERTS_FILTER},
+        {"$set": {"status": InventoryAlertStatus.OPEN.value, "updated_at": now}}
+    ) if to_open else None
+    resolved = await alerts_collection.update_many(
+        LEGACY_ALERTS_FILTER,
+        {"$set": {"status": InventoryAlertStatus.RESOLVED.value, "resolved_at": now, "updated_at": now}}
+    )
+    summary = {"opened": opened.modified_count if opened else 0, "resolved": resolved.modified_count}
+    logger.info(f"🔔 Alertas sin estado completadas: {summary['opened']} abiertas, {summary['resolved']} resueltas.")
+    return summary
+
+
+def notify_stock_change(product_ids: Iterable[Union[str, ObjectId]]) -> None:
+    """Hook para avisar al detector que el stock de estos productos cambió."""
+    low_stock_detector.notify(product_ids)
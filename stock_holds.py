@@ -0,0 +1,153 @@
+"""
+Reservas blandas de stock al agregar productos al carrito (opcional).
+
+Con CART_RESERVATIONS_ENABLED, agregar o modificar un producto en el carrito
+deja una reserva (hold) con vencimiento en `stock_holds`:
+
+    {"product_id": ObjectId, "user_id": str, "quantity": int, "expires_at": datetime}
+
+- Una sola reserva por (producto, usuario); cada acción sobre el carrito la renueva.
+- Las reservas vencidas las borra el índice TTL de MongoDB; como el TTL corre
+  cada ~60s, las consultas además filtran `expires_at > ahora`.
+- Stock disponible = stock - reservas activas de otros usuarios.
+- Al confirmar el pedido, las reservas del usuario se convierten en el descuento
+  de stock del pedido (se borran después de descontar).
+
+Los totales reservados por producto se cachean unos segundos en el proceso para
+que los listados los usen sin una consulta por producto.
+"""
+
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime, timedelta
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import logging
+
+from catalog_cache import catalog_cache
+from config import settings
+from database import get_collection
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "stock_holds"
+
+
+def _cache_key(product_id: ObjectId) -> tuple:
+    return (CACHE_PREFIX, product_id)
+
+
+async def _aggregate_held(product_ids: List[ObjectId], exclude_user: Optional[str] = None) -> Dict[ObjectId, int]:
+    """Suma de las reservas activas por producto (una sola agregación)."""
+    match: dict = {"product_id": {"$in": product_ids}, "expires_at": {"$gt": datetime.utcnow()}}
+    if exclude_user is not None:
+        match["user_id"] = {"$ne": exclude_user}
+    cursor = get_collection("stock_holds").aggregate([
+        {"$match": match},
+        {"$group": {"_id": "$product_id", "held": {"$sum": "$quantity"}}},
+    ])
+    return {doc["_id"]: doc["held"] async for doc in cursor}
+
+
+async def held_quantities(product_ids: Iterable[ObjectId], exclude_user: Optional[str] = None) -> Dict[ObjectId, int]:
+    """
+    Unidades reservadas por producto.
+    Sin `exclude_user` usa la caché del catálogo (para listados); con `exclude_user`
+    consulta siempre (para validar el carrito o el checkout de ese usuario).
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+    if exclude_user is not None:
+        return await _aggregate_held(product_ids, exclude_user)
+
+    held: Dict[ObjectId, int] = {}
+    missing = []
+    for product_id in product_ids:
+        cached = catalog_cache.get(_cache_key(product_id))
+        if cached is None:
+            missing.append(product_id)
+        else:
+            held[product_id] = cached
+    if missing:
+        loaded = await _aggregate_held(missing)
+        for product_id in missing:
+            held[product_id] = loaded.get(product_id, 0)
+            catalog_cache.set(_cache_key(product_id), held[product_id], settings.CART_HOLDS_CACHE_SECONDS)
+    return held
+
+
+def _invalidate(product_ids: Iterable[ObjectId]) -> None:
+    for product_id in product_ids:
+        catalog_cache.invalidate(_cache_key(product_id))
+
+
+async def place_hold(user_id: str, product: dict, quantity: int) -> int:
+    """
+    Crea o renueva la reserva del usuario sobre un producto por `quantity` unidades.
+    Primero escribe la reserva y después verifica que alcance; si no alcanza la
+    revierte, así dos usuarios no pueden reservar a la vez la última unidad.
+
+    Returns:
+        Stock disponible para este usuario (stock - reservas de otros).
+    Raises:
+        HTTPException 400 si no hay stock disponible suficiente.
+    """
+    holds_collection = get_collection("stock_holds")
+    product_id = product["_id"]
+    now = datetime.utcnow()
+    hold_filter = {"product_id": product_id, "user_id": user_id}
+    update = {"$set": {"quantity": quantity, "expires_at": now + timedelta(minutes=settings.CART_HOLD_MINUTES), "updated_at": now}}
+
+    try:
+        previous = await holds_collection.find_one_and_update(hold_filter, update, upsert=True, return_document=ReturnDocument.BEFORE)
+    except DuplicateKeyError:
+        # Dos acciones simultáneas del mismo usuario: el otro upsert ya creó la reserva
+        previous = await holds_collection.find_one_and_update(hold_filter, update, return_document=ReturnDocument.BEFORE)
+
+    others = (await held_quantities([product_id], exclude_user=user_id)).get(product_id, 0)
+    available = product.get("stock", 0) - others
+    if available < quantity:
+        if previous and previous["expires_at"] > now:
+            await holds_collection.update_one(
+                hold_filter, {"$set": {"quantity": previous["quantity"], "expires_at": previous["expires_at"]}}
+            )
+        else:
+            await holds_collection.delete_one(hold_filter)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Stock insuficiente para el producto '{product['name']}'. Disponibles: {max(available, 0)} unidades (hay unidades reservadas en otros carritos)."
+        )
+
+    _invalidate([product_id])
+    return available
+
+
+async def release_hold(user_id: str, product_id: ObjectId) -> None:
+    """Libera la reserva del usuario sobre un producto."""
+    await get_collection("stock_holds").delete_one({"product_id": product_id, "user_id": user_id})
+    _invalidate([product_id])
+
+
+async def release_user_holds(user_id: str, product_ids: Optional[Iterable[ObjectId]] = None) -> None:
+    """
+    Libera las reservas del usuario (todas o las de `product_ids`).
+    Se usa al vaciar el carrito y al convertir las reservas en un pedido.
+    """
+    query: dict = {"user_id": user_id}
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        query["product_id"] = {"$in": product_ids}
+    else:
+        product_ids = await get_collection("stock_holds").distinct("product_id", {"user_id": user_id})
+    await get_collection("stock_holds").delete_many(query)
+    _invalidate(product_ids)
+
+
+async def with_available_stock(products: List[dict]) -> List[dict]:
+    """Agrega `available_stock` (stock - reservas activas) a documentos de productos."""
+    held = await held_quantities([p["_id"] for p in products])
+    for product in products:
+        product["available_stock"] = max(product.get("stock", 0) - held.get(product["_id"], 0), 0)
+    return products
@@ -0,0 +1,316 @@
+"""
+Stock repartido en contadores (shards) para productos muy demandados.
+
+En una promoción, miles de checkouts concurrentes hacen `$inc` sobre el mismo
+documento de `products` y chocan entre sí. Con este modo (opcional, por
+producto) el stock se reparte en N documentos de `stock_counters`:
+
+    {"_id": ObjectId, "p": ObjectId, "n": int, "stock": int}
+
+- Las compras descuentan de un shard al azar con guarda `$gte` y, si ese no
+  alcanza, prueban los demás (y como último recurso toman de varios a la vez).
+  Nunca se vende más de lo que hay.
+- `products.stock` pasa a ser un total cacheado para los listados; lo actualiza
+  `refresh_sharded_totals` cada STOCK_SHARDS_REFRESH_SECONDS.
+- Cualquier otra escritura sobre `products.stock` (reposiciones, ajustes del
+  admin, cancelaciones) se detecta como diferencia contra `stock_cached` y se
+  incorpora a los shards en el siguiente refresco.
+
+El stock real de un producto en este modo es:
+    suma(shards) + (products.stock - products.stock_cached)
+"""
+
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+import asyncio
+import random
+import logging
+
+from database import get_collection
+from stock_alerts import notify_stock_change
+
+logger = logging.getLogger(__name__)
+
+# Asignación de una reserva: [(shard, cantidad)]
+Allocation = List[Tuple[int, int]]
+
+
+def is_sharded(product: dict) -> bool:
+    return bool(product.get("stock_shards"))
+
+
+def _split(total: int, shards: int) -> List[int]:
+    """Reparte `total` en `shards` partes lo más parejas posible."""
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+# --- Lecturas ---
+
+async def sharded_totals(product_ids: List[ObjectId], session=None) -> Dict[ObjectId, int]:
+    """Suma de los shards de cada producto, con una sola agregación."""
+    if not product_ids:
+        return {}
+    cursor = get_collection("stock_counters").aggregate([
+        {"$match": {"p": {"$in": product_ids}}},
+        {"$group": {"_id": "$p", "stock": {"$sum": "$stock"}}},
+    ], session=session)
+    return {doc["_id"]: doc["stock"] async for doc in cursor}
+
+
+async def current_stock(product: dict) -> int:
+    """Stock exacto de un producto (sume o no sus shards)."""
+    if not is_sharded(product):
+        return product.get("stock", 0)
+    total = (await sharded_totals([product["_id"]])).get(product["_id"], 0)
+    return total + product.get("stock", 0) - product.get("stock_cached", 0)
+
+
+async def compensate_stock_set(products: List[dict], session=None) -> None:
+    """
+    Después de un `$set` de products.stock (ajuste del admin) en productos con shards,
+    descuenta de products.stock lo que hay en los shards, para que el stock real
+    quede igual al valor fijado cuando se incorpore en el próximo refresco.
+    `products` son los documentos con el valor ya fijado y su stock_cached.
+    """
+    sharded = [p for p in products if is_sharded(p)]
+    if not sharded:
+        return
+    totals = await sharded_totals([p["_id"] for p in sharded], session=session)
+    await get_collection("products").bulk_write([
+        UpdateOne({"_id": p["_id"]}, {"$inc": {"stock": p.get("stock_cached", 0) - totals.get(p["_id"], 0)}})
+        for p in sharded
+    ], ordered=False, session=session)
+
+
+# --- Descuento en el camino caliente (checkout) ---
+
+async def reserve_sharded_stock(product_id: ObjectId, shards: int, quantity: int) -> Optional[Allocation]:
+    """
+    Descuenta `quantity` unidades de los shards de un producto.
+    Devuelve la asignación usada, o None si no hay stock suficiente (sin cambios).
+    """
+    counters = get_collection("stock_counters")
+
+    # 1. Un shard al azar y, si no alcanza, los siguientes en orden circular
+    start = random.randrange(shards)
+    for n in [(start + i) % shards for i in range(shards)]:
+        result = await counters.update_one(
+            {"p": product_id, "n": n, "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}}
+        )
+        if result.modified_count:
+            return [(n, quantity)]
+
+    # 2. Ningún shard alcanza solo: tomar de varios, de mayor a menor
+    allocation: Allocation = []
+    remaining = quantity
+    async for counter in counters.find({"p": product_id, "stock": {"$gt": 0}}).sort("stock", -1):
+        take = min(counter["stock"], remaining)
+        result = await counters.update_one(
+            {"_id": counter["_id"], "stock": {"$gte": take}},
+            {"$inc": {"stock": -take}}
+        )
+        if result.modified_count:
+            allocation.append((counter["n"], take))
+            remaining -= take
+        if remaining == 0:
+            return allocation
+
+    # 3. No alcanzó: devolver lo tomado
+    await release_sharded_stock(product_id, allocation)
+    return None
+
+
+async def release_sharded_stock(product_id: ObjectId, allocation: Allocation) -> None:
+    """Devuelve a sus shards una reserva (rollback)."""
+    if not allocation:
+        return
+    await get_collection("stock_counters").bulk_write(
+        [UpdateOne({"p": product_id, "n": n}, {"$inc": {"stock": quantity}}) for n, quantity in allocation],
+        ordered=False
+    )
+
+
+# --- Activación / desactivación (admin) ---
+
+async def enable_stock_shards(product_id: ObjectId, shards: int) -> dict:
+    """
+    Reparte el stock actual del producto en `shards` contadores.
+    Si ya estaba repartido, redistribuye el stock real en la nueva cantidad de shards.
+    """
+    products_collection = get_collection("products")
+    counters = get_collection("stock_counters")
+
+    product = await products_collection.find_one({"_id": product_id})
+    if not product:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
+    if is_sharded(product):
+        await disable_stock_shards(product_id)
+
+    # 1. Crear los contadores vacíos (idempotente)
+    await counters.bulk_write([
+        UpdateOne({"p": product_id, "n": n}, {"$setOnInsert": {"stock": 0}}, upsert=True)
+        for n in range(shards)
+    ], ordered=False)
+
+    # 2. Activar el modo y tomar el stock del documento en la misma escritura.
+    #    stock_cached = 0: todo lo que quede en products.stock se trata como diferencia a repartir.
+    product = await products_collection.find_one_and_update(
+        {"_id": product_id, "stock_shards": {"$exists": False}},
+        {"$set": {"stock_shards": shards, "stock_cached": 0}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not product:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El producto cambió mientras se activaban los shards. Intenta nuevamente.")
+
+    # 3. Repartir el stock en los shards
+    await refresh_sharded_totals([product])
+    logger.info(f"🧩 Stock del producto {product_id} repartido en {shards} shards.")
+    return await products_collection.find_one({"_id": product_id})
+
+
+async def disable_stock_shards(product_id: ObjectId) -> dict:
+    """Vuelve a guardar todo el stock en `products.stock` y borra los contadores."""
+    products_collection = get_collection("products")
+    counters = get_collection("stock_counters")
+
+    # 1. Desactivar primero: las compras nuevas vuelven a descontar de products.stock
+    product = await products_collection.find_one_and_update(
+        {"_id": product_id, "stock_shards": {"$exists": True}},
+        {"$unset": {"stock_shards": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not product:
+        product = await products_collection.find_one({"_id": product_id})
+        if not product:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado.")
+        return product
+
+    # 2. Vaciar cada shard de forma atómica y sumar lo que tenía
+    drained = 0
+    async for counter in counters.find({"p": product_id}, projection={"_id": 1}):
+        previous = await counters.find_one_and_update(
+            {"_id": counter["_id"]}, {"$set": {"stock": 0}}, return_document=ReturnDocument.BEFORE
+        )
+        drained += previous.get("stock", 0) if previous else 0
+
+    # 3. products.stock = total real (lo vaciado + lo escrito directamente desde el último refresco)
+    product = await products_collection.find_one_and_update(
+        {"_id": product_id},
+        {"$inc": {"stock": drained - product.get("stock_cached", 0)}, "$unset": {"stock_cached": ""}},
+        return_document=ReturnDocument.AFTER
+    )
+    await counters.delete_many({"p": product_id})
+    notify_stock_change([product_id])
+    logger.info(f"🧩 Shards de stock desactivados para el producto {product_id} ({drained} unidades devueltas).")
+    return product
+
+
+# --- Refresco del total cacheado ---
+
+async def _absorb_direct_writes(product: dict) -> None:
+    """
+    Mueve a un shard lo escrito directamente en products.stock desde el último refresco.
+    La escritura es condicional al valor leído, así que cada diferencia se mueve una sola vez.
+    """
+    difference = product.get("stock", 0) - product.get("stock_cached", 0)
+    if difference == 0:
+        return
+    taken = await get_collection("products").update_one(
+        {"_id": product["_id"], "stock": product["stock"], "stock_cached": product.get("stock_cached", 0)},
+        {"$set": {"stock": product.get("stock_cached", 0)}}
+    )
+    if not taken.modified_count:
+        return  # Otro proceso ya la movió o hubo una escritura nueva; se reintenta en el próximo refresco
+    counters = get_collection("stock_counters")
+    if difference > 0:
+        # Reposición: repartir entre todos los shards
+        parts = _split(difference, product["stock_shards"])
+        await counters.bulk_write(
+            [UpdateOne({"p": product["_id"], "n": n}, {"$inc": {"stock": part}}) for n, part in enumerate(parts) if part],
+            ordered=False
+        )
+    else:
+        # Descuento hecho fuera de los shards (ej. ajuste del admin): repartirlo entre los shards
+        remaining = await _take_from_shards(product["_id"], -difference)
+        if remaining:
+            # Las compras concurrentes ya vendieron esas unidades: los shards quedan en 0, no en negativo
+            logger.warning(f"⚠️ No se pudieron descontar {remaining} unidades de los shards del producto {product['_id']} (sin stock suficiente).")
+
+
+async def _take_from_shards(product_id: ObjectId, quantity: int) -> int:
+    """
+    Descuenta `quantity` unidades de los shards, de mayor a menor y con guarda `$gte`
+    (igual que el paso 2 de la reserva), sin dejar ninguno en negativo.
+    Devuelve lo que no se pudo descontar porque los shards se quedaron sin stock.
+    """
+    counters = get_collection("stock_counters")
+    remaining = quantity
+    while remaining:
+        shards = await counters.find({"p": product_id, "stock": {"$gt": 0}}).sort("stock", -1).to_list(length=None)
+        if not shards:
+            break
+        for counter in shards:
+            take = min(counter["stock"], remaining)
+            result = await counters.update_one(
+                {"_id": counter["_id"], "stock": {"$gte": take}},
+                {"$inc": {"stock": -take}}
+            )
+            if result.modified_count:
+                remaining -= take
+            if remaining == 0:
+                break
+        # Si alguna guarda falló por una compra concurrente, se relee el estado de los shards
+    return remaining
+
+
+async def refresh_sharded_totals(products: Optional[List[dict]] = None) -> int:
+    """
+    Incorpora las escrituras directas a los shards y guarda la suma en
+    products.stock / stock_cached. Devuelve la cantidad de productos actualizados.
+    """
+    products_collection = get_collection("products")
+    if products is None:
+        products = await products_collection.find(
+            {"stock_shards": {"$exists": True}},
+            projection={"stock": 1, "stock_cached": 1, "stock_shards": 1}
+        ).to_list(length=None)
+    if not products:
+        return 0
+
+    for product in products:
+        await _absorb_direct_writes(product)
+
+    totals = await sharded_totals([p["_id"] for p in products])
+    now = datetime.utcnow()
+    changed = []
+    for product in products:
+        total = totals.get(product["_id"], 0)
+        if total == product.get("stock_cached") and product.get("stock") == total:
+            continue
+        # Condicional: si hubo una escritura directa en el medio, la toma el próximo refresco
+        result = await products_collection.update_one(
+            {"_id": product["_id"], "stock": product.get("stock_cached", 0), "stock_shards": {"$exists": True}},
+            {"$set": {"stock": total, "stock_cached": total, "stock_refreshed_at": now}}
+        )
+        if result.modified_count:
+            changed.append(product["_id"])
+
+    notify_stock_change(changed)
+    return len(changed)
+
+
+async def stock_shards_refresh_loop(interval_seconds: int) -> None:
+    """Refresca periódicamente los totales cacheados (se lanza desde el lifespan de la app)."""
+    while True:
+        try:
+            await refresh_sharded_totals()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error al refrescar el stock repartido en shards: {e}", exc_info=True)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,369 @@
+"""
+Trazas distribuidas livianas (opt-in con TRACING_ENABLED).
+
+- `TracingMiddleware` abre un span por solicitud. Si llega un header W3C
+  `traceparent` se continúa esa traza; la respuesta devuelve el `traceparent`
+  del span de la solicitud.
+- Spans hijos: cada comando de Motor (`TracingCommandListener`, registrado por
+  database.client_options), cada llamada a Redis (`instrument_redis`, incluye
+  el rate limiter) y cada llamada HTTP a Mercado Pago (payment_gateway.py, que
+  además propaga el `traceparent`).
+- Muestreo en la cabecera: la decisión se toma al abrir la solicitud
+  (TRACING_SAMPLE_RATE, o la tasa del primer prefijo de ruta que coincida en
+  TRACING_ROUTE_SAMPLE_RATES) o se hereda del `traceparent` entrante. En una
+  solicitud descartada los spans hijos no se crean: solo se lee un contextvar.
+- Exportación en un hilo aparte, por lotes: a un archivo JSON lines
+  (TRACING_EXPORTER=file) o por OTLP/HTTP JSON a un collector
+  (TRACING_EXPORTER=otlp; ver scripts/fake_otlp_collector.py). La cola es
+  acotada: si el exportador no da abasto se descartan los spans más viejos.
+
+Las tareas en segundo plano no se trazan (no tienen una solicitud como raíz).
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from pymongo import monitoring
+
+from config import settings
+from db_monitoring import IGNORED_COMMANDS, command_collection, current_route
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = b"traceparent"
+# Tipos de span de OTLP
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+def _new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str], sampled: bool = True, attributes: Optional[dict] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# Span en curso (None: sin traza o fuera de una solicitud)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(value: str):
+    """(trace_id, parent_span_id, sampled) de un header traceparent, o None si es inválido."""
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[0] == "ff":
+        return None
+    trace_id, parent_id, flags = parts[1], parts[2], parts[3]
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    return trace_id, parent_id, sampled
+
+
+def parse_route_sample_rates(value: str) -> list:
+    """'/payments=1.0,/orders=0.2' -> [('/payments', 1.0), ('/orders', 0.2)] (prefijos más largos primero)."""
+    rates = []
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        prefix, rate = item.split("=", 1)
+        rates.append((prefix.strip(), float(rate)))
+    return sorted(rates, key=lambda entry: len(entry[0]), reverse=True)
+
+
+class SpanExporter:
+    """Cola acotada de spans terminados y un hilo que los exporta por lotes."""
+
+    def __init__(self):
+        self._queue = deque(maxlen=settings.TRACING_MAX_QUEUE_SIZE)
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session = requests.Session()
+        self.dropped = 0
+        self.exported = 0
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=settings.TRACING_EXPORT_INTERVAL_SECONDS + 5)
+            self._thread = None
+
+    def submit(self, span: Span) -> None:
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(span)
+        if len(self._queue) >= settings.TRACING_EXPORT_BATCH_SIZE:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(settings.TRACING_EXPORT_INTERVAL_SECONDS)
+            self._wake.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self) -> None:
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < settings.TRACING_EXPORT_BATCH_SIZE:
+                batch.append(self._queue.popleft().to_otlp())
+            try:
+                self._export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"⚠️ No se pudieron exportar {len(batch)} spans: {e}")
+
+    def _export(self, spans: list) -> None:
+        if settings.TRACING_EXPORTER == "file":
+            with open(settings.TRACING_FILE_PATH, "a", encoding="utf-8") as file:
+                file.writelines(json.dumps(span) + "\n" for span in spans)
+            return
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": settings.TRACING_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]}
+        response = self._session.post(settings.TRACING_OTLP_ENDPOINT, json=payload, timeout=5)
+        response.raise_for_status()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = settings.TRACING_ENABLED
+        self.sample_rate = settings.TRACING_SAMPLE_RATE
+        self.route_sample_rates = parse_route_sample_rates(settings.TRACING_ROUTE_SAMPLE_RATES)
+        self.exporter = SpanExporter()
+
+    def start(self) -> None:
+        if self.enabled:
+            self.exporter.start()
+            logger.info(f"🧵 Trazas activas (muestreo {self.sample_rate:.0%}, exportador: {settings.TRACING_EXPORTER}).")
+
+    def stop(self) -> None:
+        if self.enabled:
+            self.exporter.stop()
+
+    def should_sample(self, route: str) -> bool:
+        rate = self.sample_rate
+        for prefix, prefix_rate in self.route_sample_rates:
+            if route.startswith(prefix):
+                rate = prefix_rate
+                break
+        return random.random() < rate
+
+    def start_child(self, name: str, kind: str = "internal", attributes: Optional[dict] = None) -> Optional[Span]:
+        """Span hijo del span en curso, o None si la solicitud no se está trazando."""
+        parent = current_span.get()
+        if parent is None or not parent.sampled:
+            return None
+        return Span(name, kind, parent.trace_id, parent.span_id, attributes=attributes)
+
+    def finish(self, span: Span, error: Optional[str] = None) -> None:
+        span.end_ns = time.time_ns()
+        span.error = error
+        if span.sampled:
+            self.exporter.submit(span)
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", attributes: Optional[dict] = None):
+        """Context manager para un span hijo; entrega None si la solicitud no se traza."""
+        span = self.start_child(name, kind, attributes)
+        if span is None:
+            yield None
+            return
+        token = current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_span.reset(token)
+            self.finish(span, error)
+
+    def outgoing_headers(self) -> dict:
+        """Header traceparent para propagar la traza en curso (vacío si no hay)."""
+        span = current_span.get()
+        return {"traceparent": span.traceparent()} if span is not None else {}
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """Span por solicitud; va dentro de RequestMetricsMiddleware para conocer la plantilla de la ruta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == TRACEPARENT_HEADER:
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+
+        route = current_route.get()
+        if incoming and settings.TRACING_RESPECT_PARENT_SAMPLED:
+            sampled = incoming[2]
+        else:
+            sampled = tracer.should_sample(route)
+        if not sampled and incoming is None:
+            # Descartada y sin traza entrante: nada que registrar ni propagar
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        span = Span(
+            f"{method} {route}", "server",
+            trace_id=incoming[0] if incoming else _new_trace_id(),
+            parent_id=incoming[1] if incoming else None,
+            sampled=sampled,
+            attributes={"http.method": method, "http.route": route, "http.target": scope["path"]},
+        )
+        traceparent = span.traceparent().encode()
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                message = {**message, "headers": [*message.get("headers", []), (TRACEPARENT_HEADER, traceparent)]}
+            await send(message)
+
+        token = current_span.set(span)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_traceparent)
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_span.reset(token)
+            if error is None and span.attributes.get("http.status_code", 500) >= 500:
+                error = f"HTTP {span.attributes.get('http.status_code', 500)}"
+            tracer.finish(span, error)
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """
+    Span por comando de MongoDB. Corre en los hilos del executor de Motor, que
+    propagan los contextvars de la solicitud.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = command_collection(event.command_name, event.command)
+        span = tracer.start_child(
+            f"mongodb {event.command_name} {collection or event.database_name}", "client",
+            {"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name,
+             "db.mongodb.collection": collection or ""},
+        )
+        if span is not None:
+            self._in_flight[(event.request_id, event.connection_id)] = span
+
+    def succeeded(self, event):
+        span = self._in_flight.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            tracer.finish(span)
+
+    def failed(self, event):
+        span = self._in_flight.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            tracer.finish(span, str(event.failure.get("errmsg", "error")))
+
+
+tracing_command_listener = TracingCommandListener()
+
+
+def instrument_redis(client) -> None:
+    """Envuelve `execute_command` del cliente de redis.asyncio para crear un span por comando."""
+    execute_command = client.execute_command
+
+    async def traced_execute_command(*args, **options):
+        span = tracer.start_child(f"redis {args[0]}", "client", {"db.system": "redis", "db.operation": str(args[0])})
+        if span is None:
+            return await execute_command(*args, **options)
+        error = None
+        try:
+            return await execute_command(*args, **options)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            tracer.finish(span, error)
+
+    client.execute_command = traced_execute_command